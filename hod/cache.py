@@ -0,0 +1,174 @@
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+# #
+"""
+Cache for values which are expensive to obtain (e.g. queries to the resource
+manager), stored in a JSON file so it can be shared between hod invocations.
+"""
+import errno
+import fcntl
+import json
+import os
+import time
+
+from vsc.utils import fancylogger
+
+_log = fancylogger.getLogger(fname=False)
+
+
+class JsonCache(object):
+    """
+    Cache of JSON serializable values by key, stored in a file.
+
+    Values are fresh for ttl seconds after they were stored. Stale values are
+    still returned for max_stale more seconds, while the value is obtained
+    again in a background process (stale-while-revalidate). Older values are
+    obtained again right away.
+
+    The cache is best effort: failing to store a value is not an error.
+    """
+    def __init__(self, path, ttl, max_stale=0):
+        self.path = path
+        self.ttl = ttl
+        self.max_stale = max_stale
+
+    def _load(self):
+        '''Return dict with all cache entries.'''
+        try:
+            with open(self.path) as fh:
+                entries = json.load(fh)
+        except (IOError, ValueError):
+            return dict()
+        if not isinstance(entries, dict):
+            return dict()
+        return entries
+
+    def _save(self, entries):
+        '''Store the cache entries in the cache file (atomically).'''
+        tmp_path = '%s.%d' % (self.path, os.getpid())
+        try:
+            cache_dir = os.path.dirname(self.path)
+            if cache_dir and not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            with open(tmp_path, 'w') as fh:
+                json.dump(entries, fh)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as err:
+            _log.debug("Failed to write cache file %s: %s", self.path, err)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _age(self, entry):
+        '''Return age of cache entry in seconds; None if it is unusable.'''
+        try:
+            age = time.time() - entry['time']
+        except (KeyError, TypeError):
+            return None
+        if age < 0:
+            # stored in the future (clock skew?)
+            return None
+        return age
+
+    def get(self, key, obtain, keep=None):
+        '''
+        Return value for key from the cache. If it's not in the cache (or too
+        old), obtain() is called to get it, and the result is stored (unless
+        keep is specified and keep(result) is False, e.g. for a value which is
+        likely due to a temporary failure).
+        '''
+        entry = self._load().get(key)
+        age = None if entry is None else self._age(entry)
+        if age is not None:
+            if age < self.ttl:
+                return entry['value']
+            if age < self.ttl + self.max_stale:
+                _log.debug("Cached value for %s in %s is stale (%.1fs), revalidating", key, self.path, age)
+                self._revalidate(key, obtain, keep=keep)
+                return entry['value']
+        return self.refresh(key, obtain, keep=keep)
+
+    def set(self, key, value):
+        '''Store value for key in the cache.'''
+        entries = self._load()
+        entries[key] = {'time': time.time(), 'value': value}
+        self._save(entries)
+
+    def refresh(self, key, obtain, keep=None):
+        '''Obtain the value for key, store it in the cache (see get) and return it.'''
+        value = obtain()
+        if keep is None or keep(value):
+            self.set(key, value)
+        else:
+            _log.debug("Not caching value %s for %s in %s", value, key, self.path)
+        return value
+
+    def invalidate(self, *keys):
+        '''Remove the specified keys from the cache; all keys if none are specified.'''
+        if keys:
+            entries = self._load()
+            for key in keys:
+                entries.pop(key, None)
+            self._save(entries)
+        else:
+            try:
+                os.remove(self.path)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+
+    def _revalidate(self, key, obtain, keep=None):
+        '''
+        Refresh the value for key in a (detached) background process, unless
+        another process is already doing that.
+        '''
+        try:
+            pid = os.fork()
+        except OSError as err:
+            _log.debug("Failed to fork for revalidating %s: %s", key, err)
+            return
+        if pid:
+            # reap the intermediate child, the grandchild is adopted by init
+            os.waitpid(pid, 0)
+            return
+
+        try:
+            if os.fork():
+                os._exit(0)
+            # don't hold on to stdout/stderr of the parent (e.g. a pipe)
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in range(3):
+                os.dup2(devnull, fd)
+            with open('%s.lock' % self.path, 'a') as lock:
+                try:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    # already being revalidated
+                    os._exit(0)
+                entry = self._load().get(key)
+                age = None if entry is None else self._age(entry)
+                if age is None or age >= self.ttl:
+                    self.refresh(key, obtain, keep=keep)
+        except Exception as err:
+            _log.debug("Failed to revalidate %s: %s", key, err)
+        os._exit(0)
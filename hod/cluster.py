@@ -28,15 +28,21 @@ Cluster and label functions.
 @author: Kenneth Hoste (Universiteit Gent)
 """
 
+import ConfigParser
+import copy
+import errno
+import fcntl
+import json
 import os
 import sys
 import shutil
+import time
 from collections import namedtuple
+from contextlib import contextmanager
 
 from vsc.utils import fancylogger
 
-from hod.config.config import resolve_config_paths
-import hod.config.config as hc
+from hod.cache import JsonCache
 
 
 _log = fancylogger.getLogger(fname=False)
@@ -68,6 +74,55 @@ module list 2>&1
 
 ClusterInfo = namedtuple('ClusterInfo', 'label, jobid, pbsjob')
 
+# index of the cluster info directories (in the cluster info dir),
+# so the cluster info can be looked up without scanning all directories
+CLUSTER_INDEX_FILE = '.index.json'
+CLUSTER_INDEX_LOCK = '.index.lock'
+CLUSTER_INDEX_VERSION = 1
+
+# file in the cluster info directory which is created once all services of the cluster were started
+CLUSTER_READY_FILE = 'ready'
+# file in the cluster info directory with the latest resource usage of the services, see 'hod top'
+CLUSTER_USAGE_FILE = 'top'
+
+# cluster index read by this process, by path; see _read_cluster_index
+_CLUSTER_INDEX_CACHE = dict()
+
+# directory in the cluster info dir with the caches; updating them in the cluster info dir
+# itself would change its modification time, and hence invalidate the cluster index
+CLUSTER_CACHE_DIR = '.cache'
+
+# cache of the state of the jobs of the user (in the cache dir), see pbs_job_states;
+# the state is fresh for HOD_JOB_STATE_TTL seconds, and is used (while it is updated in
+# the background) for HOD_JOB_STATE_MAX_STALE more seconds
+JOB_STATE_CACHE_FILE = 'jobstate.json'
+JOB_STATE_TTL_ENV = 'HOD_JOB_STATE_TTL'
+JOB_STATE_MAX_STALE_ENV = 'HOD_JOB_STATE_MAX_STALE'
+DEFAULT_JOB_STATE_TTL = 10
+DEFAULT_JOB_STATE_MAX_STALE = 60
+
+# cache of the shape of the nodes (number of cores) per queue/partition (in the cache dir),
+# used to determine the ppn for full nodes (see rm_pbs.Pbs.get_ppn); fresh for HOD_NODE_SHAPE_TTL
+# seconds, and used (while it is updated in the background) for HOD_NODE_SHAPE_MAX_STALE more seconds
+NODE_SHAPE_CACHE_FILE = 'nodeshape.json'
+NODE_SHAPE_TTL_ENV = 'HOD_NODE_SHAPE_TTL'
+NODE_SHAPE_MAX_STALE_ENV = 'HOD_NODE_SHAPE_MAX_STALE'
+DEFAULT_NODE_SHAPE_TTL = 3600
+DEFAULT_NODE_SHAPE_MAX_STALE = 86400
+
+# settings which can be specified per cluster in a cluster manifest (see cluster_manifest_args),
+# with the corresponding command line option of 'hod create'/'hod batch'
+CLUSTER_MANIFEST_OPTIONS = {
+    'account': 'job-account',
+    'nodes': 'job-nodes',
+    'ppn': 'job-ppn',
+    'queue': 'job-queue',
+    'reservation': 'job-reservation',
+    'walltime': 'job-walltime',
+    'workdir': 'workdir',
+}
+
+
 def is_valid_label(label):
     """
     Checks if a label provided on the command line is a valid filename by making
@@ -102,6 +157,8 @@ def validate_hodconf_or_dist(hodconf, dist):
     If it cannot be resolved, an error is logged and false is returned..
     """
     try:
+        # imported here, since the config stack pulls in the node discovery (netifaces, netaddr)
+        from hod.config.config import resolve_config_paths
         resolve_config_paths(hodconf, dist)
     except ValueError as e:
         _log.error(e)
@@ -119,6 +176,40 @@ def report_cluster_submission(label):
         print "Submitting HOD cluster with label '%s'..." % label
 
 
+def cluster_manifest_args(path, manifest_options=None):
+    """
+    Read the cluster manifest in path: a config file with a section for each
+    cluster to submit, named after its label. The options in a section (or in
+    the DEFAULT section) override the command line options for that cluster,
+    see CLUSTER_MANIFEST_OPTIONS.
+    Returns list of (label, args) tuples in the order of the manifest, with
+    args the extra command line arguments for the cluster.
+    """
+    if manifest_options is None:
+        manifest_options = CLUSTER_MANIFEST_OPTIONS
+
+    parser = ConfigParser.RawConfigParser()
+    try:
+        if not parser.read(path):
+            raise ValueError("Failed to read cluster manifest %s" % path)
+    except ConfigParser.Error as err:
+        raise ValueError("Failed to parse cluster manifest %s: %s" % (path, err))
+
+    clusters = []
+    for label in parser.sections():
+        args = ['--label=%s' % label]
+        for key, value in parser.items(label):
+            if key not in manifest_options:
+                raise ValueError("Unknown option '%s' for cluster '%s' in cluster manifest %s (known options: %s)" %
+                                 (key, label, path, ', '.join(sorted(manifest_options))))
+            args.append('--%s=%s' % (manifest_options[key], value))
+        clusters.append((label, args))
+
+    if not clusters:
+        raise ValueError("No clusters found in cluster manifest %s" % path)
+    return clusters
+
+
 def cluster_info_dir():
     """
     Determine cluster info directory.
@@ -129,22 +220,128 @@ def cluster_info_dir():
     return os.path.join(os.getenv('XDG_CONFIG_HOME', dflt), 'hod.d')
 
 
-def known_cluster_labels():
+def _read_cluster_entry(info_dir):
+    """Return dict with jobid and workdir (None if unknown) from the cluster info directory."""
+    entry = dict()
+    for key in ('jobid', 'workdir'):
+        try:
+            with open(os.path.join(info_dir, key)) as info_file:
+                entry[key] = info_file.read()
+        except IOError:
+            entry[key] = None
+    return entry
+
+
+def _scan_cluster_info_dir(path):
+    """Return cluster index for path by scanning all cluster info directories in it."""
+    clusters = dict()
+    for entry in os.listdir(path):
+        if entry.startswith('.'):
+            continue
+        if os.path.isdir(os.path.join(path, entry)):
+            clusters[entry] = _read_cluster_entry(os.path.join(path, entry))
+        else:
+            _log.error("Found unexpected non-directory element in %s: %s", path, entry)
+    return clusters
+
+
+@contextmanager
+def _cluster_index_lock(path, operation):
+    """Context manager which holds a lock (fcntl.LOCK_SH or fcntl.LOCK_EX) on the cluster index in path."""
+    with open(os.path.join(path, CLUSTER_INDEX_LOCK), 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), operation)
+        yield
+
+
+def _read_cluster_index(path):
     """
-    Return list of known cluster labels.
+    Read the cluster index for path; the caller must hold a lock on it.
+    Returns None if the index is missing, corrupt or out of date, i.e. when
+    cluster info directories were added or removed without updating it (e.g.
+    by an older hod version).
+    """
+    index_path = os.path.join(path, CLUSTER_INDEX_FILE)
+    try:
+        dir_mtime = os.stat(path).st_mtime
+        index_stat = os.stat(index_path)
+    except OSError:
+        return None
+
+    key = (dir_mtime, index_stat.st_ino, index_stat.st_mtime, index_stat.st_size)
+    cached = _CLUSTER_INDEX_CACHE.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    try:
+        with open(index_path) as index_file:
+            index = json.load(index_file)
+    except (IOError, ValueError) as err:
+        _log.debug("Failed to read cluster index %s: %s", index_path, err)
+        return None
+    if index.get('version') != CLUSTER_INDEX_VERSION or index.get('mtime') != dir_mtime:
+        return None
+
+    clusters = dict()
+    for label, entry in index['clusters'].items():
+        clusters[label.encode('utf-8')] = dict([(str(k), None if v is None else v.encode('utf-8'))
+                                                for k, v in entry.items()])
+    _CLUSTER_INDEX_CACHE[path] = (key, clusters)
+    return clusters
+
+
+def _write_cluster_index(path, clusters):
+    """Write the cluster index for path; the caller must hold an exclusive lock on it."""
+    # write in place (readers hold a shared lock), so the cluster info dir is not modified
+    # and its modification time can be used to tell whether the index is up to date
+    with open(os.path.join(path, CLUSTER_INDEX_FILE), 'w') as index_file:
+        dir_mtime = os.stat(path).st_mtime
+        json.dump({'version': CLUSTER_INDEX_VERSION, 'mtime': dir_mtime, 'clusters': clusters}, index_file)
+
+
+@contextmanager
+def _updated_cluster_index(path):
+    """
+    Context manager which yields the cluster index for path, to be updated
+    together with the cluster info directories, and writes it back afterwards.
+    An exclusive lock on the index is held in the mean time.
+    The cluster index is a dict with jobid and workdir of the clusters, by label.
     """
-    res = []
+    with _cluster_index_lock(path, fcntl.LOCK_EX):
+        clusters = _read_cluster_index(path)
+        if clusters is None:
+            _log.debug("(Re)building cluster index for %s", path)
+            clusters = _scan_cluster_info_dir(path)
+        else:
+            clusters = copy.deepcopy(clusters)
+        yield clusters
+        _write_cluster_index(path, clusters)
+
+
+def _cluster_index():
+    """Return the cluster index for the cluster info dir; see _updated_cluster_index."""
     path = cluster_info_dir()
-    if os.path.exists(path):
-        for entry in os.listdir(path):
-            if os.path.isdir(os.path.join(path, entry)):
-                res.append(entry)
-            else:
-                _log.error("Found unexpected non-directory element in %s: %s", path, entry)
-    else:
+    if not os.path.exists(path):
         _log.warning("No cluster config directory '%s' (yet)", path)
+        return dict()
+
+    try:
+        with _cluster_index_lock(path, fcntl.LOCK_SH):
+            clusters = _read_cluster_index(path)
+        if clusters is None:
+            with _updated_cluster_index(path) as clusters:
+                pass
+    except (IOError, OSError) as err:
+        _log.warning("Failed to use cluster index for %s, scanning it instead: %s", path, err)
+        clusters = _scan_cluster_info_dir(path)
+
+    return clusters
 
-    return res
+
+def known_cluster_labels():
+    """
+    Return list of known cluster labels.
+    """
+    return sorted(_cluster_index().keys())
 
 def _cluster_info(label, info_file):
     """
@@ -163,14 +360,83 @@ def _cluster_info(label, info_file):
         raise ValueError("Unknown cluster label '%s': %s" % (label, labels))
 
 
+def _indexed_cluster_info(label, info_file):
+    """Return contents of specified cluster info file, using the cluster index if possible."""
+    value = _cluster_index().get(label, {}).get(info_file)
+    if value is None:
+        value = open(_cluster_info(label, info_file)).read()
+    return value
+
+
+def _env_seconds(name, default):
+    """Return number of seconds specified by environment variable with given name."""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        _log.warning("Ignoring invalid value for $%s: %s", name, os.getenv(name))
+        return default
+
+
+def cluster_cache_dir():
+    """Return the directory with the caches in the cluster info directory."""
+    return os.path.join(cluster_info_dir(), CLUSTER_CACHE_DIR)
+
+
+def _job_state_cache():
+    """Return the job state cache."""
+    path = os.path.join(cluster_cache_dir(), JOB_STATE_CACHE_FILE)
+    ttl = _env_seconds(JOB_STATE_TTL_ENV, DEFAULT_JOB_STATE_TTL)
+    max_stale = _env_seconds(JOB_STATE_MAX_STALE_ENV, DEFAULT_JOB_STATE_MAX_STALE)
+    return JsonCache(path, ttl, max_stale)
+
+
+def pbs_job_states(options, fresh=False):
+    """
+    Return list of PbsJob instances for the jobs of the current user.
+    The job state cache is used, unless fresh is True; the state is then
+    obtained from the pbs server (and stored in the cache).
+    """
+    import hod.rmscheduler.rm_pbs as rm_pbs
+
+    def obtain():
+        """Query the pbs server."""
+        return [[job.jobid, job.state, job.hosts] for job in rm_pbs.Pbs(options).state()]
+
+    cache = _job_state_cache()
+    master = rm_pbs.master_hostname()
+    if fresh:
+        jobs = cache.refresh(master, obtain)
+    else:
+        jobs = cache.get(master, obtain)
+
+    def _str(value):
+        """Return value from JSON as a (non-unicode) string."""
+        return None if value is None else str(value)
+
+    return [rm_pbs.PbsJob(*[_str(x) for x in job]) for job in jobs]
+
+
+def node_shape_cache():
+    """Return the cache of the shape of the nodes per queue/partition."""
+    path = os.path.join(cluster_cache_dir(), NODE_SHAPE_CACHE_FILE)
+    ttl = _env_seconds(NODE_SHAPE_TTL_ENV, DEFAULT_NODE_SHAPE_TTL)
+    max_stale = _env_seconds(NODE_SHAPE_MAX_STALE_ENV, DEFAULT_NODE_SHAPE_MAX_STALE)
+    return JsonCache(path, ttl, max_stale)
+
+
+def invalidate_pbs_job_states():
+    """Discard the cached state of the jobs of the current user, e.g. after submitting or deleting a job."""
+    _job_state_cache().invalidate()
+
+
 def cluster_jobid(label):
     """Return job ID for cluster with specified label."""
-    return open(_cluster_info(label, 'jobid')).read()
+    return _indexed_cluster_info(label, 'jobid')
 
 
 def cluster_workdir(label):
     """Return workdir for cluster with specified label."""
-    return os.path.expandvars(open(_cluster_info(label, 'workdir')).read())
+    return os.path.expandvars(_indexed_cluster_info(label, 'workdir'))
 
 
 def _find_pbsjob(jobid, pbsjobs):
@@ -188,13 +454,17 @@ def mk_cluster_info_dict(labels, pbsjobs, master=None):
     info = []
     seen_jobs = set()
 
+    pbsjobs_by_id = dict()
+    for job in pbsjobs:
+        pbsjobs_by_id.setdefault(job.jobid, job)
+
     # All the clusters with labels
     for label in labels:
         try:
             jobid = cluster_jobid(label)
             if master is not None and not jobid.endswith(master):
                 continue
-            job = _find_pbsjob(jobid, pbsjobs)
+            job = pbsjobs_by_id.get(jobid)
             if job is not None:
                 seen_jobs.add(jobid)
         except ValueError as err:
@@ -222,7 +492,9 @@ def generate_cluster_env_script(cluster_info):
 def gen_cluster_info(label, options):
     """Generate cluster info as a dict, intended to use as template values for CLUSTER_ENV_TEMPLATE."""
     # list of modules that should be loaded: modules for selected service + extra modules specified via --modules
-    config_path = resolve_config_paths(options.hodconf, options.dist)
+    import hod.config.config as hc
+
+    config_path = hc.resolve_config_paths(options.hodconf, options.dist)
     hodconf = hc.load_hod_config(config_path, options.workdir, options.modulepaths, options.modules)
     cluster_info = {
         'hadoop_conf_dir': hodconf.configdir,
@@ -235,13 +507,11 @@ def gen_cluster_info(label, options):
     return cluster_info
 
 
-def mk_cluster_info(label, jobid, workdir):
+def _write_cluster_info_files(clusters, label, jobid, workdir):
     """
-    Given a label and PbsJob, create the hod.d/<label> directory.
-    This is created after the job is submitted, but before the job is run.
+    Create the hod.d/<label> directory with the jobid and workdir files, and
+    add it to the cluster index (clusters); see _updated_cluster_index.
     """
-    if label is None:
-        label = jobid
     info_dir = os.path.join(cluster_info_dir(), label)
     try:
         if not os.path.exists(info_dir):
@@ -264,6 +534,32 @@ def mk_cluster_info(label, jobid, workdir):
         _log.error("Failed to write workdir file: %s", err)
         raise
 
+    clusters[label] = {'jobid': jobid, 'workdir': workdir}
+
+
+def mk_cluster_info(label, jobid, workdir):
+    """
+    Given a label and PbsJob, create the hod.d/<label> directory.
+    This is created after the job is submitted, but before the job is run.
+    """
+    mk_cluster_infos([(label, jobid, workdir)])
+
+
+def mk_cluster_infos(submitted):
+    """
+    Create the hod.d/<label> directories for a list of (label, jobid, workdir)
+    tuples, updating the cluster index only once.
+    """
+    path = cluster_info_dir()
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    with _updated_cluster_index(path) as clusters:
+        for label, jobid, workdir in submitted:
+            if label is None:
+                label = jobid
+            _write_cluster_info_files(clusters, label, jobid, workdir)
+
 
 def save_cluster_info(cluster_info):
     """
@@ -282,6 +578,37 @@ def save_cluster_info(cluster_info):
     with open(os.path.join(info_dir, 'env'), 'w') as env_script:
         env_script.write(env_script_txt)
 
+    mark_cluster_ready(cluster_info['label'], ready=False)
+
+
+def cluster_ready_file(label):
+    """Return path to file which marks that the cluster with specified label is ready."""
+    return os.path.join(cluster_info_dir(), label, CLUSTER_READY_FILE)
+
+
+def cluster_usage_file(label):
+    """Return path to file with the resource usage of the cluster with specified label (see hod.monitor)."""
+    return os.path.join(cluster_info_dir(), label, CLUSTER_USAGE_FILE)
+
+
+def mark_cluster_ready(label, ready=True):
+    """
+    Mark the cluster with specified label as ready (i.e. all services were
+    started) or not, by creating or removing its ready file.
+    """
+    ready_file = cluster_ready_file(label)
+    if ready:
+        tmp_path = '%s.%d' % (ready_file, os.getpid())
+        with open(tmp_path, 'w') as fh:
+            fh.write('%s\n' % time.time())
+        os.rename(tmp_path, ready_file)
+    else:
+        try:
+            os.remove(ready_file)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
 
 def clean_cluster_info(master, cluster_info):
     """
@@ -303,7 +630,9 @@ def cluster_info_exists(label):
 def rm_cluster_info(label):
     """Remove a cluster label directory"""
     info_dir = os.path.join(cluster_info_dir(), label)
-    shutil.rmtree(info_dir)
+    with _updated_cluster_index(cluster_info_dir()) as clusters:
+        shutil.rmtree(info_dir)
+        clusters.pop(label, None)
     print 'Removed cluster info directory %s for cluster labeled %s' % (info_dir, label)
 
 
@@ -324,7 +653,12 @@ def mv_cluster_info(label, newlabel):
     cid = cluster_info_dir()
     labeldir = os.path.join(cid, label)
     newlabeldir = os.path.join(cid, newlabel)
-    shutil.move(labeldir, newlabeldir)
+    with _updated_cluster_index(cid) as clusters:
+        shutil.move(labeldir, newlabeldir)
+        entry = clusters.pop(label, None)
+        if entry is None:
+            entry = _read_cluster_entry(newlabeldir)
+        clusters[newlabel] = entry
 
 
 def post_job_submission(label, jobs, workdir):
@@ -339,8 +673,43 @@ def post_job_submission(label, jobs, workdir):
         sys.stderr.write('Warning: More than one job found: %s\n' % str([j.jobid for j in jobs]))
     job = jobs[0]
     print "Job submitted: %s" % str(job)
+    invalidate_pbs_job_states()
     try:
         mk_cluster_info(label, job.jobid, workdir)
     except (IOError, OSError) as e:
         sys.stderr.write('Failed to write out cluster files. You will not be able to use `hod connect "%s"`: %s.\n' % (label, e))
         sys.exit(1)
+
+
+def post_jobs_submission(submitted, options):
+    """
+    Report the jobs for the clusters in a cluster manifest that have been
+    submitted by create and batch, and write all their hod.d/ files at once.
+    submitted is a list of (label, jobid, workdir) tuples, with jobid None
+    if the submission failed.
+    """
+    invalidate_pbs_job_states()
+    pbsjobs = pbs_job_states(options, fresh=True)
+
+    clusters = []
+    failed = False
+    for label, jobid, workdir in submitted:
+        job = _find_pbsjob(jobid, pbsjobs)
+        if jobid is None:
+            # submission failed, error was already reported
+            failed = True
+        elif job is None:
+            sys.stderr.write("Error: No job found after submission of cluster '%s'.\n" % label)
+            failed = True
+        else:
+            print "Job submitted: %s" % str(job)
+            clusters.append((label, job.jobid, workdir))
+
+    try:
+        mk_cluster_infos(clusters)
+    except (IOError, OSError) as e:
+        sys.stderr.write('Failed to write out cluster files. You will not be able to use `hod connect`: %s.\n' % e)
+        sys.exit(1)
+
+    if failed:
+        sys.exit(1)
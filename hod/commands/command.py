@@ -32,10 +32,13 @@ TODO: acutally use vsc.utils.run here
 
 @author: Jens Timmerman, Stijn De Weirdt
 """
+from collections import deque
 from subprocess import Popen, PIPE
-import datetime
+import errno
+import fcntl
 import os
 import pty
+import select
 import signal
 import time
 
@@ -45,28 +48,91 @@ from vsc.utils import fancylogger
 COMMAND_TIMEOUT = 120  # timeout in seconds
 NO_TIMEOUT = None # No timeout
 
-TIMEOUT_POLL_TIME = 1
-NO_TIMEOUT_POLL_TIME = 10
+# daemons started in the background by a command may keep its pipes open, so
+# we can't rely on end of file alone to detect that the command exited: check
+# for exit with an interval that starts small and backs off up to a maximum
+MIN_EXIT_CHECK_INTERVAL = 0.01
+MAX_EXIT_CHECK_INTERVAL = 1
+# time between sending SIGTERM and SIGKILL after a timeout
+KILL_GRACE_TIME = 1
+
+READ_SIZE = 64 * 1024
+OUTPUT_BUFFER_SIZE = 1024 * 1024  # keep at most the last 1MB of stdout and stderr
+
+
+class OutputBuffer(object):
+    """
+    Bounded buffer holding the tail of the output of a command.
+    """
+    def __init__(self, maxsize=OUTPUT_BUFFER_SIZE):
+        self.maxsize = maxsize
+        self.size = 0
+        self.truncated = False
+        self._chunks = deque()
+
+    def append(self, chunk):
+        """Add chunk, dropping the oldest data if the buffer is full."""
+        self._chunks.append(chunk)
+        self.size += len(chunk)
+        while self.size > self.maxsize:
+            excess = self.size - self.maxsize
+            first = self._chunks.popleft()
+            if len(first) > excess:
+                self._chunks.appendleft(first[excess:])
+                self.size -= excess
+            else:
+                self.size -= len(first)
+            self.truncated = True
+
+    def getvalue(self):
+        """Return buffered output."""
+        return ''.join(self._chunks)
+
+
+def _set_nonblocking(fd):
+    """Make reads on fd return immediately when there is no data."""
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
 
 
 class Command(object):
     '''
     This class represents a command
     this will have to be extended
+
+    The output of the command is read while it runs, so chatty commands can't
+    block on a full pipe (or pty, in fake pty mode). Only the tail of the output
+    is kept in memory (see OutputBuffer); the full output can be streamed to a
+    log file.
     '''
 
-    def __init__(self, command=None, timeout=COMMAND_TIMEOUT, env=None):
+    def __init__(self, command=None, timeout=COMMAND_TIMEOUT, env=None, logfile=None,
+                 max_output=OUTPUT_BUFFER_SIZE):
         '''
         Constructor
         command is a string representing the command to be run
+        logfile is an optional filename to which all output is appended
         '''
         self.log = fancylogger.getLogger(self.__class__.__name__, fname=False)
         self.command = command
         self.timeout = timeout
         self.env = env
+        self.logfile = logfile
+        self.max_output = max_output
 
         self.fake_pty = False
 
+        self._proc = None
+        self._pty_fds = None
+        self._log_fh = None
+        self._buffers = None
+        self._open = None
+        self._poller = None
+        self._deadline = None
+        self._kill_deadline = None
+        self._exit_check = MIN_EXIT_CHECK_INTERVAL
+        self.timedout = False
+
     def __str__(self):
         cmd = self.getCommand()
         if type(cmd) in (tuple, list,):
@@ -85,24 +151,52 @@ class Command(object):
         """
         return self.command
 
-    def run(self):
+    @property
+    def pid(self):
+        """PID of the started command (None if it wasn't started)."""
+        if self._proc is None:
+            return None
+        return self._proc.pid
+
+    @property
+    def returncode(self):
+        """Exit code of the command (None if it didn't finish yet)."""
+        if self._proc is None:
+            return None
+        return self._proc.returncode
+
+    def start(self):
         """
-        Run commands
+        Start the command without waiting for it to finish.
+        Returns False if there is no command to run.
         """
         if self.command is None:
             self.log.error("No command set")
-            return
+            return False
 
         self.log.debug("Run going to run %s", self.command)
-        start = datetime.datetime.now()
 
+        if self.logfile is not None:
+            self._log_fh = open(self.logfile, 'a')
+        started = False
+        try:
+            self._start()
+            started = True
+        finally:
+            if not started:
+                self._abort_start()
+        return True
+
+    def _start(self):
+        """Start the command, and set up reading its output."""
         popen_kwargs = {
             'shell': True,
             'close_fds': True,
         }
         if self.fake_pty:
             self.log.debug("Setting up PTY")
-            (master, slave) = pty.openpty()
+            self._pty_fds = pty.openpty()
+            slave = self._pty_fds[1]
             stdouterr = {
                 'stdin': slave,
                 'stdout': slave,
@@ -119,39 +213,149 @@ class Command(object):
             popen_kwargs['env'] = self.env
 
         popen_kwargs.update(stdouterr)
-        # TODO: (high) buffer overflow here sometimes, check what happens and fix
-        # see easybuild/buildsoft/async
-        p = Popen(self.__str__(), **popen_kwargs)
-        time.sleep(.1)  # for immediate answers
-        timedout = False
-        while p.poll() is None:
-            if os.path.exists("/proc/%s" % (p.pid)):
-                if self.timeout == NO_TIMEOUT:
-                    self.log.debug("There is no timeout for cmd %s and it is still running" % self.command)
-                    time.sleep(NO_TIMEOUT_POLL_TIME)
-                    continue
-                else:
-                    now = datetime.datetime.now()
-                    if (now - start).seconds > self.timeout:
-                        if timedout is False:
-                            os.kill(p.pid, signal.SIGTERM)
-                            self.log.debug("Timeout occured with cmd %s. took more than %i secs to complete.",
-                                    self.command, self.timeout)
-                            timedout = True
-                        else:
-                            os.kill(p.pid, signal.SIGKILL)
-            time.sleep(TIMEOUT_POLL_TIME)
+        self._proc = Popen(self.__str__(), **popen_kwargs)
+
+        if self.timeout != NO_TIMEOUT:
+            self._deadline = time.time() + self.timeout
+
+        self._buffers = (OutputBuffer(self.max_output), OutputBuffer(self.max_output))
+        self._open = {}
+        self._poller = select.poll()
+        if self.fake_pty:
+            # only the command has the slave end open now, so reading the master end ends when it exits
+            os.close(self._pty_fds[1])
+            fds = [self._pty_fds[0]]
+        else:
+            fds = [self._proc.stdout.fileno(), self._proc.stderr.fileno()]
+        for fd, buf in zip(fds, self._buffers):
+            _set_nonblocking(fd)
+            self._open[fd] = buf
+            self._poller.register(fd, select.POLLIN | select.POLLPRI)
+
+    def _abort_start(self):
+        """Close the log file and the pty if starting the command failed."""
+        if self._log_fh is not None:
+            self._log_fh.close()
+            self._log_fh = None
+        if self._proc is None and self._pty_fds is not None:
+            for fd in self._pty_fds:
+                os.close(fd)
+            self._pty_fds = None
+
+    def _read(self, fd):
+        """Read available data from fd; unregister fd on EOF."""
+        try:
+            data = os.read(fd, READ_SIZE)
+        except OSError as err:
+            if err.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            if err.errno != errno.EIO:
+                raise
+            # reading the master end of a pty fails once the slave end is closed
+            data = ''
+        if data:
+            self._open[fd].append(data)
+            if self._log_fh is not None:
+                self._log_fh.write(data)
+        else:
+            self._close(fd)
+            # the command is likely about to exit, check for that again soon
+            self._exit_check = MIN_EXIT_CHECK_INTERVAL
+
+    def _close(self, fd):
+        """Stop reading from fd."""
+        self._poller.unregister(fd)
+        del self._open[fd]
+
+    def _check_timeout(self, now):
+        """Terminate the command if it ran past its deadline."""
+        if self._deadline is None or now < self._deadline:
+            return
+        if not self.timedout:
+            self.log.debug("Timeout occured with cmd %s. took more than %i secs to complete.",
+                    self.command, self.timeout)
+            self._proc.send_signal(signal.SIGTERM)
+            self.timedout = True
+            self._kill_deadline = now + KILL_GRACE_TIME
+        elif now >= self._kill_deadline:
+            self._proc.send_signal(signal.SIGKILL)
+            self._kill_deadline = now + KILL_GRACE_TIME
+        else:
+            return
+        self._exit_check = MIN_EXIT_CHECK_INTERVAL
+
+    def _next_wakeup(self, now):
+        """Number of seconds until something has to be checked again."""
+        wakeups = [self._exit_check]
+        self._exit_check = min(2 * self._exit_check, MAX_EXIT_CHECK_INTERVAL)
+        if self.timedout:
+            wakeups.append(self._kill_deadline - now)
+        elif self._deadline is not None:
+            wakeups.append(self._deadline - now)
+        return max(min(wakeups), 0)
+
+    def poll(self, timeout=0):
+        """
+        Read available output and enforce the timeout, waiting at most timeout
+        seconds (None: until output arrives or the next check is due). Returns
+        the exit code of the command, or None if it is still running.
+        """
+        now = time.time()
+        self._check_timeout(now)
+        exited = self._proc.poll() is not None
+
+        fds = self._open.keys()
+        if exited and not fds:
+            return self._proc.returncode
+
+        wait = self._next_wakeup(now)
+        if timeout is not None:
+            wait = min(wait, timeout)
+
+        if fds:
+            try:
+                events = self._poller.poll(int(wait * 1000))
+            except select.error as err:
+                if err.args[0] != errno.EINTR:
+                    raise
+                events = []
+            for fd, _ in events:
+                self._read(fd)
+            if exited and not events:
+                # process is gone, but something (e.g. a daemon) keeps the pipes open
+                self.log.debug("cmd %s exited, not waiting for output of its children", self.command)
+                for fd in self._open.keys():
+                    self._close(fd)
+        elif wait:
+            time.sleep(wait)
+
+        return self._proc.poll()
+
+    def wait(self):
+        """Wait for the started command to finish and return its output."""
+        while self.poll(timeout=None) is None or self._open:
+            pass
+        return self._finish()
+
+    def _finish(self):
+        """Clean up after the command finished and return (out, err)."""
+        if self._log_fh is not None:
+            self._log_fh.close()
+            self._log_fh = None
 
         if self.fake_pty:
             # # no stdout/stderr
             self.log.debug("No stdout/stderr in fake pty mode")
+            os.close(self._pty_fds[0])
             out = 'Fake PTY no out (this is ok)'
             err = 'Fake PTY no err (this is ok)'
         else:
-            out = p.stdout.read().strip()
-            err = p.stderr.read().strip()
+            out = self._buffers[0].getvalue().strip()
+            err = self._buffers[1].getvalue().strip()
+            self._proc.stdout.close()
+            self._proc.stderr.close()
 
-        ec = p.returncode
+        ec = self._proc.returncode
         if not ec == 0:
             err += "Exitcode %s\n" % ec
             self.log.warning("Problem occured with cmd %s: out %s, err %s", self.command, out, err)
@@ -159,6 +363,14 @@ class Command(object):
             self.log.debug("cmd ok %s: out %s err %s", self.command, out, err)
         return out, err
 
+    def run(self):
+        """
+        Run commands
+        """
+        if not self.start():
+            return
+        return self.wait()
+
 
 class GenerateSshKey(Command):
     """Create a public/private key pair"""
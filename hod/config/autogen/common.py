@@ -30,10 +30,16 @@ Common functions for autogenerated configurations.
 
 from os.path import dirname
 from collections import namedtuple
+from functools import wraps
 import errno
 import os
 import re
 import math
+import threading
+
+from vsc.utils import fancylogger
+
+_log = fancylogger.getLogger(fname=False)
 
 def parse_memory(memstr):
     '''
@@ -98,6 +104,46 @@ _RECOMMENDATIONS = [
     MemRec(parse_memory('512g'), parse_memory('64g')),
 ]
 
+# resources on a node which may be used by the services (see node_resources)
+Resources = namedtuple('Resources', ['cores', 'memory', 'numa_nodes'])
+
+# number of seconds to wait for a file system to report its block size (or type)
+BLOCKSIZE_TIMEOUT = 10
+# block size to use if it isn't reported in time (Hadoop's default for io.file.buffer.size)
+DEFAULT_BLOCKSIZE = 4096
+
+class AutogenContext(dict):
+    '''
+    Node information (see hod.node.node.Node.go) which is passed to all the
+    autogen config generators on a node. Values derived from it by functions
+    decorated with memoize_on_context are computed once per context, so they
+    are shared by all generators.
+    '''
+    def __init__(self, node_info):
+        dict.__init__(self, node_info)
+        self._memo = dict()
+
+    def memoize(self, key, fn, *args):
+        '''Return fn(*args), only calling fn the first time key is used.'''
+        if key not in self._memo:
+            self._memo[key] = fn(*args)
+        return self._memo[key]
+
+def memoize_on_context(fn):
+    '''
+    Decorator for functions which take the node information as last argument:
+    if it is an AutogenContext, the result is only computed once (for the same
+    other arguments).
+    '''
+    @wraps(fn)
+    def _memoized(*args):
+        node_info = args[-1]
+        if not isinstance(node_info, AutogenContext):
+            return fn(*args)
+        return node_info.memoize((fn.__module__, fn.__name__) + args[:-1], fn, *args)
+    return _memoized
+
+
 def blocksize(path):
     '''
     Find the block size for the file system given a path. If the path points to
@@ -112,6 +158,47 @@ def blocksize(path):
             return os.statvfs(dirname(path)).f_bsize
         raise
 
+def call_with_timeout(timeout, default, fn, *args):
+    '''
+    Return fn(*args), or default if it doesn't return within timeout seconds
+    (e.g. when it accesses a hanging parallel file system). Exceptions raised
+    by fn are passed on.
+    '''
+    result = []
+    def _call():
+        try:
+            result.append((True, fn(*args)))
+        except Exception as err:
+            result.append((False, err))
+    # fn can't be interrupted; a daemon thread doesn't keep us from exiting
+    name = getattr(fn, '__name__', str(fn))
+    thread = threading.Thread(target=_call, name=name)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if not result:
+        _log.warning("%s%s did not return after %s seconds, using %s", name, args, timeout, default)
+        return default
+    success, value = result[0]
+    if not success:
+        raise value
+    return value
+
+def blocksize_timeout(path, timeout=BLOCKSIZE_TIMEOUT):
+    '''
+    Find the block size for the file system given a path (see blocksize), but
+    give up after timeout seconds and return DEFAULT_BLOCKSIZE instead.
+    '''
+    return call_with_timeout(timeout, DEFAULT_BLOCKSIZE, blocksize, path)
+
+@memoize_on_context
+def workdir_blocksize(workdir, node_info):
+    '''
+    Return the block size of the file system of the workdir (see
+    blocksize_timeout), which is only probed once per AutogenContext.
+    '''
+    return blocksize_timeout(workdir)
+
 def reserved_memory(totalmem):
     '''
     Given an amount of memory in bytes, return the amount of memory that
@@ -123,37 +210,115 @@ def reserved_memory(totalmem):
     # totalmem > 512g
     return _RECOMMENDATIONS[-1].os
 
+def hugepages_memory(node):
+    '''
+    Return the amount of memory (in bytes) set aside for huge pages, which
+    can't be used by regular (e.g. JVM heap) allocations.
+    '''
+    meminfo = node['memory']['meminfo']
+    return meminfo.get('hugepages_total', 0) * meminfo.get('hugepagesize', 0)
+
+def usable_cores(node):
+    '''
+    Return the number of cores the services on the node may use: the cores
+    this process may run on, limited by the cgroup cpuset and CPU bandwidth
+    and by the number of processors per node allocated by PBS.
+    '''
+    cores = node['cores']
+    cgroup = node.get('cgroup') or {}
+    if cgroup.get('cpuset'):
+        cores = min(cores, len(cgroup['cpuset']))
+    if cgroup.get('cpus'):
+        cores = min(cores, max(int(math.ceil(cgroup['cpus'])), 1))
+    if node.get('ppn'):
+        cores = min(cores, node['ppn'])
+    return cores
+
+def numa_nodes(node):
+    '''
+    Return the NUMA nodes (dicts with id, cpus and memtotal) on which the
+    services may run: the nodes with usable cores, limited to the memory nodes
+    of the cgroup cpuset.
+    '''
+    numa = node.get('numa') or []
+    usable = set(node.get('usablecores') or [])
+    mems = (node.get('cgroup') or {}).get('mems')
+    nodes = []
+    for numa_node in numa:
+        if mems is not None and numa_node['id'] not in mems:
+            continue
+        if usable and not usable.intersection(numa_node['cpus']):
+            continue
+        nodes.append(numa_node)
+    return nodes
+
+def numa_layout(resources):
+    '''
+    Given the Resources of a node, return the number of NUMA nodes the services
+    run on and the number of usable cores per NUMA node, so services can be
+    sized to fit in a single NUMA node.
+    '''
+    num_numa = max(len(resources.numa_nodes), 1)
+    return num_numa, max(resources.cores / num_numa, 1)
+
+def java_numa_opts(resources):
+    '''
+    Return the JVM options to allocate the heap NUMA locally if the services
+    span more than one NUMA node.
+    '''
+    if len(resources.numa_nodes) > 1:
+        return ' -XX:+UseNUMA'
+    return ''
 
 def available_memory(node):
     '''
-    Return the amount of memory available in bytes. There are three things we
-    consider: 
-    1. If we are using all the cores, we assume we can use all the
+    Return the amount of memory available in bytes. There are several things
+    we consider:
+    1. Memory set aside for huge pages is not available.
+
+    2. If we are using all the cores, we assume we can use all the
     memory in the machine (minus what the OS needs).
 
-    2. If ulimit is set and less than meminfo, we use it.
+    3. If not, we use the amount of available memory based on total
+    machine memory scaled by usablecores/totalcores (see usable_cores).
 
-    3. If ulimit for vmem is not set (unlimited) then we use the amount of
-    available memory according based on total machine memory scaled by
-    usablecpus/totalcpus
+    4. If the cgroup cpuset restricts memory to some NUMA nodes, we use at most
+    the memory of those nodes (minus what the OS needs).
 
-    TODO: Take a look at supporting cgroups and parsing PBS environment
-    variables.
+    5. If ulimit for vmem or the cgroup memory limit is set and less, we use it
+    (minus what the OS needs, for the cgroup limit).
     '''
-    meminfo = node['memory']['meminfo']['memtotal']
+    meminfo = node['memory']['meminfo']['memtotal'] - hugepages_memory(node)
     memory = meminfo - reserved_memory(meminfo)
+    cores = usable_cores(node)
     # If we have the whole box, let's use all the non OS memory
-    if node['cores'] == node['totalcores']:
-        return memory
+    if cores < node['totalcores']:
+        pct_cores = float(cores) / node['totalcores']
+        memory = int(memory * pct_cores)
 
-    pct_cores = float(node['cores']) / node['totalcores']
+    numa = node.get('numa') or []
+    allowed = numa_nodes(node)
+    if allowed and len(allowed) < len(numa):
+        numa_memory = sum([x['memtotal'] for x in allowed])
+        memory = min(memory, numa_memory - reserved_memory(numa_memory))
 
-    memory = int(memory * pct_cores)
-    ulimit = node['memory']['ulimit']
-    if ulimit == 'unlimited':
-        return int(memory)
-    else:
-        return min(int(memory), int(ulimit))
+    ulimit = node['memory'].get('ulimit', 'unlimited')
+    if ulimit != 'unlimited':
+        memory = min(memory, int(ulimit))
+
+    cgroup_memory = (node.get('cgroup') or {}).get('memory')
+    if cgroup_memory:
+        memory = min(memory, cgroup_memory - reserved_memory(cgroup_memory))
+
+    return max(int(memory), 0)
+
+@memoize_on_context
+def node_resources(node):
+    '''
+    Return the resources which may be used by the services on the node (see
+    usable_cores, available_memory and numa_nodes).
+    '''
+    return Resources(usable_cores(node), available_memory(node), numa_nodes(node))
 
 def format_memory(mem, round_val=False):
     '''
@@ -0,0 +1,302 @@
+##
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Detect the type of file system a path is on, and tune the I/O settings of the
+autogenerated configurations for it.
+"""
+import ctypes
+import ctypes.util
+import os
+import pipes
+import re
+import tempfile
+import time
+from collections import namedtuple
+
+from vsc.utils import fancylogger
+
+import hod.node.node as node
+from hod.commands.command import Command
+from hod.config.autogen.common import (BLOCKSIZE_TIMEOUT, call_with_timeout,
+        memoize_on_context, workdir_blocksize)
+
+_log = fancylogger.getLogger(fname=False)
+
+MOUNTS_FILE = '/proc/mounts'
+
+# file system types by the magic number reported by statfs (see linux/magic.h)
+FS_MAGIC = {
+    0x0BD00BD0: 'lustre',
+    0x47504653: 'gpfs',
+    0x6969: 'nfs',
+    0xFF534D42: 'cifs',
+    0x19830326: 'beegfs',
+    0xAAD7AAEA: 'panfs',
+    0x00C36400: 'ceph',
+    0xEF53: 'ext4',
+    0x58465342: 'xfs',
+    0x9123683E: 'btrfs',
+    0x01021994: 'tmpfs',
+    0x794C7630: 'overlay',
+}
+
+# kind of file system (which selects the tuning) by file system type; other
+# file systems are considered to be local
+FS_KINDS = {
+    'lustre': 'lustre',
+    'gpfs': 'gpfs',
+    'nfs': 'nfs',
+    'nfs4': 'nfs',
+    'cifs': 'nfs',
+    'beegfs': 'shared',
+    'panfs': 'shared',
+    'ceph': 'shared',
+    'fuse.glusterfs': 'shared',
+}
+
+# every open stream gets a buffer of io.file.buffer.size, so don't go beyond this
+MAX_IO_BUFFER_SIZE = 4 * 1024**2
+
+# map output spill and merge settings when the intermediate data of the tasks
+# ends up on a shared file system: spill less often, merge more spills per
+# pass and compress the spills, to reduce the amount of I/O on the shared file system
+SHARED_SPILL_TUNING = {
+    'mapreduce.map.sort.spill.percent': 0.9,
+    'mapreduce.task.io.sort.factor': 100,
+    'mapreduce.map.output.compress': 'true',
+}
+
+# candidates for node local scratch (see select_local_scratch)
+LOCAL_SCRATCH_CANDIDATES = ['$TMPDIR', '$VSC_SCRATCH_NODE', '/tmp']
+# minimal amount of free space on node local scratch
+MIN_SCRATCH_FREE = 1024**3
+# amount of data written to measure the write throughput of node local scratch
+SCRATCH_PROBE_SIZE = 8 * 1024**2
+
+FsInfo = namedtuple('FsInfo', ['fstype', 'kind', 'mountpoint', 'blocksize', 'stripe_count', 'stripe_size'])
+
+
+def _existing_path(path):
+    '''Return path, or its closest existing parent directory.'''
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and path != os.path.dirname(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def _statfs_type(path):
+    '''Return the file system type of path according to its statfs magic number, or None.'''
+    libc_name = ctypes.util.find_library('c')
+    if libc_name is None:
+        return None
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+    # f_type is the first field of struct statfs, which is (much) smaller than buf
+    buf = ctypes.create_string_buffer(256)
+    if libc.statfs(path, buf) != 0:
+        _log.debug("statfs for %s failed: %s", path, os.strerror(ctypes.get_errno()))
+        return None
+    magic = ctypes.c_long.from_buffer(buf).value & 0xFFFFFFFF
+    return FS_MAGIC.get(magic)
+
+
+def _unescape_mount(field):
+    '''Unescape the octal escapes (e.g. \\040 for a space) of a field in /proc/mounts.'''
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+
+def mount_point(path, mounts_file=MOUNTS_FILE):
+    '''Return (mount point, file system type) of the mount the (existing) path is on.'''
+    path = os.path.realpath(path)
+    best = ('/', None)
+    try:
+        lines = open(mounts_file).read().splitlines()
+    except (IOError, OSError) as err:
+        _log.debug("Could not read %s: %s", mounts_file, err)
+        return best
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        mountpoint, fstype = _unescape_mount(fields[1]), fields[2]
+        prefix = mountpoint.rstrip('/') + '/'
+        if (path == mountpoint or path.startswith(prefix)) and len(mountpoint) >= len(best[0]):
+            best = (mountpoint, fstype)
+    return best
+
+
+def lustre_stripe(path):
+    '''Return (stripe count, stripe size) of the default layout of the Lustre directory path.'''
+    stdout, _ = Command('lfs getstripe -d %s' % pipes.quote(path), timeout=BLOCKSIZE_TIMEOUT).run()
+    count = re.search(r'stripe_count:\s*(-?\d+)', stdout or '')
+    size = re.search(r'stripe_size:\s*(\d+)', stdout or '')
+    if count is None or size is None:
+        _log.debug("Could not determine Lustre striping of %s: %s", path, stdout)
+        return None, None
+    return int(count.group(1)), int(size.group(1))
+
+
+def _filesystem_type(path):
+    '''Return (mount point, file system type) of the (existing) path.'''
+    mountpoint, mount_fstype = mount_point(path)
+    fstype = call_with_timeout(BLOCKSIZE_TIMEOUT, None, _statfs_type, path) or mount_fstype
+    return mountpoint, fstype
+
+
+def is_shared_filesystem(path):
+    '''Return whether path is (or will be) on a shared file system (see FS_KINDS).'''
+    _, fstype = _filesystem_type(_existing_path(path))
+    return FS_KINDS.get(fstype, 'local') != 'local'
+
+
+def detect_filesystem(path, blocksize):
+    '''
+    Return FsInfo for the file system path is on (or will be on, if it doesn't
+    exist yet). The type is taken from the statfs magic number, or from
+    /proc/mounts if the magic number is not known.
+    '''
+    path = _existing_path(path)
+    mountpoint, fstype = _filesystem_type(path)
+    kind = FS_KINDS.get(fstype, 'local')
+    stripe_count, stripe_size = None, None
+    if kind == 'lustre':
+        stripe_count, stripe_size = lustre_stripe(path)
+    fsinfo = FsInfo(fstype, kind, mountpoint, blocksize, stripe_count, stripe_size)
+    _log.debug("File system of %s: %s", path, fsinfo)
+    return fsinfo
+
+
+@memoize_on_context
+def workdir_filesystem(workdir, node_info):
+    '''Return FsInfo for the workdir, which is only detected once per AutogenContext.'''
+    return detect_filesystem(workdir, workdir_blocksize(workdir, node_info))
+
+
+def io_buffer_size(fsinfo):
+    '''
+    Return the I/O buffer size to use on the file system: the stripe size for
+    Lustre, the block size otherwise; at most MAX_IO_BUFFER_SIZE.
+    '''
+    size = fsinfo.stripe_size or fsinfo.blocksize
+    return min(size, MAX_IO_BUFFER_SIZE)
+
+
+def _scratch_candidates(candidates):
+    '''Expand the environment variables in the candidates, and drop unset and duplicate ones.'''
+    paths = []
+    for candidate in candidates:
+        path = os.path.expandvars(candidate)
+        if '$' in path or not path:
+            continue
+        path = os.path.realpath(path)
+        if path not in paths:
+            paths.append(path)
+    return paths
+
+
+def probe_scratch(path, size=SCRATCH_PROBE_SIZE):
+    '''
+    Return (free space, write throughput) in bytes and bytes per second for
+    the directory path, or None if it is not usable as node local scratch
+    (i.e. not a writable directory on a local, disk backed file system).
+    '''
+    if not os.path.isdir(path) or not os.access(path, os.W_OK | os.X_OK):
+        return None
+    fsinfo = detect_filesystem(path, None)
+    # tmpfs would take memory from the services
+    if fsinfo.kind != 'local' or fsinfo.fstype == 'tmpfs':
+        _log.debug("Not using %s (%s) as node local scratch", path, fsinfo.fstype)
+        return None
+    try:
+        stat = os.statvfs(path)
+        fd, probe = tempfile.mkstemp(prefix='.hod-probe-', dir=path)
+        try:
+            data = '\0' * (1024**2)
+            start = time.time()
+            for _ in range(size / len(data)):
+                os.write(fd, data)
+            os.fsync(fd)
+            elapsed = max(time.time() - start, 1e-6)
+        finally:
+            os.close(fd)
+            os.unlink(probe)
+    except (IOError, OSError) as err:
+        _log.debug("Could not probe %s as node local scratch: %s", path, err)
+        return None
+    return stat.f_bavail * stat.f_frsize, size / elapsed
+
+
+def select_local_scratch(candidates=LOCAL_SCRATCH_CANDIDATES):
+    '''
+    Return the candidate directory which is most suited as node local scratch:
+    the one with the highest write throughput out of those with at least
+    MIN_SCRATCH_FREE bytes of free space. Returns None if none is suited.
+    '''
+    best, best_throughput = None, 0
+    for path in _scratch_candidates(candidates):
+        probe = call_with_timeout(BLOCKSIZE_TIMEOUT, None, probe_scratch, path)
+        if probe is None:
+            continue
+        free, throughput = probe
+        _log.debug("Node local scratch %s: %d bytes free, %d bytes/s", path, free, throughput)
+        if free >= MIN_SCRATCH_FREE and throughput > best_throughput:
+            best, best_throughput = path, throughput
+    _log.info("Selected node local scratch: %s", best)
+    return best
+
+
+def local_scratch():
+    '''
+    Return the node local scratch directory of this node (see
+    select_local_scratch), which is shared through the discovery cache.
+    '''
+    return node.discovery.get('localscratch', select_local_scratch)
+
+
+@memoize_on_context
+def io_tuning(workdir, node_info):
+    '''
+    Return dict with I/O settings per config file for the file system of the
+    workdir. If the workdir is on a shared file system, the Hadoop temporary
+    directory and the local dirs of the NodeManagers (where spills and map
+    outputs go) are placed in $localscratch, and spilling is tuned for shared
+    storage. Whether there is node local scratch is only determined when the
+    template is resolved (see hod.config.template.mklocalscratch); if not,
+    $localscratch is the localworkdir, which is on the shared file system.
+    '''
+    fsinfo = workdir_filesystem(workdir, node_info)
+    tuning = {
+        'core-site.xml': {'io.file.buffer.size': io_buffer_size(fsinfo)},
+        'mapred-site.xml': {},
+        'yarn-site.xml': {},
+    }
+    if fsinfo.kind == 'local':
+        return tuning
+
+    _log.info("Workdir %s is on %s: using $localscratch for local dirs, tuning spills for shared storage",
+              workdir, fsinfo.fstype)
+    tuning['core-site.xml']['hadoop.tmp.dir'] = '$localscratch'
+    tuning['mapred-site.xml'].update(SHARED_SPILL_TUNING)
+    tuning['yarn-site.xml']['yarn.nodemanager.local-dirs'] = '$localscratch/nm-local-dir'
+    return tuning
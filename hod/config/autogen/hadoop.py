@@ -33,8 +33,9 @@ http://docs.hortonworks.com/HDPDocuments/HDP2/HDP-2.0.6.0/bk_installing_manually
 """
 
 from collections import namedtuple
-from hod.config.autogen.common import (blocksize,
-        available_memory, parse_memory, format_memory, round_mb)
+from hod.config.autogen.common import (memoize_on_context, java_numa_opts,
+        node_resources, numa_layout, parse_memory, format_memory, round_mb)
+from hod.config.autogen.filesystem import io_tuning
 
 __all__ = ['autogen_config']
 
@@ -42,7 +43,8 @@ MemDefaults = namedtuple('MemDefaults', [
     'available_memory',
     'min_container_sz',
     'num_containers',
-    'ram_per_container'
+    'ram_per_container',
+    'num_numa_nodes',
 ])
 
 def min_container_size(totalmem):
@@ -60,20 +62,30 @@ def min_container_size(totalmem):
     else:
         return 2 * (1024**3)
 
+@memoize_on_context
 def memory_defaults(node_info):
     '''
     Return default memory information.
+
+    If the node has several NUMA nodes, the number of containers is a multiple
+    of the number of NUMA nodes so they can be spread evenly over them, and
+    no container needs more memory than is available on a single NUMA node.
     '''
-    ncores = node_info['cores']
-    hadoop_memory = available_memory(node_info)
+    resources = node_resources(node_info)
+    ncores = resources.cores
+    hadoop_memory = resources.memory
+    num_numa, _ = numa_layout(resources)
     min_container_sz = min_container_size(hadoop_memory)
     num_containers = min(2*ncores, hadoop_memory/min_container_sz)
+    if num_containers >= num_numa:
+        num_containers -= num_containers % num_numa
     ram_per_container = max(min_container_sz, hadoop_memory/num_containers)
     return MemDefaults(
             hadoop_memory,
             min_container_sz,
             num_containers,
-            ram_per_container)
+            ram_per_container,
+            num_numa)
 
 def core_site_xml_defaults(workdir, node_info):
     '''
@@ -86,11 +98,11 @@ def core_site_xml_defaults(workdir, node_info):
         'fs.inmemory.size.mb': 200,
         'hadoop.rpc.socket.factory.class.default': 'org.apache.hadoop.net.StandardSocketFactory',
         'hadoop.tmp.dir': '$localworkdir',
-        # If there is hdfs, probably don't set to this blocksize.
-        'io.file.buffer.size': blocksize(workdir),
         'io.sort.factor': 64,
         'io.sort.mb': 256,
     }
+    # If there is hdfs, probably don't set io.file.buffer.size to this file system.
+    dflts.update(io_tuning(workdir, node_info)['core-site.xml'])
     return dflts
 
 def mapred_site_xml_defaults(workdir, node_info):
@@ -98,6 +110,7 @@ def mapred_site_xml_defaults(workdir, node_info):
     Default entries for the mapred-site.xml config file.
     '''
     mem_dflts = memory_defaults(node_info)
+    numa_opts = java_numa_opts(node_resources(node_info))
 
     java_map_mem = format_memory(0.8 * mem_dflts.ram_per_container, round_val=True)
     java_reduce_mem = format_memory(0.8 * 2 * mem_dflts.ram_per_container, round_val=True)
@@ -107,29 +120,41 @@ def mapred_site_xml_defaults(workdir, node_info):
     reduce_memory = round_mb(2 * mem_dflts.ram_per_container)
     dflts = {
         'mapreduce.framework.name': 'yarn',
-        'mapreduce.map.java.opts': '-Xmx%s' % java_map_mem,
+        'mapreduce.map.java.opts': '-Xmx%s%s' % (java_map_mem, numa_opts),
         'mapreduce.map.memory.mb': map_memory,
-        'mapreduce.reduce.java.opts': '-Xmx%s' % java_reduce_mem,
+        'mapreduce.reduce.java.opts': '-Xmx%s%s' % (java_reduce_mem, numa_opts),
         'mapreduce.reduce.memory.mb': reduce_memory,
         # io.sort.mb can't be > 2047mb
         'mapreduce.task.io.sort.mb': min(int(0.4 * map_memory), 2047),
         'yarn.app.mapreduce.am.staging-dir': '$localworkdir/tmp/hadoop-yarn/staging',
     }
+    dflts.update(io_tuning(workdir, node_info)['mapred-site.xml'])
     return dflts
 
 def yarn_site_xml_defaults(workdir, node_info):
     '''
     Default entries for the yarn-site.xml config file.
+
+    With several NUMA nodes, a single container can get at most the memory and
+    cores of one NUMA node, but always enough for a reduce task (see
+    mapred_site_xml_defaults).
     '''
     mem_dflts = memory_defaults(node_info)
-    ncores = node_info['cores']
-    max_alloc = round_mb(mem_dflts.ram_per_container * mem_dflts.num_containers)
+    resources = node_resources(node_info)
+    ncores = resources.cores
+    num_numa, numa_cores = numa_layout(resources)
+    node_alloc = round_mb(mem_dflts.ram_per_container * mem_dflts.num_containers)
+    max_alloc = node_alloc
+    if mem_dflts.num_containers >= num_numa:
+        max_alloc = round_mb(mem_dflts.ram_per_container * (mem_dflts.num_containers / num_numa))
+        # reduce containers get twice the memory of a map container
+        max_alloc = max(max_alloc, round_mb(2 * mem_dflts.ram_per_container))
     min_alloc = round_mb(mem_dflts.ram_per_container)
     dflts = {
         'yarn.nodemanager.aux-services': 'mapreduce_shuffle',
         'yarn.scheduler.maximum-allocation-mb': max_alloc,
         'yarn.scheduler.minimum-allocation-mb': min_alloc,
-        'yarn.nodemanager.resource.memory-mb': max_alloc,
+        'yarn.nodemanager.resource.memory-mb': node_alloc,
         'yarn.nodemanager.vmem-check-enabled':'false',
         'yarn.nodemanager.vmem-pmem-ratio': 2.1,
         'yarn.nodemanager.hostname': '$dataname',
@@ -139,10 +164,11 @@ def yarn_site_xml_defaults(workdir, node_info):
         'yarn.resourcemanager.webapp.https.address': '$masterhostaddress:8090',
         'yarn.resourcemanager.scheduler.class': 'org.apache.hadoop.yarn.server.resourcemanager.scheduler.capacity.CapacityScheduler',
         'yarn.scheduler.capacity.allocation.file': 'capacity-scheduler.xml',
-        'yarn.scheduler.maximum-allocation-vcores': str(ncores),
+        'yarn.scheduler.maximum-allocation-vcores': str(numa_cores),
         'yarn.scheduler.minimum-allocation-vcores': '1',
         'yarn.nodemanager.resource.cpu-vcores': str(ncores),
     }
+    dflts.update(io_tuning(workdir, node_info)['yarn-site.xml'])
     return dflts
 
 def capacity_scheduler_xml_defaults(workdir, node_info):
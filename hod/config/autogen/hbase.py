@@ -27,8 +27,9 @@
 """
 
 from collections import namedtuple
-from hod.config.autogen.common import (blocksize,
-        available_memory, parse_memory, format_memory, round_mb)
+from hod.config.autogen.common import (memoize_on_context,
+        node_resources, parse_memory, format_memory, round_mb)
+from hod.config.autogen.filesystem import io_tuning
 
 __all__ = ['autogen_config']
 
@@ -54,12 +55,14 @@ def min_container_size(totalmem):
     else:
         return 2 * (1024**3)
 
+@memoize_on_context
 def memory_defaults(node_info):
     '''
     Return default memory information.
     '''
-    ncores = node_info['cores']
-    hadoop_memory = available_memory(node_info)
+    resources = node_resources(node_info)
+    ncores = resources.cores
+    hadoop_memory = resources.memory
     min_container_sz = min_container_size(hadoop_memory)
     num_containers = min(2*ncores, hadoop_memory/min_container_sz)
     ram_per_container = max(min_container_sz, hadoop_memory/num_containers)
@@ -80,11 +83,11 @@ def core_site_xml_defaults(workdir, node_info):
         'fs.inmemory.size.mb': 200,
         'hadoop.rpc.socket.factory.class.default': 'org.apache.hadoop.net.StandardSocketFactory',
         'hadoop.tmp.dir': '$localworkdir',
-        # If there is hdfs, probably don't set to this blocksize.
-        'io.file.buffer.size': blocksize(workdir),
         'io.sort.factor': 64,
         'io.sort.mb': 256,
     }
+    # If there is hdfs, probably don't set io.file.buffer.size to this file system.
+    dflts.update(io_tuning(workdir, node_info)['core-site.xml'])
     return dflts
 
 def hdfs_site_xml_defaults(workdir, node_info):
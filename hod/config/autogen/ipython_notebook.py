@@ -43,11 +43,15 @@ def spark_defaults(_, node_info):
 
     We use 2 cores per executor based on discussion found here:
     http://stackoverflow.com/questions/24622108/apache-spark-the-number-of-cores-vs-the-number-of-executors
+
+    Executors are sized per NUMA node, so none of them straddles two NUMA nodes.
     '''
     memory_defaults = hcah.memory_defaults(node_info)
     num_nodes = node_info['num_nodes']
-    cores_per_executor = min(2, node_info['cores'])
-    instances_per_node = node_info['cores'] / cores_per_executor
+    resources = hcac.node_resources(node_info)
+    num_numa, numa_cores = hcac.numa_layout(resources)
+    cores_per_executor = min(2, numa_cores)
+    instances_per_node = num_numa * (numa_cores / cores_per_executor)
     # -1 because we want one less executor instance on the application master
     # If we have only one node then we don't expect the driver to be very busy, so
     # we can give the executors more memory.
@@ -59,6 +63,9 @@ def spark_defaults(_, node_info):
         'spark.executor.memory':  str(memory) + 'M',
         'spark.local.dir': tempfile.gettempdir(),
     }
+    numa_opts = hcac.java_numa_opts(resources)
+    if numa_opts:
+        dflts['spark.executor.extraJavaOptions'] = numa_opts.strip()
     return dflts
 
 def autogen_config(workdir, node_info):
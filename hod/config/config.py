@@ -27,16 +27,18 @@
 """
 
 import os
+import sys
 
 from ConfigParser import NoOptionError, NoSectionError, SafeConfigParser
 from collections import Mapping, namedtuple
 from copy import deepcopy
 from os.path import join as mkpath, dirname, realpath
-from pkg_resources import Requirement, resource_filename, resource_listdir
 
 import hod
 from hod.node.node import Node
+from hod.config.autogen.common import AutogenContext
 from hod.commands.command import COMMAND_TIMEOUT
+from hod.work.ready_check import READY_TIMEOUT, ready_check_kind
 import hod.config.template as hct
 
 
@@ -59,6 +61,7 @@ RUNS_ON_ALL = RUNS_ON_MASTER | RUNS_ON_SLAVE
 HOD_ETC_DIR = os.path.join('etc', 'hod')
 
 
+
 def load_service_config(fileobj):
     '''
     Load a .ini style config for a service.
@@ -208,7 +211,8 @@ class PreServiceConfigOpts(object):
         login node then we can't process this information from the login node.
         '''
         node = Node()
-        node_info = node.go()
+        # collect the node information only once, and share what is derived from it between the generators
+        node_info = AutogenContext(node.go())
         _log.debug('Collected Node information: %s', node_info)
         for autocfg in self.autogen:
             fn = autogen_fn(autocfg)
@@ -322,23 +326,35 @@ class ConfigOpts(object):
         start_script = _cfgget(config, _SERVICE_SECTION, 'ExecStart')
         stop_script = _cfgget(config, _SERVICE_SECTION, 'ExecStop')
         env = dict(config.items(_ENVIRONMENT_SECTION))
-
-        return ConfigOpts(name, runs_on, pre_start_script, start_script, stop_script, env, template_resolver)
+        after = parse_comma_delim_list(_cfgget(config, _UNIT_SECTION, 'After', ''))
+        requires = parse_comma_delim_list(_cfgget(config, _UNIT_SECTION, 'Requires', ''))
+        ready_check = _cfgget(config, _SERVICE_SECTION, 'ReadyCheck', '') or None
+        if ready_check is not None:
+            # fail early for unknown kinds of ready checks; the rest may contain templates,
+            # so it is only checked once they are resolved (see ConfiguredService.start_work_service)
+            ready_check_kind(ready_check)
+        ready_timeout = float(_cfgget(config, _SERVICE_SECTION, 'ReadyTimeout', READY_TIMEOUT))
+
+        return ConfigOpts(name, runs_on, pre_start_script, start_script, stop_script, env, template_resolver,
+                          after=after, requires=requires, ready_check=ready_check, ready_timeout=ready_timeout)
 
     def to_params(self, workdir, modulepaths, modules, master_template_args):
         """Create a ConfigOptsParams object from the ConfigOpts instance"""
         return ConfigOptsParams(self.name, self._runs_on, self._pre_start_script, self._start_script,
                                 self._stop_script, self._env, workdir, modulepaths, modules,
-                                master_template_args, self.timeout)
+                                master_template_args, self.timeout, self.after, self.requires,
+                                self._ready_check, self.ready_timeout)
 
     @staticmethod
     def from_params(params, template_resolver):
         """Create a ConfigOpts instance from a ConfigOptsParams instance"""
         return ConfigOpts(params.name, params.runs_on, params.pre_start_script, params.start_script,
-                          params.stop_script, params.env, template_resolver, params.timeout)
+                          params.stop_script, params.env, template_resolver, params.timeout,
+                          params.after, params.requires, params.ready_check, params.ready_timeout)
 
     def __init__(self, name, runs_on, pre_start_script, start_script, stop_script, env, template_resolver, 
-                    timeout=COMMAND_TIMEOUT):
+                    timeout=COMMAND_TIMEOUT, after=None, requires=None, ready_check=None,
+                    ready_timeout=READY_TIMEOUT):
         self.name = name
         self._runs_on = runs_on
         self._tr = template_resolver
@@ -347,6 +363,13 @@ class ConfigOpts(object):
         self._stop_script = stop_script
         self._env = env
         self.timeout = timeout
+        # names of services which have to be started before this one
+        self.after = after or []
+        # like after, but the services must be part of the same cluster
+        self.requires = requires or []
+        # check which tells whether the service is ready after it was started (see hod.work.ready_check)
+        self._ready_check = ready_check
+        self.ready_timeout = ready_timeout
 
     @property
     def pre_start_script(self):
@@ -360,6 +383,12 @@ class ConfigOpts(object):
     def stop_script(self):
         return self._tr(self._stop_script)
 
+    @property
+    def ready_check(self):
+        if self._ready_check is None:
+            return None
+        return self._tr(self._ready_check)
+
     @property
     def workdir(self):
         return self._tr.workdir
@@ -368,6 +397,18 @@ class ConfigOpts(object):
     def localworkdir(self):
         return hct.mklocalworkdir(self._tr.workdir)
 
+    @property
+    def localscratch(self):
+        '''
+        Node local scratch directory if $localscratch is used by this service,
+        or by the config files written by this process; None otherwise.
+        '''
+        # resolving the templates of the service evaluates $localscratch if it is used
+        for value in [self._pre_start_script, self._start_script, self._stop_script,
+                      self._ready_check] + self._env.values():
+            self._tr(value)
+        return hct.resolved_localscratch(self._tr.workdir)
+
     @property
     def configdir(self):
         return mkpath(self.localworkdir, 'conf')
@@ -419,6 +460,10 @@ ConfigOptsParams = namedtuple('ConfigOptsParams', [
     'modules',
     'master_template_kwargs',
     'timeout',
+    'after',
+    'requires',
+    'ready_check',
+    'ready_timeout',
 ])
 
 def autogen_fn(name):
@@ -466,16 +511,68 @@ def service_config_fn(policy_path):
     return getattr(module, fn)
 
 
+def _writer_chunks(config_writer, outfile, data_dict, template_resolver):
+    '''
+    Return an iterable with the contents of outfile in chunks. Writers which
+    can stream their output provide a 'chunks' function (see
+    hod.config.writer.common.streaming_writer); other writers return the full
+    contents as a string.
+    '''
+    chunks = getattr(config_writer, 'chunks', None)
+    if chunks is None:
+        return [config_writer(outfile, data_dict, template_resolver)]
+    return chunks(outfile, data_dict, template_resolver)
+
+
+def _write_atomic(path, chunks):
+    '''
+    Write the chunks to a temporary file next to path and rename it to path, so
+    readers never see a partially written file.
+    '''
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp_path, 'w') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 def write_service_config(outfile, data_dict, config_writer, template_resolver):
     """Write service config files to disk."""
-    with open(outfile, 'w') as f:
-        f.write(config_writer(outfile, data_dict, template_resolver))
+    _write_atomic(outfile, _writer_chunks(config_writer, outfile, data_dict, template_resolver))
+
+
+def write_service_configs(configdir, service_configs, config_writer, template_resolver):
+    """
+    Write the service config files to configdir, streaming them to disk as
+    they are rendered. The config dir is private to this process (it is in the
+    localworkdir), so the files are written in place, without a temporary file.
+    """
+    for dest_file, cfg in sorted(service_configs.items()):
+        path = mkpath(configdir, dest_file)
+        with open(path, 'w') as f:
+            for chunk in _writer_chunks(config_writer, path, cfg, template_resolver):
+                f.write(chunk)
 
 
 def resolve_dists_dir():
-    """Resolve path to distributions."""
-    pkg = Requirement.parse(hod.NAME)
-    return resource_filename(pkg, HOD_ETC_DIR)
+    """
+    Resolve path to distributions: next to the hod package (source tree or
+    unzipped egg), or in the installation prefix. pkg_resources is slow to
+    import, so it is only used as a last resort (e.g. for a zipped egg).
+    """
+    pkg_dir = dirname(dirname(os.path.abspath(hod.__file__)))
+    for prefix in [pkg_dir, sys.prefix]:
+        path = mkpath(prefix, HOD_ETC_DIR)
+        if os.path.isdir(path):
+            return path
+
+    from pkg_resources import Requirement, resource_filename
+    return resource_filename(Requirement.parse(hod.NAME), HOD_ETC_DIR)
 
 
 def resolve_dist_path(dist):
@@ -490,8 +587,7 @@ def resolve_dist_path(dist):
 
 def avail_dists():
     """Return a list of available distributions"""
-    pkg = Requirement.parse(hod.NAME)
-    return sorted(resource_listdir(pkg, HOD_ETC_DIR))
+    return sorted(os.listdir(resolve_dists_dir()))
 
 
 def resolve_config_paths(config, dist):
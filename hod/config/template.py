@@ -27,20 +27,25 @@
 """
 
 from collections import namedtuple
+from distutils.spawn import find_executable
 from os.path import join as mkpath
 
 import os
 import pwd
-import socket
 import string
 
 import hod.node.node as node
+from hod.config.autogen.common import numa_nodes
+from hod.config.autogen.filesystem import is_shared_filesystem, local_scratch
 
 from vsc.utils import fancylogger
 _log = fancylogger.getLogger(fname=False)
 
 ConfigTemplate = namedtuple('ConfigTemplate', 'name, fn, doc')
 
+# node local scratch directory $localscratch was resolved to in this process, by workdir
+_LOCAL_SCRATCH = dict()
+
 def _config_template_error(name):
     '''Placeholder function for config templates for when we don't have access
     to the master node fields yet.'''
@@ -85,21 +90,23 @@ def register_templates(template_registry, config_opts):
     '''
     workdir = config_opts.workdir
     modules = config_opts.modules
-    local_data_network = node.sorted_network(node.get_networks())[0]
+    local_data_network = node.sorted_network(node.discovery.networks())[0]
     templates = [
         _config_template_stub('masterhostname', 'Hostname bound to the Fully Qualified Domain Name (FQDN) of the master node.'),
         _config_template_stub('masterhostaddress', 'Address bound to the Fully Qualified Domain Name (FQDN) of the master node.'),
         _config_template_stub('masterdataname', 'Hostname bound to the Infiniband adaptor on the master node if available'),
         _config_template_stub('masterdataaddress', 'Address bound to the Infiniband adaptor on the master node if available'),
-        ConfigTemplate('hostname', socket.getfqdn, 'Fully Qualified Domain Name (FQDN)'),
-        ConfigTemplate('hostaddress', lambda: socket.gethostbyname(socket.getfqdn()), 'IP address registered as the FQDN'),
+        ConfigTemplate('hostname', node.discovery.fqdn, 'Fully Qualified Domain Name (FQDN)'),
+        ConfigTemplate('hostaddress', node.discovery.hostaddress, 'IP address registered as the FQDN'),
         ConfigTemplate('dataname', local_data_network.hostname, 'Infiniband hostname if available'),
         ConfigTemplate('dataaddress', local_data_network.addr, 'Infiniband address if available'),
         ConfigTemplate('workdir', workdir, 'Base directory for configuration and logging, e.g. /tmp, or somewhere on a shared file system.'),
         ConfigTemplate('localworkdir', lambda: mklocalworkdir(workdir), 'Subdirectory of workdir with user, host, and pid in the name to make it distinct from other workdirs for use on shared file systems'),
+        ConfigTemplate('localscratch', lambda: mklocalscratch(workdir), 'Like localworkdir, but on node local scratch (the localworkdir if there is no suitable node local scratch); removed when the services stop'),
         ConfigTemplate('user', _current_user, 'Current user'),
         ConfigTemplate('pid', os.getpid, 'PID for the current process'),
         ConfigTemplate('modules', lambda: ' '.join(modules), 'Modules listed in the hod.conf'),
+        ConfigTemplate('numactl', numactl_command, 'numactl command binding to the NUMA nodes of the usable cores (empty if all NUMA nodes are used)'),
         ]
 
     for ct in templates:
@@ -115,10 +122,53 @@ def mklocalworkdir(workdir):
     jobid = os.getenv('PBS_JOBID')
     if jobid is None:
         raise RuntimeError('$PBS_JOBID must be defined to create a localworkdir.')
-    hostname = socket.getfqdn()
+    hostname = node.discovery.fqdn()
     dir_name = '.'.join([user, hostname, str(pid)])
     return mkpath(workdir, 'hod', jobid, dir_name)
 
+def mklocalscratch(workdir):
+    '''
+    Construct the pathname for a directory on node local scratch (see
+    hod.config.autogen.filesystem.select_local_scratch) which is local to this
+    host/job/user. If the workdir is not on a shared file system, or there is
+    no node local scratch, this is the localworkdir.
+    '''
+    # selecting the node local scratch involves writing to every candidate, only do that if it helps
+    if not is_shared_filesystem(workdir):
+        return mklocalworkdir(workdir)
+    scratch = local_scratch()
+    if scratch is None:
+        return mklocalworkdir(workdir)
+    path = mklocalworkdir(scratch)
+    _LOCAL_SCRATCH[workdir] = path
+    return path
+
+def resolved_localscratch(workdir):
+    '''
+    Return the node local scratch directory (see mklocalscratch) for workdir if
+    a template was resolved to it in this process, None otherwise (also if it is
+    the localworkdir).
+    '''
+    return _LOCAL_SCRATCH.get(workdir)
+
+def numactl_command():
+    '''
+    Return the numactl command which binds processes (and their children) to
+    the cpus and memory of the NUMA nodes with cores this process may use.
+    Returns an empty string if all NUMA nodes may be used or numactl is not
+    available.
+    '''
+    numa = node.discovery.numa()
+    node_info = dict(numa=numa, usablecores=node.discovery.usable_cores(), cgroup=node.discovery.cgroup())
+    ids = ','.join([str(numa_node['id']) for numa_node in numa_nodes(node_info)])
+    if not ids or len(ids.split(',')) == len(numa):
+        return ''
+    numactl = find_executable('numactl')
+    if numactl is None:
+        _log.warning("numactl not found, not binding to NUMA nodes %s", ids)
+        return ''
+    return '%s --cpunodebind=%s --membind=%s' % (numactl, ids, ids)
+
 def _current_user():
     '''
     Return the current user name as recommended by documentation of
@@ -142,16 +192,74 @@ def resolve_config_str(tmpl_str, **template_kwargs):
         raise TypeError('Error processing "%s": %s' % (tmpl_str, err))
     return retval
 
+# compiled string.Template objects by template string; shared by all resolvers
+_COMPILED_TEMPLATES = dict()
+
+def _compile_template(tmpl_str):
+    '''Return the (cached) string.Template for tmpl_str.'''
+    template = _COMPILED_TEMPLATES.get(tmpl_str)
+    if template is None:
+        template = string.Template(tmpl_str)
+        _COMPILED_TEMPLATES[tmpl_str] = template
+    return template
+
 class TemplateResolver(object):
     '''
     Resolver for templates. This is partially applied wrapper around
     resolve_config_str but picklable.
+
+    Environment variables take precedence over the template values. Fields of a
+    TemplateRegistry (see from_registry) are only evaluated when a template
+    string refers to them, and then only once.
     '''
     def __init__(self, **template_kwargs):
         self.workdir = template_kwargs['workdir'] # raise if not found...
         self._template_kwargs = template_kwargs
-        self._template_kwargs.update(os.environ)
+        # template fields which are not evaluated yet: name -> function
+        self._fields = dict()
+
+    @staticmethod
+    def from_registry(template_registry):
+        '''Create a TemplateResolver which evaluates the fields of template_registry lazily.'''
+        kwargs = dict()
+        fields = dict()
+        for name, field in template_registry.fields.items():
+            # the workdir is needed right away
+            if callable(field.fn) and name != 'workdir':
+                fields[name] = field.fn
+            else:
+                kwargs[name] = field.fn() if callable(field.fn) else field.fn
+        resolver = TemplateResolver(**kwargs)
+        resolver._fields = fields
+        return resolver
+
+    def _value(self, name):
+        '''Return the value of template field name, evaluating it if needed.'''
+        try:
+            return self._template_kwargs[name]
+        except KeyError:
+            fn = self._fields.pop(name) # raise if not found...
+            value = fn()
+            self._template_kwargs[name] = value
+            return value
+
+    def __getitem__(self, name):
+        '''Return the value for the template placeholder name.'''
+        if name in os.environ:
+            return os.environ[name]
+        return self._value(name)
 
     def __call__(self, tmpl_str):
         '''Given a string with template placeholders, return the resolved string'''
-        return resolve_config_str(tmpl_str, **self._template_kwargs)
+        if not isinstance(tmpl_str, basestring) or '$' not in tmpl_str:
+            return tmpl_str
+        try:
+            return _compile_template(tmpl_str).substitute(self)
+        except TypeError as err:
+            raise TypeError('Error processing "%s": %s' % (tmpl_str, err))
+
+    def __getstate__(self):
+        # functions of template fields can't be pickled, so evaluate them first
+        for name in self._fields.keys():
+            self._value(name)
+        return self.__dict__
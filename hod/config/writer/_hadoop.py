@@ -25,41 +25,37 @@
 """
 @author: Ewan Higgs (University of Ghent)
 """
-from common import XML_PREAMBLE, HADOOP_STYLESHEET, kv2xml, write_whitespace_delimited_file
+from common import XML_PREAMBLE, HADOOP_STYLESHEET, iter_whitespace_delimited_file, kv2xml, streaming_writer
 
 from vsc.utils import fancylogger
 _log = fancylogger.getLogger(fname=False)
 
 
 def _write_xml(outfile, options, template_resolver):
-    """Return string of XML file in Hadoop configuration format."""
-    output = XML_PREAMBLE + HADOOP_STYLESHEET + "<configuration>\n"
+    """Yield chunks of XML file in Hadoop configuration format."""
+    yield XML_PREAMBLE + HADOOP_STYLESHEET + "<configuration>\n"
 
     for k, v in sorted(options.items()):
         name = template_resolver(k)
         value = template_resolver(v)
-        output += kv2xml(name, value)
-    output += "</configuration>"
-    return output
+        yield kv2xml(name, value)
+    yield "</configuration>"
 
 
 def _write_properties(outfile, options, template_resolver):
-    """Return string of property file in format used by log4j."""
-    output = ''
+    """Yield lines of property file in format used by log4j."""
     for k, v in sorted(options.items()):
-        output += '%s=%s\n' % (k, v)
-    return output
+        yield '%s=%s\n' % (k, v)
 
 
 def _write_masters(outfile, options, template_resolver):
-    """Write the Hadoop master file out"""
-    output = ''
+    """Yield lines of the Hadoop master file"""
     for _, v in sorted(options.items()):
         value = template_resolver(v)
-        output += '%s\n' % (value)
-    return output
+        yield '%s\n' % (value)
 
 
+@streaming_writer
 def hadoop_xml(outfile, options, template_resolver):
     """Given a dict of options, write the resulting .xml or .properties file.
     Note: when dealing with .properties files, we don't use the templating
@@ -81,7 +77,7 @@ def hadoop_xml(outfile, options, template_resolver):
     elif outfile.endswith('masters'):
         return _write_masters(outfile, options, template_resolver)
     elif outfile.endswith('spark-defaults.conf'):
-        return write_whitespace_delimited_file(outfile, options, template_resolver)
+        return iter_whitespace_delimited_file(outfile, options, template_resolver)
     else:
         _log.error('Unrecognized hadoop file type: %s', outfile)
         raise RuntimeError('Unrecognized hadoop file type: %s' % outfile)
@@ -1,20 +1,45 @@
+from functools import wraps
+from xml.sax.saxutils import escape
+
 XML_PREAMBLE = """<?xml version="1.0" encoding="utf-8"?>
 """
 
 HADOOP_STYLESHEET = """<?xml-stylesheet type="text/xsl" href="configuration.xsl"?>
 """
 
+def streaming_writer(chunks_fn):
+    """
+    Make a config writer, which returns the contents of the file as a string,
+    from a function returning an iterable with the contents in chunks. The
+    chunks function is available as the 'chunks' attribute of the writer, so
+    hod.config.config can stream the contents to the file.
+    """
+    @wraps(chunks_fn)
+    def writer(outfile, options, template_resolver):
+        return ''.join(chunks_fn(outfile, options, template_resolver))
+    writer.chunks = chunks_fn
+    return writer
+
+def xml_escape(value):
+    """Escape &, < and > in value (converted to a string)."""
+    if not isinstance(value, basestring):
+        value = str(value)
+    # most values don't need escaping
+    if '&' in value or '<' in value or '>' in value:
+        value = escape(value)
+    return value
+
 def kv2xml(name, value):
     """Take a config option and return an xml string"""
     return '''<property>
     <name>%s</name>
     <value>%s</value>
 </property>
-''' % (name, value)
+''' % (xml_escape(name), xml_escape(value))
 
-def write_whitespace_delimited_file(_, options, template_resolver):
+def iter_whitespace_delimited_file(_, options, template_resolver):
     """
-    Write a whitespace delimited file. e.g.:
+    Yield the lines of a whitespace delimited file. e.g.:
 
     property1 value1
     property2 value2
@@ -22,10 +47,9 @@ def write_whitespace_delimited_file(_, options, template_resolver):
     "spark-defaults.conf" is one such example:
     https://spark.apache.org/docs/latest/configuration.html#dynamically-loading-spark-properties
     """
-    output = ""
-
     for key, val in sorted(options.items()):
         name = template_resolver(key)
         value = template_resolver(val)
-        output += '%s %s\n' % (name, value)
-    return output
+        yield '%s %s\n' % (name, value)
+
+write_whitespace_delimited_file = streaming_writer(iter_whitespace_delimited_file)
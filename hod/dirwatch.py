@@ -0,0 +1,152 @@
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+# #
+"""
+Watch directories for changes, using inotify when it is available.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import time
+
+from vsc.utils import fancylogger
+
+_log = fancylogger.getLogger(fname=False)
+
+# from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+def _load_libc():
+    '''Return libc if it provides inotify, None otherwise.'''
+    libc_name = ctypes.util.find_library('c')
+    if libc_name is None:
+        return None
+    try:
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, 'inotify_init1') or not hasattr(libc, 'inotify_add_watch'):
+        return None
+    return libc
+
+
+class DirWatcher(object):
+    """
+    Watch a set of directories for entries being created, changed or removed.
+
+    When inotify is available, fileno() returns a descriptor which becomes
+    readable as soon as something changes in one of the watched directories, so
+    it can be passed to select(). Without inotify, fileno() returns None and
+    changed() falls back to comparing the modification times of the
+    directories.
+    """
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self._fd = None
+        self._mtimes = dict()
+
+        libc = _load_libc()
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                _log.debug("inotify_init1 failed: %s", os.strerror(ctypes.get_errno()))
+            else:
+                self._fd = fd
+                for path in self.paths:
+                    if libc.inotify_add_watch(fd, path, WATCH_MASK) < 0:
+                        _log.debug("Failed to add inotify watch for %s: %s", path,
+                                   os.strerror(ctypes.get_errno()))
+        if self._fd is None:
+            _log.debug("inotify not available, polling modification times of %s", self.paths)
+        self._mtimes = self._collect_mtimes()
+
+    def _collect_mtimes(self):
+        '''Return dict mapping each watched path to its modification time.'''
+        mtimes = dict()
+        for path in self.paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def fileno(self):
+        '''Return the inotify file descriptor, or None if inotify is not used.'''
+        return self._fd
+
+    def changed(self):
+        '''
+        Return True if one of the watched directories changed since the last
+        call. Pending inotify events are consumed.
+        '''
+        if self._fd is not None:
+            seen = False
+            while True:
+                try:
+                    if not os.read(self._fd, 4096):
+                        break
+                    seen = True
+                except OSError as err:
+                    if err.errno in (errno.EAGAIN, errno.EINTR):
+                        break
+                    raise
+            return seen
+
+        mtimes = self._collect_mtimes()
+        seen = mtimes != self._mtimes
+        self._mtimes = mtimes
+        return seen
+
+    def wait(self, timeout):
+        '''
+        Block for at most timeout seconds until one of the watched directories
+        changes. Returns True if a change was seen.
+        '''
+        if self._fd is None:
+            time.sleep(timeout)
+            return self.changed()
+        try:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+        except select.error as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            readable = []
+        return bool(readable) and self.changed()
+
+    def close(self):
+        '''Release the inotify file descriptor.'''
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
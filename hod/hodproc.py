@@ -27,17 +27,19 @@
 @author: Stijn De Weirdt (Ghent University)
 """
 import os
+from copy import deepcopy
 from errno import EEXIST
 from os.path import join as mkpath
 from hod.mpiservice import MpiService, Task, MASTERRANK
 import hod.cluster as hc
 from hod.config.config import (PreServiceConfigOpts, ConfigOpts, 
-        ConfigOptsParams, env2str, service_config_fn, write_service_config,
+        ConfigOptsParams, env2str, service_config_fn, write_service_configs,
         parse_comma_delim_list, resolve_config_paths, RUNS_ON_MASTER,
         load_hod_config)
 from hod.commands.command import NO_TIMEOUT
 from hod.config.template import (TemplateRegistry, TemplateResolver,
         register_templates)
+from hod.timeline import span
 from hod.work.config_service import ConfiguredService
 
 from vsc.utils import fancylogger
@@ -71,10 +73,7 @@ def _setup_config_paths(precfg, resolver):
     config_writer = service_config_fn(precfg.config_writer)
 
     _log.info("Copying %d config files to %s", len(precfg.service_configs), precfg.configdir)
-    for dest_file, cfg in precfg.service_configs.items():
-        _log.info("Copying config %s file to '%s'", cfg, precfg.configdir)
-        dest_path = mkpath(precfg.configdir, dest_file)
-        write_service_config(dest_path, cfg, config_writer, resolver)
+    write_service_configs(precfg.configdir, precfg.service_configs, config_writer, resolver)
 
 def _setup_template_resolver(m_config, master_template_args):
     '''
@@ -84,7 +83,7 @@ def _setup_template_resolver(m_config, master_template_args):
     register_templates(reg, m_config)
     for ct in master_template_args:
         reg.register(ct)
-    return TemplateResolver(**reg.to_kwargs())
+    return TemplateResolver.from_registry(reg)
 
 def _script_output_paths(script_name, label=None):
     """
@@ -103,6 +102,17 @@ def _script_output_paths(script_name, label=None):
     return (script_stdout, script_stderr)
 
 
+def _default_start_order(configs):
+    '''
+    If none of the service configs specify After or Requires, start the services
+    one after the other in the order in which they are listed.
+    '''
+    if any([config.after or config.requires for config in configs]):
+        return
+    for prev, config in zip(configs, configs[1:]):
+        config.after = [prev.name]
+
+
 class ConfiguredMaster(MpiService):
     """
     Use config to setup services.
@@ -114,12 +124,18 @@ class ConfiguredMaster(MpiService):
     def distribution(self, *master_template_args, **kwargs):
         """Master makes the distribution"""
         self.tasks = []
-        config_path = resolve_config_paths(self.options.hodconf, self.options.dist)
-        m_config = load_hod_config(config_path, self.options.workdir, self.options.modulepaths, self.options.modules)
-        m_config.autogen_configs()
+        with span('load-hod-config'):
+            config_path = resolve_config_paths(self.options.hodconf, self.options.dist)
+            m_config = load_hod_config(config_path, self.options.workdir, self.options.modulepaths,
+                                       self.options.modules)
+        # slaves get the config as it is before autogen, since that depends on the node
+        self.config = deepcopy(m_config)
+        with span('autogen'):
+            m_config.autogen_configs()
 
         resolver = _setup_template_resolver(m_config, master_template_args)
-        _setup_config_paths(m_config, resolver)
+        with span('setup-config-paths'):
+            _setup_config_paths(m_config, resolver)
 
         master_env = dict([(v, os.getenv(v)) for v in m_config.master_env])
         # There may be scripts in the hod.conf dir so add it to the PATH
@@ -128,9 +144,14 @@ class ConfiguredMaster(MpiService):
 
         svc_cfgs = m_config.service_files
         self.log.info('Loading %d service configs.', len(svc_cfgs))
-        for config_filename in svc_cfgs:
-            self.log.info('Loading "%s" service config', config_filename)
-            config = ConfigOpts.from_file(open(config_filename, 'r'), resolver)
+        configs = []
+        with span('load-service-configs'):
+            for config_filename in svc_cfgs:
+                self.log.info('Loading "%s" service config', config_filename)
+                configs.append(ConfigOpts.from_file(open(config_filename, 'r'), resolver))
+        _default_start_order(configs)
+
+        for config in configs:
             ranks_to_run = config.runs_on(MASTERRANK, range(self.size))
             self.log.debug('Adding ConfiguredService Task to work with config: %s', str(config))
             cfg_opts = config.to_params(m_config.workdir, m_config.modulepaths, m_config.modules, master_template_args)
@@ -145,7 +166,10 @@ class ConfiguredMaster(MpiService):
             start_script = env_script + ' && ' + script + redirection + '; qdel $PBS_JOBID'
             self.log.debug('Adding script Task: %s', start_script)
             # TODO: How can we test this?
-            config = ConfigOpts(script, RUNS_ON_MASTER, '', start_script, '', master_env, resolver, timeout=NO_TIMEOUT)
+            # the script only starts once all services are up
+            services = [task.name for task in self.tasks]
+            config = ConfigOpts(script, RUNS_ON_MASTER, '', start_script, '', master_env, resolver, timeout=NO_TIMEOUT,
+                                after=services)
             ranks_to_run = config.runs_on(MASTERRANK, range(self.size))
             cfg_opts = config.to_params(m_config.workdir, m_config.modulepaths, m_config.modules, master_template_args)
             self.tasks.append(Task(ConfiguredService, config.name, ranks_to_run, cfg_opts, master_env))
@@ -161,12 +185,20 @@ class ConfiguredSlave(MpiService):
 
     def distribution(self, *master_template_args, **kwargs):
         """
-        Master makes the distribution
+        Master makes the distribution; set up the configuration on this node.
+        The hod configuration parsed by the master can be passed as 'config';
+        otherwise it is loaded from file.
 
         This only needs to run if there are more than 1 node (self.size>1)
         """
-        config_path = resolve_config_paths(self.options.hodconf, self.options.dist)
-        m_config = load_hod_config(config_path, self.options.workdir, self.options.modulepaths, self.options.modules)
-        m_config.autogen_configs()
+        m_config = kwargs.get('config')
+        if m_config is None:
+            with span('load-hod-config'):
+                config_path = resolve_config_paths(self.options.hodconf, self.options.dist)
+                m_config = load_hod_config(config_path, self.options.workdir, self.options.modulepaths,
+                                           self.options.modules)
+        with span('autogen'):
+            m_config.autogen_configs()
         resolver = _setup_template_resolver(m_config, master_template_args)
-        _setup_config_paths(m_config, resolver)
+        with span('setup-config-paths'):
+            _setup_config_paths(m_config, resolver)
@@ -35,13 +35,15 @@ import string
 import sys
 
 from hod import VERSION as HOD_VERSION
+from hod import timeline
 
 from vsc.utils import fancylogger
 from vsc.utils.generaloption import GeneralOption
 
 from hod.config.config import resolve_config_paths
-from hod.cluster import gen_cluster_info, save_cluster_info
+from hod.cluster import cluster_usage_file, gen_cluster_info, mark_cluster_ready, save_cluster_info
 from hod.hodproc import ConfiguredSlave, ConfiguredMaster
+from hod.monitor import ServiceMonitor
 from hod.mpiservice import MASTERRANK, run_tasks, setup_tasks
 from hod.options import COMMON_HOD_CONFIG_OPTIONS, GENERAL_HOD_OPTIONS
 from hod.utils import only_if_module_is_available
@@ -73,12 +75,42 @@ class LocalOptions(GeneralOption):
         self.add_group_parser(opts, descr)
 
 
+def _job_dir(options):
+    '''Return the directory of this job in the working directory; None if $PBS_JOBID is not set.'''
+    jobid = os.getenv('PBS_JOBID')
+    if jobid is None or not options.workdir:
+        return None
+    return os.path.join(options.workdir, 'hod', jobid)
+
+
+def _write_rank_timeline(jobdir, rank):
+    '''Write the timeline of this rank to the job directory, e.g. when it failed before it was gathered.'''
+    if jobdir is None:
+        return
+    path = os.path.join(jobdir, timeline.RANK_TIMELINE_FILE % rank)
+    try:
+        if not os.path.exists(jobdir):
+            os.makedirs(jobdir)
+        timeline.write_timeline(path, timeline.process_timeline().records())
+    except (IOError, OSError) as err:
+        _log.error("Failed to write timeline of rank %s to %s: %s", rank, path, err)
+
+
 @only_if_module_is_available('mpi4py')
 def main(args):
     """Run HOD cluster."""
+    rank = MPI.COMM_WORLD.rank
+    process_timeline = timeline.process_timeline()
+    process_timeline.rank = rank
+    # starting the interpreter and the imports, which includes initialising MPI
+    start = timeline.process_start()
+    process_timeline.add('imports', process_timeline.origin if start is None else start)
+
     optparser = LocalOptions(go_args=args)
+    jobdir = _job_dir(optparser.options)
 
-    if MPI.COMM_WORLD.rank == MASTERRANK:
+    on_started = None
+    if rank == MASTERRANK:
         label = optparser.options.label
         if label is None:
             # if no label is specified, use job ID;
@@ -87,27 +119,47 @@ def main(args):
             optparser.options.label = label
 
         _log.debug("Creating cluster info using label '%s'", label)
-        cluster_info = gen_cluster_info(label, optparser.options)
-        try:
-            save_cluster_info(cluster_info)
-        except (IOError, OSError) as e:
-            _log.error("Failed to save cluster info files: %s", e)
-            sys.exit(1)
+        with timeline.span('cluster-info'):
+            cluster_info = gen_cluster_info(label, optparser.options)
+            try:
+                save_cluster_info(cluster_info)
+            except (IOError, OSError) as e:
+                _log.error("Failed to save cluster info files: %s", e)
+                sys.exit(1)
 
         _log.debug("Starting master process")
         svc = ConfiguredMaster(optparser.options)
+        svc.monitor = ServiceMonitor(rank, path=cluster_usage_file(label), jobid=os.getenv('PBS_JOBID'))
+
+        def on_started():
+            """Let 'hod wait' know that the cluster is ready, and report the startup timeline."""
+            try:
+                mark_cluster_ready(label)
+            except (IOError, OSError) as err:
+                _log.error("Failed to mark cluster '%s' as ready: %s", label, err)
+
+            if jobdir is not None and svc.timeline is not None:
+                try:
+                    timeline.report_timeline(jobdir, svc.timeline)
+                except (IOError, OSError) as err:
+                    _log.error("Failed to write startup timeline to %s: %s", jobdir, err)
     else:
         _log.debug("Starting slave process")
         svc = ConfiguredSlave(optparser.options)
+        svc.monitor = ServiceMonitor(rank, jobid=os.getenv('PBS_JOBID'))
 
     try:
         setup_tasks(svc)
-        run_tasks(svc)
+        run_tasks(svc, on_started=on_started)
+        if MPI.COMM_WORLD.rank == MASTERRANK:
+            mark_cluster_ready(optparser.options.label, ready=False)
+            svc.monitor.usage.remove()
         svc.stop_service()
         return 0
     except Exception as err:
         _log.error(str(err))
         _log.exception("HanythingOnDemand failed")
+        _write_rank_timeline(jobdir, rank)
         sys.exit(1)
 
 
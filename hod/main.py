@@ -29,28 +29,55 @@ Hanythingondemand main program.
 @author: Ewan Higgs (Universiteit Gent)
 @author: Kenneth Hoste (Universiteit Gent)
 """
+import os
 import sys
+from collections import namedtuple
 
 import hod
-from hod.subcommands import (batch, connect, clean, clone, create, destroy, dists, genconfig,
-        helptemplate, listcmd, relabel)
 
 
+# subcommands with the module and class implementing them, and their short description (see SubCommand.HELP);
+# only the module for the selected subcommand is imported, since importing all of them makes 'hod' slow to start
+SubCommandSpec = namedtuple('SubCommandSpec', ['cmd', 'module', 'classname', 'help'])
+
 SUBCOMMANDS = [
-    batch.BatchSubCommand,
-    clean.CleanSubCommand,
-    clone.CloneSubCommand,
-    connect.ConnectSubCommand,
-    create.CreateSubCommand,
-    destroy.DestroySubCommand,
-    dists.DistsSubCommand,
-    genconfig.GenConfigSubCommand,
-    helptemplate.HelpTemplateSubCommand,
-    listcmd.ListSubCommand,
-    relabel.RelabelSubCommand,
+    SubCommandSpec('batch', 'hod.subcommands.batch', 'BatchSubCommand',
+                   "Submit a job to spawn a cluster on a PBS job controller, run a job script, "
+                   "and tear down the cluster when it's done"),
+    SubCommandSpec('clean', 'hod.subcommands.clean', 'CleanSubCommand',
+                   "Remove stale cluster info."),
+    SubCommandSpec('clone', 'hod.subcommands.clone', 'CloneSubCommand',
+                   "Write hod configs to a directory for editing purposes."),
+    SubCommandSpec('connect', 'hod.subcommands.connect', 'ConnectSubCommand',
+                   "Connect to a hod cluster."),
+    SubCommandSpec('create', 'hod.subcommands.create', 'CreateSubCommand',
+                   "Submit a job to spawn a cluster on a PBS job controller"),
+    SubCommandSpec('destroy', 'hod.subcommands.destroy', 'DestroySubCommand',
+                   "Destroy an HOD cluster."),
+    SubCommandSpec('dists', 'hod.subcommands.dists', 'DistsSubCommand',
+                   "List the available distributions"),
+    SubCommandSpec('genconfig', 'hod.subcommands.genconfig', 'GenConfigSubCommand',
+                   "Write hod configs to a directory for diagnostic purposes"),
+    SubCommandSpec('help-template', 'hod.subcommands.helptemplate', 'HelpTemplateSubCommand',
+                   "Print the values of the configuration templates based on the current machine."),
+    SubCommandSpec('list', 'hod.subcommands.listcmd', 'ListSubCommand',
+                   "List submitted/running clusters"),
+    SubCommandSpec('relabel', 'hod.subcommands.relabel', 'RelabelSubCommand',
+                   "Change the label of an existing job."),
+    SubCommandSpec('top', 'hod.subcommands.top', 'TopSubCommand',
+                   "Show the resource usage of the services of an HOD cluster."),
+    SubCommandSpec('wait', 'hod.subcommands.wait', 'WaitSubCommand',
+                   "Wait until an HOD cluster is ready."),
 ]
 
-SUBCOMMAND_CLASSES = dict([(sc.CMD, sc) for sc in SUBCOMMANDS])
+SUBCOMMAND_SPECS = dict([(spec.cmd, spec) for spec in SUBCOMMANDS])
+
+
+def subcommand_class(subcmd):
+    """Import the module implementing the specified subcommand, and return its class."""
+    spec = SUBCOMMAND_SPECS[subcmd]
+    module = __import__(spec.module, fromlist=[spec.classname])
+    return getattr(module, spec.classname)
 
 
 def usage():
@@ -58,17 +85,17 @@ def usage():
     usage = "%s version %s - Run services within an HPC cluster\n" % (hod.NAME, hod.VERSION)
     usage += "usage: hod <subcommand> [subcommand options]\n"
     usage += "Available subcommands (one of these must be specified!):\n"
-    for sc in SUBCOMMANDS:
-        usage += '    {0:16}{1}\n'.format(sc.CMD, sc.HELP)
+    for spec in SUBCOMMANDS:
+        usage += '    {0:16}{1}\n'.format(spec.cmd, spec.help)
 
     return usage
 
 
 def init_subcmd(args):
     """Initialize subcommand based on specified arguments; returns None is no subcommand was found."""
-    for subcmd in SUBCOMMAND_CLASSES:
+    for subcmd in SUBCOMMAND_SPECS:
         if subcmd in args:
-            subcmd_class = SUBCOMMAND_CLASSES[subcmd]
+            subcmd_class = subcommand_class(subcmd)
             return subcmd_class(), args[1:].remove(subcmd)
     return None, args
 
@@ -89,4 +116,6 @@ def main(args):
         return 0
 
 if __name__ == '__main__':
+    # the hod command line tool doesn't run under MPI; don't let fancylogger import (and initialise) mpi4py
+    os.environ.setdefault('FANCYLOGGER_IGNORE_MPI4PY', '1')
     sys.exit(main(sys.argv))
@@ -0,0 +1,342 @@
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+# #
+"""
+Resource usage of the services of a cluster, as shown by 'hod top'.
+
+The processes of a service are tagged with $HOD_SERVICE (see
+hod.work.config_service), which is inherited by all processes they start.
+Each rank samples the CPU time, memory and disk I/O of the tagged processes
+from /proc at a fixed interval, together with the network traffic of the node,
+and sends the usage since the previous sample to the master. The master
+writes the latest usage of all ranks to the cluster info directory.
+"""
+import json
+import os
+import socket
+import time
+
+from vsc.utils import fancylogger
+
+from hod.table import format_table
+
+_log = fancylogger.getLogger(fname=False)
+
+# environment variable with the name of the service a process belongs to
+SERVICE_ENV = 'HOD_SERVICE'
+
+# number of seconds between samples
+MONITOR_INTERVAL = 10
+
+PROC = '/proc'
+NET_DEV = '/proc/net/dev'
+
+# usage per service in a sample: number of processes, CPU seconds, resident memory (bytes),
+# bytes read from and written to storage
+PROCS, CPU, RSS, READ, WRITE = range(5)
+
+NODE_HEADERS = ['HOST', 'RANK', 'PROCS', 'CPU', 'RSS', 'DISK READ', 'DISK WRITE', 'NET RX', 'NET TX', 'AGE']
+SERVICE_HEADERS = ['SERVICE', 'NODES', 'PROCS', 'CPU', 'RSS', 'DISK READ', 'DISK WRITE']
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def process_service(pid, jobid=None, proc=PROC):
+    '''
+    Return the service the process with the given pid belongs to (see
+    SERVICE_ENV), or None if it's not part of a service (of the job with the
+    given job id, if specified) or its environment can't be read.
+    '''
+    try:
+        with open(os.path.join(proc, str(pid), 'environ')) as fh:
+            env = dict([var.split('=', 1) for var in fh.read().split('\0') if '=' in var])
+    except (IOError, OSError):
+        return None
+    if jobid is not None and env.get('PBS_JOBID') != jobid:
+        return None
+    return env.get(SERVICE_ENV)
+
+
+def process_counters(pid, proc=PROC):
+    '''
+    Return [CPU seconds, resident memory, bytes read, bytes written] of the
+    process with the given pid, or None if it is gone. The I/O counters are 0
+    if they can't be read.
+    '''
+    try:
+        with open(os.path.join(proc, str(pid), 'stat')) as fh:
+            stat = fh.read()
+        # the 2nd field (command) can contain spaces; utime, stime and rss are the 14th, 15th and 24th field
+        fields = stat[stat.rindex(')') + 2:].split()
+        cpu = float(int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+        rss = int(fields[21]) * _PAGE_SIZE
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    read_bytes, write_bytes = 0, 0
+    try:
+        with open(os.path.join(proc, str(pid), 'io')) as fh:
+            counters = dict([line.split(':', 1) for line in fh.read().splitlines() if ':' in line])
+        read_bytes, write_bytes = int(counters['read_bytes']), int(counters['write_bytes'])
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    return [cpu, rss, read_bytes, write_bytes]
+
+
+def net_counters(net_dev=NET_DEV):
+    '''Return [bytes received, bytes sent] over all network interfaces of this node, except loopback.'''
+    rx_bytes, tx_bytes = 0, 0
+    try:
+        with open(net_dev) as fh:
+            lines = fh.read().splitlines()[2:]
+    except (IOError, OSError):
+        return [0, 0]
+    for line in lines:
+        if ':' not in line:
+            continue
+        name, counters = line.split(':', 1)
+        counters = counters.split()
+        if name.strip() == 'lo' or len(counters) < 9:
+            continue
+        rx_bytes += int(counters[0])
+        tx_bytes += int(counters[8])
+    return [rx_bytes, tx_bytes]
+
+
+class ServiceSampler(object):
+    """
+    Sample the resource usage of the service processes on this node. The
+    environment of a process is only read the first time it is seen, so the
+    cost of a sample mostly depends on the number of service processes.
+    """
+    def __init__(self, rank, jobid=None, proc=PROC, net_dev=NET_DEV):
+        self.rank = rank
+        self.host = socket.gethostname()
+        self.jobid = jobid
+        self.proc = proc
+        self.net_dev = net_dev
+        # service of each process seen so far (None if not part of a service)
+        self._services = dict()
+        self._prev_counters = dict()
+        self._prev_net = None
+        self._prev_time = None
+        self.sample()
+
+    def _service_pids(self):
+        '''Return dict with the service of each running process which is part of a service.'''
+        try:
+            pids = set([int(entry) for entry in os.listdir(self.proc) if entry.isdigit()])
+        except OSError as err:
+            _log.debug("Failed to list processes in %s: %s", self.proc, err)
+            pids = set()
+        services = dict()
+        for pid in pids:
+            if pid not in self._services:
+                self._services[pid] = process_service(pid, self.jobid, self.proc)
+            if self._services[pid] is not None:
+                services[pid] = self._services[pid]
+        # forget processes which are gone, their pids may be reused
+        for pid in set(self._services) - pids:
+            del self._services[pid]
+        return services
+
+    def sample(self):
+        '''
+        Return the resource usage on this node since the previous sample:
+        a dict with the rank, host, time, interval (seconds), the usage of each
+        service (see PROCS, CPU, RSS, READ, WRITE; RSS is the current value)
+        and the network traffic [received, sent] in bytes.
+        '''
+        now = time.time()
+        usage = dict()
+        counters = dict()
+        for pid, service in self._service_pids().items():
+            current = process_counters(pid, self.proc)
+            if current is None:
+                continue
+            counters[pid] = current
+            # processes started since the previous sample count from 0
+            prev = self._prev_counters.get(pid, [0, 0, 0, 0])
+            values = usage.setdefault(service, [0, 0.0, 0, 0, 0])
+            values[PROCS] += 1
+            values[CPU] += max(current[0] - prev[0], 0)
+            values[RSS] += current[1]
+            values[READ] += max(current[2] - prev[2], 0)
+            values[WRITE] += max(current[3] - prev[3], 0)
+        net = net_counters(self.net_dev)
+
+        interval = 0
+        if self._prev_time is not None:
+            interval = now - self._prev_time
+        net_usage = [0, 0]
+        if self._prev_net is not None:
+            net_usage = [max(cur - prev, 0) for cur, prev in zip(net, self._prev_net)]
+
+        self._prev_counters = counters
+        self._prev_net = net
+        self._prev_time = now
+        return {
+            'rank': self.rank,
+            'host': self.host,
+            'time': now,
+            'interval': interval,
+            'services': usage,
+            'net': net_usage,
+        }
+
+
+class ClusterUsage(object):
+    """Latest resource usage reported by each rank, kept by the master."""
+    def __init__(self, path):
+        self.path = path
+        self.samples = dict()
+
+    def update(self, sample):
+        '''Add the sample of a rank.'''
+        self.samples[sample['rank']] = sample
+
+    def write(self):
+        '''Write the latest samples of all ranks to the file (atomically).'''
+        tmp_path = '%s.%d' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as fh:
+            json.dump({'time': time.time(), 'samples': [self.samples[rank] for rank in sorted(self.samples)]}, fh)
+        os.rename(tmp_path, self.path)
+
+    def remove(self):
+        '''Remove the file, e.g. once the cluster is stopped.'''
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class ServiceMonitor(object):
+    """
+    Sample the resource usage of the services on this rank every interval
+    seconds; the master also keeps track of the usage of all ranks (see
+    hod.supervisor.Supervisor), and writes it to path.
+    """
+    def __init__(self, rank, path=None, jobid=None, interval=MONITOR_INTERVAL):
+        self.sampler = ServiceSampler(rank, jobid=jobid)
+        self.interval = interval
+        self.next_sample = time.time() + interval
+        self.usage = None
+        if path is not None:
+            self.usage = ClusterUsage(path)
+
+    def due(self):
+        '''Return the number of seconds until the next sample is due.'''
+        return self.next_sample - time.time()
+
+    def sample(self):
+        '''Take a sample and schedule the next one.'''
+        self.next_sample = time.time() + self.interval
+        return self.sampler.sample()
+
+
+def read_usage(path):
+    '''Read the resource usage of a cluster as written by ClusterUsage.'''
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def _fmt_bytes(value):
+    '''Format a number of bytes with a binary unit, e.g. 1.5G.'''
+    for unit in ['B', 'K', 'M', 'G', 'T']:
+        if abs(value) < 1024 or unit == 'T':
+            break
+        value /= 1024.0
+    if unit == 'B':
+        return '%d%s' % (value, unit)
+    return '%.1f%s' % (value, unit)
+
+
+def _rate(value, interval):
+    '''Format a number of bytes during interval as a rate.'''
+    if not interval:
+        return '-'
+    return _fmt_bytes(value / interval) + '/s'
+
+
+def _cpu(seconds, interval):
+    '''Format CPU time during interval as a percentage of a core (like top).'''
+    if not interval:
+        return '-'
+    return '%.0f%%' % (100.0 * seconds / interval)
+
+
+def _total(usages):
+    '''Add up a list of usages per service (see PROCS, CPU, RSS, READ, WRITE).'''
+    total = [0, 0.0, 0, 0, 0]
+    for usage in usages:
+        total = [tot + value for tot, value in zip(total, usage)]
+    return total
+
+
+def node_rows(usage, now=None):
+    '''Return table rows (see NODE_HEADERS) with the resource usage of each rank.'''
+    if now is None:
+        now = time.time()
+    rows = []
+    for sample in usage['samples']:
+        interval = sample['interval']
+        total = _total(sample['services'].values())
+        rows.append([sample['host'], str(sample['rank']), str(total[PROCS]), _cpu(total[CPU], interval),
+                     _fmt_bytes(total[RSS]), _rate(total[READ], interval), _rate(total[WRITE], interval),
+                     _rate(sample['net'][0], interval), _rate(sample['net'][1], interval),
+                     '%ds' % max(now - sample['time'], 0)])
+    return rows
+
+
+def service_rows(usage):
+    '''Return table rows (see SERVICE_HEADERS) with the resource usage of each service over all ranks.'''
+    services = dict()
+    for sample in usage['samples']:
+        interval = sample['interval']
+        for service, values in sample['services'].items():
+            if not interval:
+                continue
+            # rates, so samples over different intervals can be added up
+            rates = [values[PROCS], values[CPU] / interval, values[RSS],
+                     values[READ] / interval, values[WRITE] / interval]
+            nodes, total = services.get(service, (0, [0, 0.0, 0, 0, 0]))
+            services[service] = (nodes + 1, _total([total, rates]))
+    rows = []
+    for service in sorted(services):
+        nodes, total = services[service]
+        rows.append([service, str(nodes), str(total[PROCS]), _cpu(total[CPU], 1), _fmt_bytes(total[RSS]),
+                     _rate(total[READ], 1), _rate(total[WRITE], 1)])
+    return rows
+
+
+def format_usage(usage, now=None):
+    '''Format the resource usage of a cluster as a table per node and per service.'''
+    out = ''
+    rows = node_rows(usage, now=now)
+    if rows:
+        out += format_table(rows, NODE_HEADERS) + '\n'
+    rows = service_rows(usage)
+    if rows:
+        out += '\n' + format_table(rows, SERVICE_HEADERS) + '\n'
+    return out
@@ -29,14 +29,16 @@ Supporting MPI functionality
 @author: Ewan Higgs (Ghent University)
 @author: Kenneth Hoste (Ghent University)
 """
-import socket
-import time
+import sys
+import threading
 from collections import namedtuple
 from vsc.utils import fancylogger
 
 import hod.node.node as node
 from hod.config.config import ConfigOpts
 from hod.config.template import ConfigTemplate, TemplateRegistry, TemplateResolver, register_templates
+from hod.supervisor import Supervisor
+from hod.timeline import gather_timeline, span
 from hod.utils import only_if_module_is_available
 
 # optional packages, not always required
@@ -50,12 +52,21 @@ _log = fancylogger.getLogger(fname=False)
 
 
 
-__all__ = ['MASTERRANK', 'Task', 'barrier', 'MpiService', 'setup_tasks', 'run_tasks']
+__all__ = ['MASTERRANK', 'Task', 'ClusterPlan', 'CommPool', 'barrier', 'MpiService', 'setup_tasks', 'run_tasks']
 
 MASTERRANK = 0
 
+# version of the layout of ClusterPlan (and the objects in it);
+# bump this whenever it changes so mismatching hod installations are detected
+PLAN_VERSION = 1
+
 Task = namedtuple('Task', ['type', 'name', 'ranks', 'config_opts', 'master_env'])
 
+# Everything the slaves need to set up their node, sent by the master in a single broadcast:
+# the master template arguments, the parsed hod configuration (before autogen,
+# which depends on the node) and the tasks (with the ranks they run on).
+ClusterPlan = namedtuple('ClusterPlan', ['version', 'master_template_args', 'config', 'tasks'])
+
 def _who_is_out_there(comm, rank):
     """Get all self.ranks of members of communicator"""
     others = comm.allgather(rank)
@@ -124,6 +135,44 @@ def _stop_comm(comm):
         comm.Disconnect()
 
 
+class CommPool(object):
+    """
+    Communicators for subsets of the ranks of a communicator. Tasks running on
+    the same set of ranks share a single communicator, which is created on first
+    use. Since creating a communicator is collective, all ranks must request the
+    communicators in the same order.
+    """
+    def __init__(self, comm):
+        self.comm = comm
+        self._comms = dict()
+        # keep creation order so the communicators are freed in the same order on all ranks
+        self._keys = []
+
+    def get(self, ranks):
+        """Return the communicator for the given ranks (COMM_NULL if this rank is not one of them)."""
+        key = frozenset(ranks)
+        if key not in self._comms:
+            self._comms[key] = _make_comm_group(self.comm, ranks)
+            self._keys.append(key)
+        else:
+            _log.debug("Reusing communicator for ranks %s", ranks)
+        return self._comms[key]
+
+    def __len__(self):
+        return len(self._keys)
+
+    @only_if_module_is_available('mpi4py')
+    def free(self):
+        """Free all communicators in the pool."""
+        _log.debug("Freeing %d communicators", len(self._keys))
+        for key in self._keys:
+            comm = self._comms[key]
+            if comm != MPI.COMM_NULL:
+                comm.Free()
+        self._comms = dict()
+        self._keys = []
+
+
 def _master_spread(comm, tasks):
     retval = comm.bcast(tasks, root=MASTERRANK)
     _log.debug("Distributed '%s' from masterrank %s", tasks, MASTERRANK)
@@ -131,7 +180,7 @@ def _master_spread(comm, tasks):
 
 
 def _slave_spread(comm):
-    tasks = comm.bcast(root=MASTERRANK)
+    tasks = comm.bcast(None, root=MASTERRANK)
     _log.debug("Received '%s' from masterrank %s", tasks, MASTERRANK)
     return tasks
 
@@ -143,40 +192,57 @@ def master_template_opts(stub_config_opts=None):
     If stub_config_opts is given, this function pulls the doctrings from the existing
     configuration
     '''
-    data_interface = node.sorted_network(node.get_networks())[0]
+    data_interface = node.sorted_network(node.discovery.networks())[0]
     master_dataname = data_interface.hostname
     master_dataaddress = data_interface.addr
-    fqdn = socket.getfqdn()
+    fqdn = node.discovery.fqdn()
     docs = dict()
     if stub_config_opts is not None:
         docs = dict([(opt.name, opt.doc) for opt in stub_config_opts])
     return [
         ConfigTemplate('masterhostname', fqdn, docs.get('masterhostname', '')),
-        ConfigTemplate('masterhostaddress', socket.gethostbyname(fqdn), docs.get('masterhostaddress', '')),
+        ConfigTemplate('masterhostaddress', node.discovery.hostaddress(), docs.get('masterhostaddress', '')),
         ConfigTemplate('masterdataname', master_dataname, docs.get('masterdataname', '')),
         ConfigTemplate('masterdataaddress', master_dataaddress, docs.get('masterdataaddress', '')),
         ]
  
 def setup_tasks(svc):
-    """Setup the per node services and spread the tasks out."""
+    """
+    Setup the per node services and spread the tasks out.
+
+    The master parses the configuration and makes the distribution, and sends
+    the resulting ClusterPlan to the slaves in a single broadcast. Slaves only
+    configure their own node using the plan.
+    """
     _log.debug("No tasks found. Running distribution and spread.")
 
-    # Configure
     if svc.rank == MASTERRANK:
-        master_template_kwargs = master_template_opts()
-        _master_spread(svc.comm, master_template_kwargs)
+        try:
+            with span('master-template-opts'):
+                master_template_args = master_template_opts()
+            svc.distribution(*master_template_args)
+        except Exception:
+            # don't leave the slaves waiting for the plan
+            if svc.size > 1:
+                _master_spread(svc.comm, None)
+            raise
+        if svc.size > 1:
+            plan = ClusterPlan(PLAN_VERSION, master_template_args, svc.config, svc.tasks)
+            with span('spread-plan'):
+                _master_spread(svc.comm, plan)
     else:
-        master_template_kwargs = _slave_spread(svc.comm)
+        # includes waiting for the master to make the distribution
+        with span('spread-plan'):
+            plan = _slave_spread(svc.comm)
+        if plan is None:
+            raise RuntimeError("Master failed to make the distribution")
+        if plan.version != PLAN_VERSION:
+            raise RuntimeError("Cluster plan version %s from master does not match version %s on rank %d" %
+                               (plan.version, PLAN_VERSION, svc.rank))
+        svc.tasks = plan.tasks
+        svc.distribution(*plan.master_template_args, config=plan.config)
 
-    svc.distribution(*master_template_kwargs)
     _log.debug("Setup tasks on rank '%d': %s", svc.rank, svc.tasks)
-    barrier(svc.comm, "Setup tasks on rank '%d'" % svc.rank)
-
-    # Collect tasks
-    if svc.rank == MASTERRANK:
-        _master_spread(svc.comm, svc.tasks)
-    else:
-        svc.tasks = _slave_spread(svc.comm)
 
 
 def _mkconfigopts(cfg_opts):
@@ -185,56 +251,120 @@ def _mkconfigopts(cfg_opts):
     for ct  in cfg_opts.master_template_kwargs:
         reg.register(ct)
 
-    resolver = TemplateResolver(**reg.to_kwargs())
+    resolver = TemplateResolver.from_registry(reg)
     return ConfigOpts.from_params(cfg_opts, resolver)
 
 
+def _task_waves(tasks):
+    '''
+    Group the tasks in waves of tasks that can be started at the same time:
+    a task is started in the wave following the last wave containing a task it
+    has to start after (see the After and Requires options of service configs).
+    Returns a list of lists of indices in tasks.
+    '''
+    names = [task.name for task in tasks]
+    deps = []
+    for task in tasks:
+        for name in task.config_opts.requires:
+            if name not in names:
+                raise ValueError("Service %s requires service %s, which is not part of the cluster" %
+                                 (task.name, name))
+        # ordering on services which are not part of the cluster is ignored
+        deps.append(set([idx for idx, name in enumerate(names)
+                         if name in task.config_opts.after or name in task.config_opts.requires]))
+
+    waves = []
+    done = set()
+    while len(done) < len(tasks):
+        wave = [idx for idx in range(len(tasks)) if idx not in done and deps[idx] <= done]
+        if not wave:
+            cycle = [names[idx] for idx in range(len(tasks)) if idx not in done]
+            raise ValueError("Dependency cycle between services %s" % ', '.join(cycle))
+        waves.append(wave)
+        done.update(wave)
+    _log.debug("Start order of tasks: %s", [[names[idx] for idx in wave] for wave in waves])
+    return waves
+
+
+def _run_concurrently(calls):
+    '''
+    Run the given callables in parallel threads and wait until they are all done.
+    The first exception that was raised (if any) is reraised afterwards.
+    '''
+    if len(calls) < 2:
+        for call in calls:
+            call()
+        return
+
+    errors = []
+    def _run(call):
+        try:
+            call()
+        except Exception:
+            errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=_run, args=(call,)) for call in calls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+
 @only_if_module_is_available('mpi4py')
-def run_tasks(svc):
-    """Make communicators for tasks and execute the work there"""
+def run_tasks(svc, on_started=None):
+    """
+    Make communicators for tasks and execute the work there.
+    on_started is called (if specified) once all work was started on all ranks.
+    """
     # Based on initial dist, create the groups and communicators and map with work
     active_work = []
-    wait_iter_sleep = 15  # run through all active work, then wait wait_iter_sleep seconds
+    task_work = []
 
     for task in svc.tasks:
         # pass any existing previous work
         _log.debug("newcomm  for ranks %s for work %s: %s", task.ranks, task.name, task.type)
-        newcomm = _make_comm_group(svc.comm, task.ranks)
+        with span('make-comm-group'):
+            newcomm = svc.comm_pool.get(task.ranks)
 
         if newcomm == MPI.COMM_NULL:
             _log.debug('Skipping work setup for rank %d of this type %s', svc.rank, task.type)
+            task_work.append(None)
             continue
 
         _log.debug('Setting up rank %d of this type %s', svc.rank, task.type)
-        svc.tempcomm.append(newcomm)
-        cfg = _mkconfigopts(task.config_opts)
-        work = task.type(cfg, task.master_env)
-        _log.debug("work %s begin", task.type.__name__)
-        work.prepare_work_cfg()
+        with span('prepare-work', service=task.name):
+            cfg = _mkconfigopts(task.config_opts)
+            work = task.type(cfg, task.master_env)
+            _log.debug("work %s begin", task.type.__name__)
+            work.prepare_work_cfg()
         # adding started work
         active_work.append(work)
-
-    for act_work in active_work:
-        _log.debug("work %s start", act_work.__class__.__name__)
-        act_work.do_work_start()
-
-    # all work is started now
-    while len(active_work):
-        _log.debug("amount of active work %s", len(active_work))
-        for act_work in active_work:
-
-            should_cleanup = act_work.do_work_wait()
-            if should_cleanup:
-                _log.debug("work %s stop", act_work.__class__.__name__)
-                act_work.do_work_stop()
-                _log.debug("work %s end", act_work.__class__.__name__)
-                act_work.work_end()
-
-                _log.debug("Removing %s from active_work", act_work)
-                active_work.remove(act_work)
-        if len(active_work):
-            _log.debug('Still %s active work left. sleeping %s seconds', len(active_work), wait_iter_sleep)
-            time.sleep(wait_iter_sleep)
+        task_work.append(work)
+
+    # services in the same wave are started at the same time; every rank passes
+    # the same barriers for each wave, whether it runs any of its tasks or not
+    for wave in _task_waves(svc.tasks):
+        names = ', '.join([svc.tasks[idx].name for idx in wave])
+        works = [task_work[idx] for idx in wave if task_work[idx] is not None]
+        with span('barrier'):
+            barrier(svc.comm, "Going to run pre-start work for %s on rank %s" % (names, svc.rank))
+        _run_concurrently([work.pre_start_work_service for work in works])
+        with span('barrier'):
+            barrier(svc.comm, "Going to start work for %s on rank %s" % (names, svc.rank))
+        _log.debug("work %s start", [work.__class__.__name__ for work in works])
+        _run_concurrently([work.start_work_service for work in works])
+
+    with span('barrier'):
+        barrier(svc.comm, "All work started on rank %s" % svc.rank)
+    # the master gets the startup timeline of all ranks
+    svc.timeline = gather_timeline(svc.comm, MASTERRANK)
+    if on_started is not None:
+        on_started()
+
+    # all work is started now; block until it's over on all ranks
+    Supervisor(svc.comm, active_work, MASTERRANK, monitor=svc.monitor).run()
     _log.debug("No more active work left.")
 
 
@@ -251,15 +381,20 @@ class MpiService(object):
         self.size = self.comm.Get_size()
         self.rank = self.comm.Get_rank()
 
-        self.tempcomm = []
+        self.comm_pool = CommPool(self.comm)
 
         self.tasks = None
+        # configuration to send along with the tasks
+        self.config = None
+        # startup timeline of all ranks (on the master only), see run_tasks
+        self.timeline = None
+        # resource usage of the services (see hod.monitor), sampled while the work is running
+        self.monitor = None
 
     def stop_service(self):
         """End all communicators"""
-        self.log.debug("Stopping tempcomm")
-        for comm in self.tempcomm:
-            _stop_comm(comm)
+        self.log.debug("Freeing task communicators")
+        self.comm_pool.free()
         self.log.debug("Stopping self.comm")
         _stop_comm(self.comm)
 
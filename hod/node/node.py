@@ -29,6 +29,8 @@ Network utilities
 @author: Ewan Higgs (Ghent University)
 @author: Kenneth Hoste (Ghent University)
 """
+import copy
+import json
 import re
 import os
 import socket
@@ -51,6 +53,17 @@ except ImportError:
 NetworkInterface = namedtuple('NetworkInterface', 'hostname,addr,device,mask_bits')
 _log = fancylogger.getLogger(fname=False)
 
+# path of a file in which discovered node properties are kept, so they can be
+# shared between the processes of a job on the same node (optional)
+DISCOVERY_CACHE_ENV = 'HOD_DISCOVERY_CACHE'
+
+PROC_CGROUP = '/proc/self/cgroup'
+CGROUP_ROOT = '/sys/fs/cgroup'
+NUMA_NODE_DIR = '/sys/devices/system/node'
+
+# cgroup v1 reports 'no limit' as a huge number (close to 2**63)
+CGROUP_UNLIMITED = 2 ** 60
+
 
 @only_if_module_is_available('netaddr')
 def netmask2maskbits(netmask):
@@ -214,6 +227,340 @@ def get_memory():
     memory['ulimit'] = _get_memory_ulimit_v()
     return memory
 
+def get_usable_cores():
+    """Return list of indices of the cores this process may run on."""
+    return [idx for idx, used in enumerate(sched_getaffinity().cpus) if used]
+
+
+def parse_cpulist(cpulist):
+    """
+    Parse a list of cpus (or NUMA nodes) in the format used by the kernel,
+    e.g. '0-3,8,10-11', into a list of indices.
+    """
+    indices = []
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            indices.extend(range(int(first), int(last) + 1))
+        else:
+            indices.append(int(part))
+    return indices
+
+
+def _read_first_line(path):
+    '''Return the first line of the file (stripped), or None if it can't be read.'''
+    try:
+        with open(path) as fh:
+            return fh.readline().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _cgroup_paths(proc_cgroup=PROC_CGROUP):
+    """
+    Return dict mapping cgroup controllers to the cgroup of this process;
+    the unified (v2) hierarchy is mapped by the empty string.
+    """
+    paths = {}
+    try:
+        lines = open(proc_cgroup).read().splitlines()
+    except (IOError, OSError) as err:
+        _log.debug("Could not read %s: %s", proc_cgroup, err)
+        return paths
+    for line in lines:
+        fields = line.split(':', 2)
+        if len(fields) != 3:
+            continue
+        for controller in fields[1].split(','):
+            paths[controller] = fields[2]
+    return paths
+
+
+def _cgroup_dirs(mount, path):
+    """
+    Return the directories of the cgroup and of its ancestors (up to the mount
+    point), starting with the cgroup itself. When the cgroup is not visible
+    (e.g. in a cgroup namespace), only the mount point is returned.
+    """
+    dirs = []
+    path = path.strip('/')
+    while path:
+        cgdir = os.path.join(mount, path)
+        if os.path.isdir(cgdir):
+            dirs.append(cgdir)
+        path = os.path.dirname(path)
+    dirs.append(mount)
+    return dirs
+
+
+def _cgroup_min(dirs, read_limit):
+    '''Return the smallest limit set on the given cgroup directories, or None.'''
+    limits = [read_limit(cgdir) for cgdir in dirs]
+    limits = [x for x in limits if x is not None]
+    if limits:
+        return min(limits)
+    return None
+
+
+def _cgroup_memory_v1(cgdir):
+    '''Memory limit (in bytes) of a cgroup v1 memory cgroup.'''
+    limit = _read_first_line(os.path.join(cgdir, 'memory.limit_in_bytes'))
+    if limit is None or not limit.isdigit() or int(limit) >= CGROUP_UNLIMITED:
+        return None
+    return int(limit)
+
+
+def _cgroup_memory_v2(cgdir):
+    '''Memory limit (in bytes) of a cgroup v2 cgroup.'''
+    limit = _read_first_line(os.path.join(cgdir, 'memory.max'))
+    if limit is None or not limit.isdigit():
+        return None
+    return int(limit)
+
+
+def _cgroup_cpu_v1(cgdir):
+    '''CPU bandwidth limit (in number of cpus) of a cgroup v1 cpu cgroup.'''
+    quota = _read_first_line(os.path.join(cgdir, 'cpu.cfs_quota_us'))
+    period = _read_first_line(os.path.join(cgdir, 'cpu.cfs_period_us'))
+    # a quota of -1 means there is no limit
+    if quota is None or period is None or not quota.isdigit() or not period.isdigit() or not int(period):
+        return None
+    return float(quota) / int(period)
+
+
+def _cgroup_cpu_v2(cgdir):
+    '''CPU bandwidth limit (in number of cpus) of a cgroup v2 cgroup.'''
+    cpu_max = _read_first_line(os.path.join(cgdir, 'cpu.max'))
+    if cpu_max is None:
+        return None
+    # 'max <period>' means there is no limit
+    fields = cpu_max.split()
+    if len(fields) != 2 or not fields[0].isdigit() or not fields[1].isdigit() or not int(fields[1]):
+        return None
+    return float(fields[0]) / int(fields[1])
+
+
+def _cgroup_cpuset(dirs, filenames):
+    '''Return the first cpu (or memory node) list found in the given cgroup directories.'''
+    for cgdir in dirs:
+        for filename in filenames:
+            cpulist = _read_first_line(os.path.join(cgdir, filename))
+            if cpulist:
+                return parse_cpulist(cpulist)
+    return None
+
+
+def get_cgroup_limits(proc_cgroup=PROC_CGROUP, cgroup_root=CGROUP_ROOT):
+    """
+    Return the limits imposed on this process by cgroups (v1 or v2), as a dict with
+      memory: memory limit in bytes
+      cpus: CPU bandwidth limit, in number of cpus (may be fractional)
+      cpuset: list of cpus the process may run on
+      mems: list of NUMA nodes the process may allocate memory on
+    Limits which are not set are None.
+    """
+    limits = dict(memory=None, cpus=None, cpuset=None, mems=None)
+    paths = _cgroup_paths(proc_cgroup)
+
+    # with the hybrid layout, the v2 hierarchy is mounted at <root>/unified
+    unified = os.path.join(cgroup_root, 'unified')
+    if not os.path.isdir(unified):
+        unified = cgroup_root
+    v2_dirs = []
+    if '' in paths:
+        v2_dirs = _cgroup_dirs(unified, paths[''])
+
+    if 'memory' in paths:
+        memory_dirs = _cgroup_dirs(os.path.join(cgroup_root, 'memory'), paths['memory'])
+        limits['memory'] = _cgroup_min(memory_dirs, _cgroup_memory_v1)
+    elif v2_dirs:
+        limits['memory'] = _cgroup_min(v2_dirs, _cgroup_memory_v2)
+
+    if 'cpu' in paths:
+        cpu_dirs = _cgroup_dirs(os.path.join(cgroup_root, 'cpu'), paths['cpu'])
+        limits['cpus'] = _cgroup_min(cpu_dirs, _cgroup_cpu_v1)
+    elif v2_dirs:
+        limits['cpus'] = _cgroup_min(v2_dirs, _cgroup_cpu_v2)
+
+    if 'cpuset' in paths:
+        cpuset_dirs = _cgroup_dirs(os.path.join(cgroup_root, 'cpuset'), paths['cpuset'])
+        limits['cpuset'] = _cgroup_cpuset(cpuset_dirs, ['cpuset.effective_cpus', 'cpuset.cpus'])
+        limits['mems'] = _cgroup_cpuset(cpuset_dirs, ['cpuset.effective_mems', 'cpuset.mems'])
+    elif v2_dirs:
+        limits['cpuset'] = _cgroup_cpuset(v2_dirs, ['cpuset.cpus.effective'])
+        limits['mems'] = _cgroup_cpuset(v2_dirs, ['cpuset.mems.effective'])
+
+    _log.debug("Collected cgroup limits %s", limits)
+    return limits
+
+
+def get_numa_nodes(node_dir=NUMA_NODE_DIR):
+    """
+    Return list of NUMA nodes of this machine, as dicts with the id of the
+    node, the list of its cpus and its total amount of memory (in bytes).
+    """
+    re_memtotal = re.compile(r"MemTotal:\s*(?P<mem>\d+)\s*kB")
+    numa = []
+    try:
+        entries = os.listdir(node_dir)
+    except OSError as err:
+        _log.debug("Could not list NUMA nodes in %s: %s", node_dir, err)
+        return numa
+    for entry in entries:
+        if not re.match(r"^node\d+$", entry):
+            continue
+        path = os.path.join(node_dir, entry)
+        cpus = parse_cpulist(_read_first_line(os.path.join(path, 'cpulist')) or '')
+        memtotal = 0
+        try:
+            reg = re_memtotal.search(open(os.path.join(path, 'meminfo')).read())
+            if reg:
+                memtotal = int(reg.group('mem')) * 1024
+        except (IOError, OSError):
+            pass
+        numa.append(dict(id=int(entry[len('node'):]), cpus=cpus, memtotal=memtotal))
+    numa.sort(key=lambda x: x['id'])
+    _log.debug("Collected NUMA nodes %s", numa)
+    return numa
+
+
+def get_pbs_ppn():
+    """
+    Return the number of processors per node allocated to the job by PBS
+    (PBS_NUM_PPN, or PBS_NP divided over PBS_NUM_NODES), or None if unknown.
+    """
+    try:
+        if os.getenv('PBS_NUM_PPN'):
+            return int(os.environ['PBS_NUM_PPN'])
+        if os.getenv('PBS_NP'):
+            return max(int(os.environ['PBS_NP']) / int(os.getenv('PBS_NUM_NODES', 1)), 1)
+    except ValueError as err:
+        _log.warning("Invalid PBS processor count in environment: %s", err)
+    return None
+
+
+def _to_str(value):
+    '''Convert unicode strings (from JSON) back to str, recursively.'''
+    if isinstance(value, unicode):
+        return str(value)
+    elif isinstance(value, list):
+        return [_to_str(x) for x in value]
+    elif isinstance(value, dict):
+        return dict([(_to_str(k), _to_str(v)) for k, v in value.items()])
+    return value
+
+
+class DiscoveryCache(object):
+    """
+    Cache for properties of the local node which are expensive to discover
+    (e.g. get_networks does a reverse DNS lookup for every interface).
+
+    Values are discovered on first use and kept for the lifetime of the process.
+    If a path is given, they are also stored in that (JSON) file, so other
+    processes can reuse them, except for the values in PROCESS_LOCAL which
+    depend on the process (e.g. its CPU affinity). Use invalidate() to
+    discover them again.
+    """
+    PROCESS_LOCAL = ('usablecores', 'ulimit', 'cgroup')
+
+    def __init__(self, path=None):
+        self.path = path
+        self._values = dict()
+        self._local = dict()
+        self._loaded = False
+
+    def _load(self):
+        '''Load the values stored by other processes, if any.'''
+        if self._loaded or self.path is None:
+            return
+        self._loaded = True
+        try:
+            if os.stat(self.path).st_uid != os.getuid():
+                _log.warning("Ignoring discovery cache %s which is owned by another user", self.path)
+                return
+            with open(self.path) as fh:
+                values = json.load(fh)
+        except (IOError, OSError, ValueError) as err:
+            _log.debug("Could not load discovery cache %s: %s", self.path, err)
+            return
+        for key, value in values.items():
+            if key not in self.PROCESS_LOCAL:
+                self._values.setdefault(str(key), _to_str(value))
+
+    def _save(self):
+        '''Store the values in the cache file (atomically), if any.'''
+        if self.path is None:
+            return
+        tmp_path = '%s.%d' % (self.path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as fh:
+                json.dump(self._values, fh)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as err:
+            _log.debug("Could not save discovery cache %s: %s", self.path, err)
+
+    def get(self, key, discover):
+        '''Return the value for key, calling discover() if it isn't known yet.'''
+        if key in self.PROCESS_LOCAL:
+            if key not in self._local:
+                self._local[key] = discover()
+            return self._local[key]
+        self._load()
+        if key not in self._values:
+            self._values[key] = discover()
+            self._save()
+        return self._values[key]
+
+    def invalidate(self, *keys):
+        '''Forget the given values (or all values if no keys are given).'''
+        self._load()
+        if keys:
+            for key in keys:
+                self._values.pop(key, None)
+                self._local.pop(key, None)
+        else:
+            self._values = dict()
+            self._local = dict()
+        self._save()
+
+    def fqdn(self):
+        '''Fully qualified domain name of this node.'''
+        return self.get('fqdn', socket.getfqdn)
+
+    def hostaddress(self):
+        '''IP address registered for the FQDN of this node.'''
+        return self.get('hostaddress', lambda: socket.gethostbyname(self.fqdn()))
+
+    def networks(self):
+        '''List of NetworkInterface tuples (see get_networks); a fresh list which may be sorted in place.'''
+        return [NetworkInterface(*intf) for intf in self.get('networks', get_networks)]
+
+    def memory(self):
+        '''Memory information (see get_memory).'''
+        return {
+            'meminfo': copy.deepcopy(self.get('meminfo', _get_memory_proc_meminfo)),
+            'ulimit': self.get('ulimit', _get_memory_ulimit_v),
+        }
+
+    def usable_cores(self):
+        '''Cores this process may run on (see get_usable_cores).'''
+        return list(self.get('usablecores', get_usable_cores))
+
+    def cgroup(self):
+        '''Limits imposed by cgroups (see get_cgroup_limits).'''
+        return copy.deepcopy(self.get('cgroup', get_cgroup_limits))
+
+    def numa(self):
+        '''NUMA nodes of this machine (see get_numa_nodes).'''
+        return copy.deepcopy(self.get('numa', get_numa_nodes))
+
+
+# discovery cache of this process
+discovery = DiscoveryCache(os.getenv(DISCOVERY_CACHE_ENV))
+
+
 class Node(object):
     """Detect localnode properties"""
     def __init__(self):
@@ -227,6 +574,9 @@ class Node(object):
         self.totalcores = None
 
         self.memory = {}
+        self.cgroup = {}
+        self.numa = []
+        self.ppn = None
         self.num_nodes = -1
 
 
@@ -235,17 +585,20 @@ class Node(object):
 
     def go(self):
         """A wrapper around some common functions"""
-        self.fqdn = socket.getfqdn()
-        self.network = sorted_network(get_networks())
+        self.fqdn = discovery.fqdn()
+        self.network = sorted_network(discovery.networks())
 
         self.pid = os.getpid()
-        self.usablecores = [idx for idx, used in enumerate(sched_getaffinity().cpus) if used]
+        self.usablecores = discovery.usable_cores()
         self.cores = len(self.usablecores)
         self.totalcores = os.sysconf('SC_NPROCESSORS_ONLN')
 
-        self.memory = get_memory()
+        self.memory = discovery.memory()
+        self.cgroup = discovery.cgroup()
+        self.numa = discovery.numa()
 
         self.num_nodes = int(os.getenv('PBS_NUM_NODES', 1))
+        self.ppn = get_pbs_ppn()
 
         descr = {
             'fqdn': self.fqdn,
@@ -255,6 +608,9 @@ class Node(object):
             'usablecores': self.usablecores,
             'totalcores': self.totalcores,
             'num_nodes': self.num_nodes,
+            'ppn': self.ppn,
             'memory': self.memory,
+            'cgroup': self.cgroup,
+            'numa': self.numa,
         }
         return descr
@@ -30,7 +30,10 @@
 import os
 import sys
 
+from vsc.utils import fancylogger
+
 import hod
+from hod.cluster import node_shape_cache
 from hod.rmscheduler.job import Job
 from hod.rmscheduler.rm_pbs import Pbs
 from hod.rmscheduler.resourcemanagerscheduler import ResourceManagerScheduler
@@ -38,6 +41,29 @@ from hod.config.config import (parse_comma_delim_list,
         PreServiceConfigOpts, resolve_config_paths)
 
 
+_log = fancylogger.getLogger(fname=False)
+
+
+def load_hod_config(options):
+    """
+    Load the hod.conf files for the given (create/batch) options; returns a
+    PreServiceConfigOpts instance.
+    """
+    config_filenames = resolve_config_paths(options.hodconf, options.dist)
+    _log.debug('Manifest config paths resolved to: %s', config_filenames)
+    config_filenames = parse_comma_delim_list(config_filenames)
+    _log.info('Loading "%s" manifest config', config_filenames)
+    # If the user mistypes the --dist argument (e.g. Haddoop-...) then this will
+    # raise; TODO: cleanup the error reporting. 
+    return PreServiceConfigOpts.from_file_list(config_filenames, workdir=options.workdir,
+                                               modulepaths=options.modulepaths, modules=options.modules)
+
+
+def hod_config_key(options):
+    """Return key for the (create/batch) options which determine the result of load_hod_config."""
+    return (options.hodconf, options.dist, options.workdir, options.modulepaths, options.modules)
+
+
 class HodJob(Job):
     """Hanything on demand job"""
 
@@ -116,20 +142,20 @@ class PbsHodJob(MympirunHod):
     """PbsHodJob type job for easybuild infrastructure
         - easybuild module names
     """
-    def __init__(self, options):
+    def __init__(self, options, precfg=None):
+        """
+        Constructor; precfg is the result of load_hod_config for the options,
+        it is loaded if it is not specified.
+        """
         super(PbsHodJob, self).__init__(options)
 
         self.modules = [options.options.hod_module]
 
-        config_filenames = resolve_config_paths(options.options.hodconf, options.options.dist)
-        self.log.debug('Manifest config paths resolved to: %s', config_filenames)
-        config_filenames = parse_comma_delim_list(config_filenames)
-        self.log.info('Loading "%s" manifest config', config_filenames)
-        # If the user mistypes the --dist argument (e.g. Haddoop-...) then this will
-        # raise; TODO: cleanup the error reporting. 
-        precfg = PreServiceConfigOpts.from_file_list(config_filenames, workdir=options.options.workdir,
-                                                     modulepaths=options.options.modulepaths,
-                                                     modules=options.options.modules)
+        if precfg is None:
+            precfg = load_hod_config(options.options)
+
+        # the ppn for full nodes is determined using the cached shape of the nodes
+        self.type.node_shape_cache = node_shape_cache()
         for modulepath in precfg.modulepaths:
             self.log.debug("Adding extra module path '%s' to startup script", modulepath)
             self.modulepaths.append(modulepath)
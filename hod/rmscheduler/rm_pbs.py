@@ -29,7 +29,9 @@ Implementation of the pbs resource manager
 @author: Ewan Higgs (Ghent University)
 @author: Kenneth Hoste (Ghent University)
 """
+import atexit
 import os
+import pwd
 import re
 import tempfile
 from vsc.utils import fancylogger
@@ -47,6 +49,18 @@ except ImportError:
 
 _log = fancylogger.getLogger(fname=False)
 
+# connections to pbs servers by server name, shared by all Pbs instances
+_CONNECTIONS = dict()
+
+# node attributes needed to determine the shape of the nodes (see Pbs.node_shapes)
+NODE_SHAPE_ATTRIBUTES = ['np', 'properties', 'state']
+# states of the nodes which are taken into account for the shape of the nodes
+NODE_SHAPE_STATES = ('free', 'job-exclusive')
+# node properties (as opposed to the other parts of a node spec like 2:ppn=4)
+NODE_PROPERTY_REGEX = re.compile(r'^[A-Za-z][\w.-]*$')
+# job name filters which the pbs server can apply itself: a literal prefix or name
+JOB_NAME_FILTER_REGEX = re.compile(r'^\^(?P<name>[\w.-]+)(?P<end>\$?)$')
+
 
 class PbsJob(object):
     '''
@@ -81,11 +95,36 @@ def format_state(pbsjobs):
     return msg
 
 
+@only_if_module_is_available('pbs')
 def master_hostname():
     """Return hostname of master server of resource manager."""
     return pbs.pbs_default()
 
 
+@only_if_module_is_available('pbs')
+def pbs_connection(server):
+    """Return a connection to the pbs server, reusing an existing one if possible."""
+    conn = _CONNECTIONS.get(server)
+    if conn is None:
+        conn = pbs.pbs_connect(server)
+        if conn < 0:
+            _log.error("Failed to connect to pbs server %s: %s", server, pbs.error())
+            return conn
+        _log.debug("Connected to pbs server %s", server)
+        _CONNECTIONS[server] = conn
+    return conn
+
+
+def close_pbs_connections():
+    """Close all connections to pbs servers."""
+    for server, conn in _CONNECTIONS.items():
+        _log.debug("Disconnecting from pbs server %s", server)
+        pbs.pbs_disconnect(conn)
+    _CONNECTIONS.clear()
+
+atexit.register(close_pbs_connections)
+
+
 class Pbs(ResourceManagerScheduler):
     """Interaction with torque"""
     @only_if_module_is_available('pbs')
@@ -96,7 +135,9 @@ class Pbs(ResourceManagerScheduler):
         self.log.debug("Provided options %s", options)
 
         self.pbs_server = pbs.pbs_default()
-        self.pbsconn = pbs.pbs_connect(self.pbs_server)
+        self.pbsconn = pbs_connection(self.pbs_server)
+        # JsonCache for the node shapes, see get_ppn
+        self.node_shape_cache = None
 
         self.vars = {
             'cwd': 'PBS_O_WORKDIR',
@@ -220,9 +261,58 @@ class Pbs(ResourceManagerScheduler):
         pbsjobs = [PbsJob(j, s, h) for (j, s, h) in  zip(jid, jstate, map(_first_or_blank, ehosts))]
         return pbsjobs
 
+    @only_if_module_is_available('pbs')
+    def _select_criteria(self, job_filter):
+        """
+        Return the criteria for pbs_selstat for the jobs of the current user,
+        as (name, op, value) tuples. A job name filter which is a literal prefix
+        (e.g. ^HOD) is turned into a range of names; other job name filters are
+        only applied to the jobs returned by the server (see match_filter).
+        """
+        criteria = [('User_List', pbs.EQ, pwd.getpwuid(os.getuid()).pw_name)]
+        regex = JOB_NAME_FILTER_REGEX.match(job_filter.get('Job_Name', ''))
+        if regex is not None:
+            name = regex.group('name')
+            if regex.group('end'):
+                criteria.append(('Job_Name', pbs.EQ, name))
+            else:
+                # names with this prefix sort at or after the prefix, and before the prefix with the last character + 1
+                criteria.append(('Job_Name', pbs.GE, name))
+                criteria.append(('Job_Name', pbs.LT, name[:-1] + chr(ord(name[-1]) + 1)))
+        return criteria
+
+    @only_if_module_is_available('pbs')
+    def _select_user_jobs(self, jobattr, job_filter):
+        """
+        Let the pbs server select the jobs of the current user (which match the
+        job name filter, if possible), with only the attributes in jobattr,
+        rather than returning all jobs on the server. Returns None if this fails.
+        """
+        criteria = self._select_criteria(job_filter)
+        select = pbs.new_attropl(len(criteria))
+        for idx, (name, op, value) in enumerate(criteria):
+            select[idx].name = name
+            select[idx].op = op
+            select[idx].value = value
+        try:
+            try:
+                jobs = pbs.pbs_selstat(self.pbsconn, select, jobattr, 'NULL')
+            except TypeError:
+                # pbs_selstat without the list of attributes to return (e.g. older Torque)
+                jobs = pbs.pbs_selstat(self.pbsconn, select, 'NULL')
+        except (AttributeError, TypeError) as err:
+            self.log.debug("pbs_selstat not available: %s", err)
+            return None
+
+        is_error, errormsg = pbs.error()
+        if is_error:
+            self.log.debug("pbs_selstat failed: %s", errormsg)
+            return None
+        return jobs
+
     @only_if_module_is_available('pbs')
     def info(self, jobid, types=None, job_filter=None):
-        """Return jobinfo"""
+        """Return jobinfo; if jobid is None, for all jobs of the current user."""
         # add all filter values to the types
         if job_filter is None:
             job_filter = {}
@@ -232,9 +322,10 @@ class Pbs(ResourceManagerScheduler):
             job_filter.update(self.job_filter)
         self.log.debug("Job filter used %s", job_filter)
 
-        for filter_name in job_filter.keys():
-            if not filter_name in types:
-                types.append(filter_name)
+        if types is not None:
+            for filter_name in job_filter.keys():
+                if not filter_name in types:
+                    types.append(filter_name)
 
         if types is None:
             jobattr = 'NULL'
@@ -243,7 +334,11 @@ class Pbs(ResourceManagerScheduler):
             for idx, name in enumerate(types):
                 jobattr[idx].name = name
 
-        jobs = pbs.pbs_statjob(self.pbsconn, jobid, jobattr, 'NULL')
+        jobs = None
+        if jobid is None:
+            jobs = self._select_user_jobs(jobattr, job_filter)
+        if jobs is None:
+            jobs = pbs.pbs_statjob(self.pbsconn, jobid, jobattr, 'NULL')
         if not jobs:
             self.log.debug("No job found. Wrong id %s or job finished?", jobid)
             return []
@@ -251,7 +346,9 @@ class Pbs(ResourceManagerScheduler):
         self.log.debug("Request for jobid %s returned %d result(s) %s", jobid, len(jobs), jobs)
         res = []
         for j in jobs:
-            job_details = dict([(attrib.name, attrib.value) for attrib in j.attribs])
+            # only keep the requested attributes, in case the server returns more
+            job_details = dict([(attrib.name, attrib.value) for attrib in j.attribs
+                                if types is None or attrib.name in types])
             job_details['id'] = j.name  # add id
             if self.match_filter(job_details, job_filter):
                 res.append(job_details)
@@ -378,22 +475,73 @@ class Pbs(ResourceManagerScheduler):
             "Created header %s (although not used by pbs_submit)", hdr)
         return hdr
 
+    def _queue_partition(self):
+        """Return queue and partition the job is submitted to (empty string if not specified)."""
+        return self.options.get('queue', '') or '', self.options.get('partition', '') or ''
+
     @only_if_module_is_available('pbs')
-    def get_ppn(self):
-        """Guess the ppn for full node"""
+    def _queue_properties(self, pq, queue):
+        """Return list of node properties required by the queue (in its resources_default.neednodes)."""
+        queue_info = pq.getqueue(queue, ['resources_default']) or {}
+        neednodes = queue_info.get('resources_default', {}).get('neednodes', [])
+        properties = []
+        for spec in neednodes:
+            # neednodes can also be a node spec (e.g. 2:ppn=4:gpu), only keep the properties
+            properties.extend([x for x in spec.split(':') if NODE_PROPERTY_REGEX.match(x)])
+        return properties
+
+    @only_if_module_is_available('pbs')
+    def node_shapes(self, queue='', partition=''):
+        """
+        Return sorted list of [np, count] pairs: the number of usable nodes by
+        number of cores, for the nodes in the given queue and partition.
+        Nodes are in a queue if they have the node properties it requires, and in
+        a partition if they have its name as a property; if no such nodes are
+        found, all usable nodes are considered.
+        """
         pq = PBSQuery.PBSQuery()
-        node_vals = pq.getnodes().values()  # only the values, not the names
-        interesni_nodes = ('free', 'job-exclusive',)
-        res = {}
-        for np in [int(x['np'][0]) for x in node_vals if x['state'][0] in interesni_nodes]:
-            res.setdefault(np, 0)
-            res[np] += 1
+        # only query the attributes that are needed, not a full dump of all nodes
+        nodes = [node for node in pq.getnodes(NODE_SHAPE_ATTRIBUTES).values()
+                 if node.get('state', [''])[0] in NODE_SHAPE_STATES]
+
+        required = set()
+        if queue:
+            required.update(self._queue_properties(pq, queue))
+        if partition:
+            required.add(partition)
+        if required:
+            selected = [node for node in nodes if required.issubset(node.get('properties', []))]
+            if selected:
+                nodes = selected
+            else:
+                self.log.debug("No usable nodes with properties %s found, using all nodes", sorted(required))
+
+        shapes = {}
+        for node in nodes:
+            np = int(node['np'][0])
+            shapes[np] = shapes.get(np, 0) + 1
+        self.log.debug("Found node shapes %s for queue '%s' partition '%s'", shapes, queue, partition)
+        return sorted([[np, count] for np, count in shapes.items()])
+
+    def get_ppn(self):
+        """
+        Guess the ppn for full node: the most frequent number of cores of the
+        usable nodes in the queue and partition the job is submitted to.
+        The node shapes are kept in node_shape_cache (if it is set), unless
+        no usable nodes were found (e.g. because the nodes are temporarily down).
+        """
+        queue, partition = self._queue_partition()
+        if self.node_shape_cache is None:
+            shapes = self.node_shapes(queue, partition)
+        else:
+            key = '%s/%s/%s' % (self.pbs_server, queue, partition)
+            shapes = self.node_shape_cache.get(key, lambda: self.node_shapes(queue, partition), keep=bool)
 
         # # return most frequent
-        if not len(res):
+        if not shapes:
             return None
-        freq_np, freq_count = max(res.iteritems(), key=lambda x: x[1])
-        self.log.debug("Found most frequent np %s (%s times) in interesting nodes %s",
-                freq_np, freq_count, interesni_nodes)
+        freq_np, freq_count = max(shapes, key=lambda x: x[1])
+        self.log.debug("Found most frequent np %s (%s times) in nodes %s for queue '%s' partition '%s'",
+                       freq_np, freq_count, NODE_SHAPE_STATES, queue, partition)
 
         return freq_np
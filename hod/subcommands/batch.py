@@ -44,6 +44,10 @@ from hod.rmscheduler.hodjob import PbsHodJob
 from hod.subcommands.subcommand import SubCommand
 
 
+# the script to run can also be specified per cluster in a cluster manifest
+BATCH_MANIFEST_OPTIONS = dict(hc.CLUSTER_MANIFEST_OPTIONS, script='script')
+
+
 class BatchOptions(GeneralOption):
     VERSION = HOD_VERSION
 
@@ -59,6 +63,7 @@ class BatchOptions(GeneralOption):
         """Add batch configuration options"""
         opts = {
             'script': ("Script to run on the cluster", "string", "store", None),
+            'manifest': ("Cluster manifest: submit a cluster for each section of this file", 'string', 'store', None),
         }
         descr = ["Batch options", "Configuration options for the 'batch' subcommand"]
         self.log.debug("Add config option parser descr %s opts %s", descr, opts)
@@ -80,31 +85,42 @@ class BatchSubCommand(SubCommand):
     EXAMPLE = "--hodconf=<hod.conf file> --workdir=<working directory> --script=<jobscript>"
     HELP = "Submit a job to spawn a cluster on a PBS job controller, run a job script, and tear down the cluster when it's done"
 
+    def _prepare_script(self, options):
+        """Check the script to run on the cluster, and make sure it is executable; return False if it's unusable."""
+        if options.script is None:
+            sys.stderr.write('Missing script. Exiting.\n')
+            return False
+
+        # resolve script path to absolute path
+        options.script = os.path.abspath(options.script)
+
+        if not os.path.exists(options.script):
+            sys.stderr.write("Specified script does not exist: %s. Exiting.\n" % options.script)
+            return False
+
+        # make sure script is executable
+        cur_perms = os.stat(options.script)[stat.ST_MODE]
+        if not (cur_perms & stat.S_IXUSR):
+            print "Specified script %s is not executable yet, fixing that..." % options.script
+            os.chmod(options.script, cur_perms|stat.S_IXUSR)
+
+        return True
+
     def run(self, args):
         """Run 'batch' subcommand."""
         optparser = BatchOptions(go_args=args, envvar_prefix=self.envvar_prefix, usage=self.usage_txt)
         options = optparser.options
+        if options.manifest:
+            return self.run_manifest(args, options.manifest, BatchOptions, manifest_options=BATCH_MANIFEST_OPTIONS,
+                                     validate=self._prepare_script)
+
         if not validate_pbs_option(options):
             sys.stderr.write('Missing config options. Exiting.\n')
             return 1
 
-        if optparser.options.script is None:
-            sys.stderr.write('Missing script. Exiting.\n')
-            return 1
-
-        # resolve script path to absolute path
-        optparser.options.script = os.path.abspath(optparser.options.script)
-
-        if not os.path.exists(optparser.options.script):
-            sys.stderr.write("Specified script does not exist: %s. Exiting.\n" % optparser.options.script)
+        if not self._prepare_script(options):
             return 1
 
-        # make sure script is executable
-        cur_perms = os.stat(optparser.options.script)[stat.ST_MODE]
-        if not (cur_perms & stat.S_IXUSR):
-            print "Specified script %s is not executable yet, fixing that..." % optparser.options.script
-            os.chmod(optparser.options.script, cur_perms|stat.S_IXUSR)
-
         label = options.label
 
         if not hc.validate_label(label, hc.known_cluster_labels()):
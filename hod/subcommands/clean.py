@@ -52,8 +52,7 @@ class CleanSubCommand(SubCommand):
         """Run 'clean' subcommand."""
         optparser = CleanOptions(go_args=args, envvar_prefix=self.envvar_prefix, usage=self.usage_txt)
         try:
-            pbs = rm_pbs.Pbs(optparser)
-            state = pbs.state()
+            state = hc.pbs_job_states(optparser, fresh=True)
             labels = hc.known_cluster_labels()
             rm_master = rm_pbs.master_hostname()
             info = hc.mk_cluster_info_dict(labels, state, master=rm_master)
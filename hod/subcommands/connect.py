@@ -36,10 +36,9 @@ import sys
 
 from vsc.utils.generaloption import GeneralOption
 
-from hod.cluster import cluster_env_file, cluster_jobid
+from hod.cluster import cluster_env_file, cluster_jobid, pbs_job_states
 from hod.subcommands.subcommand import SubCommand
 import hod
-import hod.rmscheduler.rm_pbs as rm_pbs
 
 
 class ConnectOptions(GeneralOption):
@@ -79,9 +78,10 @@ class ConnectSubCommand(SubCommand):
 
             print "Job ID found: %s" % jobid
 
-            pbs = rm_pbs.Pbs(optparser)
-            jobs = pbs.state()
-            pbsjobs = [job for job in jobs if job.jobid == jobid]
+            pbsjobs = [job for job in pbs_job_states(optparser) if job.jobid == jobid]
+            if len(pbsjobs) != 1 or pbsjobs[0].state != 'R' or not pbsjobs[0].hosts:
+                # cached job state may be outdated, e.g. when it was cached while the job was still queued
+                pbsjobs = [job for job in pbs_job_states(optparser, fresh=True) if job.jobid == jobid]
 
             if len(pbsjobs) == 0:
                 self.report_error("Job with job ID '%s' not found by pbs.", jobid)
@@ -89,10 +89,12 @@ class ConnectSubCommand(SubCommand):
                 self.report_error("Multiple jobs found with job ID '%s': %s", jobid, pbsjobs)
 
             pbsjob = pbsjobs[0]
-            if pbsjob.state == ['Q', 'H']:
+            if pbsjob.state in ['Q', 'H']:
                 # This should never happen since the hod.d/<jobid>/env file is
                 # written on cluster startup. Maybe someone hacked the dirs.
                 self.report_error("Cannot connect to cluster with job ID '%s' yet. It is still queued.", jobid)
+            elif not pbsjob.hosts:
+                self.report_error("No hosts found for job with job ID '%s' (state %s).", jobid, pbsjob.state)
             else:
                 print "HOD cluster '%s' @ job ID %s appears to be running..." % (label, jobid)
 
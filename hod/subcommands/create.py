@@ -61,6 +61,9 @@ class CreateOptions(GeneralOption):
         """Add general configuration options."""
         opts = copy.deepcopy(GENERAL_HOD_OPTIONS)
         opts.update(COMMON_HOD_CONFIG_OPTIONS)
+        opts.update({
+            'manifest': ("Cluster manifest: submit a cluster for each section of this file", 'string', 'store', None),
+        })
         descr = ["Create configuration", "Configuration options for the 'create' subcommand"]
 
         self.log.debug("Add config option parser descr %s opts %s", descr, opts)
@@ -77,6 +80,9 @@ class CreateSubCommand(SubCommand):
         """Run 'create' subcommand."""
         optparser = CreateOptions(go_args=args, envvar_prefix=self.envvar_prefix, usage=self.usage_txt)
         options = optparser.options
+        if options.manifest:
+            return self.run_manifest(args, options.manifest, CreateOptions)
+
         if not validate_pbs_option(options):
             sys.stderr.write('Missing config options. Exiting.\n')
             return 1
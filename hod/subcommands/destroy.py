@@ -35,7 +35,8 @@ from vsc.utils.generaloption import GeneralOption
 
 import hod
 import hod.rmscheduler.rm_pbs as rm_pbs
-from hod.cluster import cluster_info_exists, cluster_jobid, rm_cluster_info, rm_cluster_localworkdir
+from hod.cluster import cluster_info_exists, cluster_jobid, invalidate_pbs_job_states, pbs_job_states
+from hod.cluster import rm_cluster_info, rm_cluster_localworkdir
 from hod.subcommands.subcommand import SubCommand
 
 
@@ -79,8 +80,7 @@ class DestroySubCommand(SubCommand):
             # try to figure out job state
             job_state = None
 
-            pbs = rm_pbs.Pbs(optparser)
-            jobs = pbs.state()
+            jobs = pbs_job_states(optparser, fresh=True)
             pbsjobs = [job for job in jobs if job.jobid == jobid]
             self.log.debug("Matching jobs for job ID '%s': %s", jobid, pbsjobs)
 
@@ -110,8 +110,10 @@ class DestroySubCommand(SubCommand):
             # actually destroy HOD cluster by deleting job and removing cluster info dir and local work dir
             if job_state is not None:
                 # if job was not successfully deleted, pbs.remove will print an error message
+                pbs = rm_pbs.Pbs(optparser)
                 if pbs.remove(jobid):
                     print "Job with ID %s deleted." % jobid
+                invalidate_pbs_job_states()
 
             rm_cluster_localworkdir(label)
 
@@ -38,6 +38,7 @@ from hod.subcommands.subcommand import SubCommand
 from hod.mpiservice import master_template_opts
 from hod.config.config import ConfigOptsParams
 from hod.commands.command import COMMAND_TIMEOUT
+from hod.work.ready_check import READY_TIMEOUT
 from hod.utils import setup_diagnostic_environment
 
 
@@ -50,7 +51,8 @@ def mk_registry():
     """Make a TemplateRegistry and register basic items"""
     config_opts = ConfigOptsParams('svc-name', 'MASTER', 'ExecPreStart', 'ExecStart', 'ExecStop',
                                    dict(), workdir='WORKDIR', modulepaths=['MODULEPATHS'],
-                                   modules=['MODULES'], master_template_kwargs=[], timeout=COMMAND_TIMEOUT)
+                                   modules=['MODULES'], master_template_kwargs=[], timeout=COMMAND_TIMEOUT,
+                                   after=[], requires=[], ready_check=None, ready_timeout=READY_TIMEOUT)
     reg = hct.TemplateRegistry()
     hct.register_templates(reg, config_opts)
     master_template_kwargs = master_template_opts(reg.fields.values())
@@ -39,7 +39,6 @@ from hod import VERSION as HOD_VERSION
 from hod.subcommands.subcommand import SubCommand
 import hod.cluster as hc
 import hod.table as ht
-import hod.rmscheduler.rm_pbs as rm_pbs
 
 
 class ListOptions(GeneralOption):
@@ -70,8 +69,7 @@ class ListSubCommand(SubCommand):
         """Run 'list' subcommand."""
         optparser = ListOptions(go_args=args, envvar_prefix=self.envvar_prefix, usage=self.usage_txt)
         try:
-            pbs = rm_pbs.Pbs(optparser)
-            state = pbs.state()
+            state = hc.pbs_job_states(optparser)
             labels = hc.known_cluster_labels()
             info = hc.mk_cluster_info_dict(labels, state)
             if not info:
@@ -65,6 +65,72 @@ class SubCommand(object):
         self.log.error(msg, *args)
         sys.exit(1)
 
+    def run_manifest(self, args, manifest, options_class, manifest_options=None, validate=None):
+        """
+        Submit a cluster for each section of the cluster manifest, with the
+        options parsed by options_class. validate is called with the options of
+        each cluster, and should return False if they are unusable.
+        """
+        # only needed by the subcommands which submit clusters, don't make all others import them
+        import hod.cluster as hc
+        from hod.options import validate_pbs_option
+        from hod.rmscheduler.hodjob import PbsHodJob, hod_config_key, load_hod_config
+
+        try:
+            clusters = hc.cluster_manifest_args(manifest, manifest_options)
+        except ValueError as err:
+            self.report_error("%s", err)
+
+        labels = list(hc.known_cluster_labels())
+        optparsers = []
+        for label, cluster_args in clusters:
+            optparser = options_class(go_args=args + cluster_args, envvar_prefix=self.envvar_prefix,
+                                      usage=self.usage_txt)
+            options = optparser.options
+            # the manifest is not passed on to the job
+            options.manifest = None
+            if not validate_pbs_option(options):
+                self.report_error("Missing config options for cluster '%s'.", label)
+
+            if validate is not None and not validate(options):
+                self.report_error("Invalid options for cluster '%s'.", label)
+
+            if not hc.validate_label(label, labels):
+                self.report_error("Invalid label for cluster '%s'.", label)
+            labels.append(label)
+
+            if not hc.validate_hodconf_or_dist(options.hodconf, options.dist):
+                self.report_error("Invalid hod.conf or dist for cluster '%s'.", label)
+
+            optparsers.append(optparser)
+
+        # clusters sharing the same hod.conf files use the same modules in their job script
+        precfgs = dict()
+        submitted = []
+        for optparser in optparsers:
+            options = optparser.options
+            # a failed submission must not prevent the hod.d/ files of the clusters submitted so far to be written
+            jobid = None
+            try:
+                key = hod_config_key(options)
+                if key not in precfgs:
+                    precfgs[key] = load_hod_config(options)
+                j = PbsHodJob(optparser, precfg=precfgs[key])
+                hc.report_cluster_submission(options.label)
+                j.run()
+                jobid = j.type.jobid
+            except StandardError as err:
+                self.log.error("Failed to submit cluster '%s': %s", options.label, err)
+                sys.stderr.write("Failed to submit cluster '%s': %s\n" % (options.label, err))
+            submitted.append((options.label, jobid, options.workdir))
+
+        try:
+            hc.post_jobs_submission(submitted, optparsers[0])
+        except StandardError as err:
+            self._log_and_raise(err)
+
+        return 0
+
     @abstractmethod
     def run(self, args):
         '''Run the command'''
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+"""
+Show the resource usage of the services of an HOD cluster.
+"""
+import time
+
+from vsc.utils.generaloption import GeneralOption
+
+import hod
+import hod.cluster as hc
+from hod.monitor import format_usage, read_usage
+from hod.subcommands.subcommand import SubCommand
+
+
+class TopOptions(GeneralOption):
+    """Option parser for 'top' subcommand."""
+    VERSION = hod.VERSION
+    ALLOPTSMANDATORY = False # let us use optionless arguments.
+
+    def config_options(self):
+        """Add configuration options for 'top' subcommand."""
+        opts = {
+            'watch': ("Show the resource usage again every given number of seconds (0: only once)",
+                      'float', 'store', 0),
+        }
+        descr = ["Top configuration", "Configuration options for the 'top' subcommand"]
+
+        self.log.debug("Add config option parser descr %s opts %s", descr, opts)
+        self.add_group_parser(opts, descr)
+
+
+class TopSubCommand(SubCommand):
+    """
+    Implementation of HOD 'top' subcommand;
+    shows the latest resource usage of the services of the HOD cluster with
+    specified label, per node and per service, as reported by its master.
+    """
+    CMD = 'top'
+    HELP = "Show the resource usage of the services of an HOD cluster."
+    EXAMPLE = "hod top <label> [--watch=<seconds>]"
+
+    def show_usage(self, label, path):
+        """Print the resource usage of the cluster."""
+        try:
+            usage = read_usage(path)
+        except (IOError, OSError, ValueError) as err:
+            self.log.debug("Failed to read resource usage from %s: %s", path, err)
+            self.report_error("No resource usage available for HOD cluster '%s' (yet).", label)
+
+        updated = time.strftime('%H:%M:%S', time.localtime(usage['time']))
+        print "Resource usage of HOD cluster '%s' at %s:" % (label, updated)
+        print format_usage(usage)
+
+    def run(self, args):
+        """Run 'top' subcommand."""
+        optparser = TopOptions(go_args=args, envvar_prefix=self.envvar_prefix, usage=self.usage_txt)
+        options = optparser.options
+        try:
+            if len(optparser.args) > 1:
+                label = optparser.args[1]
+            else:
+                self.report_error("No label provided.")
+
+            if label not in hc.known_cluster_labels():
+                self.report_error("Cluster with label '%s' not found", label)
+
+            path = hc.cluster_usage_file(label)
+            self.show_usage(label, path)
+            while options.watch > 0:
+                time.sleep(options.watch)
+                self.show_usage(label, path)
+
+        except StandardError as err:
+            self._log_and_raise(err)
+
+        return 0
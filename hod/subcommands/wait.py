@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+"""
+Wait until an HOD cluster is ready.
+"""
+import os
+import time
+
+from vsc.utils.generaloption import GeneralOption
+
+import hod
+import hod.cluster as hc
+import hod.rmscheduler.rm_pbs as rm_pbs
+from hod.dirwatch import DirWatcher
+from hod.subcommands.subcommand import SubCommand
+
+
+# initial number of seconds between checks of the job state
+INITIAL_INTERVAL = 1
+
+# maximum number of seconds between checks for the ready file: it is written on the master node of
+# the cluster, and inotify doesn't see that if the cluster info directory is on a shared file system
+READY_POLL_INTERVAL = 0.5
+
+
+def backoff(initial, maximum, factor=2):
+    """Generate exponentially increasing intervals, up to maximum."""
+    interval = initial
+    while True:
+        yield interval
+        interval = min(interval * factor, maximum)
+
+
+class WaitOptions(GeneralOption):
+    """Option parser for 'wait' subcommand."""
+    VERSION = hod.VERSION
+    ALLOPTSMANDATORY = False # let us use optionless arguments.
+
+    def config_options(self):
+        """Add configuration options for 'wait' subcommand."""
+        opts = {
+            'timeout': ("Maximum number of seconds to wait (0: no limit)", 'float', 'store', 0),
+            'max-interval': ("Maximum number of seconds between checks of the job state", 'float', 'store', 60),
+        }
+        descr = ["Wait configuration", "Configuration options for the 'wait' subcommand"]
+
+        self.log.debug("Add config option parser descr %s opts %s", descr, opts)
+        self.add_group_parser(opts, descr)
+
+
+class WaitSubCommand(SubCommand):
+    """
+    Implementation of HOD 'wait' subcommand;
+    blocks until the job for the HOD cluster with specified label is running,
+    and all services of the cluster were started.
+    """
+    CMD = 'wait'
+    HELP = "Wait until an HOD cluster is ready."
+    EXAMPLE = "hod wait <label> [--timeout=<seconds>]"
+
+    def _remaining(self, deadline):
+        """Return number of seconds until the deadline (None if there is no deadline); exit if it passed."""
+        if deadline is None:
+            return None
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            self.report_error("Timed out waiting for HOD cluster.")
+        return remaining
+
+    def _check_job(self, pbs, jobid):
+        """Return True if the job is running, False if it is queued; exit if it is gone."""
+        states = [job.state for job in pbs.state(jobid) if job.jobid == jobid]
+        self.log.debug("State of job %s: %s", jobid, states)
+        if not states or states[0] in ['C', 'E']:
+            self.report_error("Job with job ID '%s' is no longer running.", jobid)
+        return states[0] == 'R'
+
+    def wait_for_job(self, pbs, jobid, deadline, max_interval):
+        """Wait until the job is running, checking its state with exponential backoff."""
+        for interval in backoff(INITIAL_INTERVAL, max_interval):
+            if self._check_job(pbs, jobid):
+                return
+            remaining = self._remaining(deadline)
+            time.sleep(interval if remaining is None else min(interval, remaining))
+
+    def wait_for_ready(self, pbs, label, jobid, deadline, max_interval):
+        """
+        Wait until the ready file for the cluster shows up, while checking
+        (with exponential backoff) whether the job is still running. The ready
+        file is checked for every READY_POLL_INTERVAL seconds; inotify only
+        shortens the wait if it sees the file being created.
+        """
+        ready_file = hc.cluster_ready_file(label)
+        # start watching before checking for the ready file, to avoid missing it
+        watcher = DirWatcher([os.path.dirname(ready_file)])
+        try:
+            intervals = backoff(INITIAL_INTERVAL, max_interval)
+            next_check = time.time() + next(intervals)
+            while not os.path.exists(ready_file):
+                timeout = min(next_check - time.time(), READY_POLL_INTERVAL)
+                remaining = self._remaining(deadline)
+                if remaining is not None:
+                    timeout = min(timeout, remaining)
+                if timeout > 0:
+                    watcher.wait(timeout)
+                if time.time() >= next_check:
+                    self._check_job(pbs, jobid)
+                    next_check = time.time() + next(intervals)
+        finally:
+            watcher.close()
+
+    def run(self, args):
+        """Run 'wait' subcommand."""
+        optparser = WaitOptions(go_args=args, envvar_prefix=self.envvar_prefix, usage=self.usage_txt)
+        options = optparser.options
+        try:
+            if len(optparser.args) > 1:
+                label = optparser.args[1]
+            else:
+                self.report_error("No label provided.")
+
+            try:
+                jobid = hc.cluster_jobid(label)
+            except ValueError as err:
+                self.report_error(err)
+
+            deadline = None
+            if options.timeout:
+                deadline = time.time() + options.timeout
+
+            pbs = rm_pbs.Pbs(optparser)
+
+            print "Waiting for job %s of HOD cluster '%s' to start..." % (jobid, label)
+            self.wait_for_job(pbs, jobid, deadline, options.max_interval)
+
+            print "Waiting for services of HOD cluster '%s' to start..." % label
+            self.wait_for_ready(pbs, label, jobid, deadline, options.max_interval)
+
+            print "HOD cluster '%s' is ready." % label
+
+        except StandardError as err:
+            self._log_and_raise(err)
+
+        return 0
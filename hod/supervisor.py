@@ -0,0 +1,247 @@
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+# #
+"""
+Event driven supervision of the work running on each rank.
+
+Instead of waking up every rank at a fixed interval to run a collective, each
+rank blocks until something happens locally: a file shows up in a control
+directory (inotify), a child process exits (SIGCHLD) or a work reaches its
+maximum age. Ranks with no more active work report to the master rank with a
+point to point message, and the master releases everyone once all ranks are done.
+If a monitor is given (see hod.monitor), each rank also samples the resource
+usage of its services at a fixed interval and sends it to the master.
+"""
+import errno
+import fcntl
+import os
+import select
+import signal
+import time
+
+from vsc.utils import fancylogger
+
+from hod.dirwatch import DirWatcher
+from hod.utils import only_if_module_is_available
+
+# optional packages, not always required
+try:
+    from mpi4py import MPI
+except ImportError:
+    pass
+
+
+_log = fancylogger.getLogger(fname=False)
+
+# message tags used between the ranks
+DONE_TAG = 0x4f0
+FINISH_TAG = 0x4f1
+MONITOR_TAG = 0x4f2
+
+# interval for checking for messages from other ranks once local work is done,
+# or for checking the control directories when inotify is not available
+POLL_INTERVAL = 0.5
+
+# maximum interval for checking the control directories when inotify is used: inotify doesn't see
+# force_stop/force_continue files created from another node on a shared file system
+CONTROL_CHECK_INTERVAL = 5
+
+
+class Supervisor(object):
+    """
+    Supervise the active work on this rank until all ranks are done.
+    """
+    def __init__(self, comm, active_work, masterrank, poll_interval=POLL_INTERVAL, monitor=None):
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.size = comm.Get_size()
+        self.masterrank = masterrank
+        self.active_work = list(active_work)
+        self.poll_interval = poll_interval
+        self.monitor = monitor
+
+        controldirs = sorted(set([w.controldir for w in self.active_work if w.controldir is not None]))
+        self.watcher = DirWatcher(controldirs)
+
+        self._sigchld_pipe = None
+        self._prev_sigchld = None
+
+    def _sigchld_handler(self, signum, frame):
+        '''Wake up the supervision loop when a child process exits.'''
+        try:
+            os.write(self._sigchld_pipe[1], '.')
+        except OSError:
+            pass
+
+    def _install_sigchld(self):
+        '''Install SIGCHLD handler which writes to a (non-blocking) self-pipe.'''
+        self._sigchld_pipe = os.pipe()
+        for fd in self._sigchld_pipe:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._prev_sigchld = signal.signal(signal.SIGCHLD, self._sigchld_handler)
+        # restart interrupted system calls (e.g. in subprocess) rather than failing with EINTR
+        signal.siginterrupt(signal.SIGCHLD, False)
+
+    def _remove_sigchld(self):
+        '''Restore previous SIGCHLD handler and close the self-pipe.'''
+        if self._sigchld_pipe is None:
+            return
+        prev = self._prev_sigchld
+        if prev is None:
+            prev = signal.SIG_DFL
+        signal.signal(signal.SIGCHLD, prev)
+        for fd in self._sigchld_pipe:
+            os.close(fd)
+        self._sigchld_pipe = None
+
+    def _drain_sigchld(self):
+        '''Consume pending SIGCHLD notifications.'''
+        try:
+            while os.read(self._sigchld_pipe[0], 512):
+                pass
+        except OSError as err:
+            if err.errno not in (errno.EAGAIN, errno.EINTR):
+                raise
+
+    def _next_timeout(self):
+        '''
+        Return number of seconds until the next work reaches its maximum age,
+        or the control directories have to be checked again. Deadlines which
+        already passed (e.g. work kept running with a force_continue file) are
+        ignored, so the loop doesn't keep spinning.
+        '''
+        now = time.time()
+        deadlines = [w.work_deadline() for w in self.active_work if w.work_deadline() > now]
+        if not deadlines:
+            return self.poll_interval
+        timeout = min(min(deadlines) - now, CONTROL_CHECK_INTERVAL)
+        if self.watcher.fileno() is None:
+            timeout = min(timeout, self.poll_interval)
+        if self.monitor is not None:
+            timeout = min(timeout, self.monitor.due())
+        return max(timeout, 0)
+
+    def _wait_for_event(self, timeout):
+        '''Block until a local event occurs or timeout seconds have passed.'''
+        fds = [self._sigchld_pipe[0]]
+        if self.watcher.fileno() is not None:
+            fds.append(self.watcher.fileno())
+        try:
+            readable, _, _ = select.select(fds, [], [], timeout)
+        except select.error as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            readable = []
+
+        if self._sigchld_pipe[0] in readable:
+            self._drain_sigchld()
+            _log.debug("Child process exited on rank %s", self.rank)
+        # consume inotify events (or compare mtimes when there's no inotify)
+        self.watcher.changed()
+
+    def _check_work(self):
+        '''Stop and remove the work which is over.'''
+        for work in self.active_work[:]:
+            if work.do_work_wait():
+                _log.debug("work %s stop", work.__class__.__name__)
+                work.do_work_stop()
+                _log.debug("work %s end", work.__class__.__name__)
+                self.active_work.remove(work)
+
+    def _receive_samples(self):
+        '''Receive the resource usage sent by the other ranks (master only); return True if there was any.'''
+        received = False
+        while self.comm.Iprobe(source=MPI.ANY_SOURCE, tag=MONITOR_TAG):
+            sample = self.comm.recv(source=MPI.ANY_SOURCE, tag=MONITOR_TAG)
+            if self.monitor.usage is not None:
+                self.monitor.usage.update(sample)
+            received = True
+        return received
+
+    def _write_usage(self):
+        '''Write the resource usage of all ranks (master only).'''
+        if self.monitor.usage is None:
+            return
+        try:
+            self.monitor.usage.write()
+        except (IOError, OSError) as err:
+            _log.error("Failed to write resource usage to %s: %s", self.monitor.usage.path, err)
+
+    def _check_monitor(self):
+        '''Sample the resource usage if it is due, and send it to the master.'''
+        if self.monitor is None or self.monitor.due() > 0:
+            return
+        sample = self.monitor.sample()
+        if self.rank == self.masterrank:
+            if self.monitor.usage is not None:
+                self.monitor.usage.update(sample)
+            self._receive_samples()
+            self._write_usage()
+        else:
+            self.comm.send(sample, dest=self.masterrank, tag=MONITOR_TAG)
+
+    def _wait_for_others(self):
+        '''
+        Report to the master that this rank is done, and wait until the master
+        reports that all ranks are done.
+        '''
+        if self.rank == self.masterrank:
+            waiting = self.size - 1
+            while waiting:
+                while self.comm.Iprobe(source=MPI.ANY_SOURCE, tag=DONE_TAG):
+                    src = self.comm.recv(source=MPI.ANY_SOURCE, tag=DONE_TAG)
+                    _log.debug("Rank %s reported all its work is done", src)
+                    waiting -= 1
+                if self.monitor is not None and self._receive_samples():
+                    self._write_usage()
+                if waiting:
+                    time.sleep(self.poll_interval)
+            for dest in range(self.size):
+                if dest != self.masterrank:
+                    self.comm.send(None, dest=dest, tag=FINISH_TAG)
+        else:
+            self.comm.send(self.rank, dest=self.masterrank, tag=DONE_TAG)
+            while not self.comm.Iprobe(source=self.masterrank, tag=FINISH_TAG):
+                time.sleep(self.poll_interval)
+            self.comm.recv(source=self.masterrank, tag=FINISH_TAG)
+        _log.debug("All ranks are done (rank %s)", self.rank)
+
+    @only_if_module_is_available('mpi4py')
+    def run(self):
+        '''Supervise the active work until it is over on all ranks.'''
+        self._install_sigchld()
+        try:
+            self._check_work()
+            while self.active_work:
+                _log.debug("amount of active work %s", len(self.active_work))
+                self._wait_for_event(self._next_timeout())
+                self._check_work()
+                self._check_monitor()
+        finally:
+            self._remove_sigchld()
+            self.watcher.close()
+
+        _log.debug("No more active work left on rank %s.", self.rank)
+        self._wait_for_others()
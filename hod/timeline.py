@@ -0,0 +1,251 @@
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+# #
+"""
+Startup timeline: spans of time spent in each phase of setting up a cluster,
+per rank and per service.
+
+Spans are measured with a monotonic clock, relative to a single wall clock
+reading per rank, so ranks on different nodes can be lined up. The master
+gathers the spans of all ranks once all work was started, and writes them to
+the job directory as JSON lines, together with a summary per phase.
+"""
+import ctypes
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from vsc.utils import fancylogger
+
+from hod.table import format_table
+
+_log = fancylogger.getLogger(fname=False)
+
+# from <time.h>
+CLOCK_MONOTONIC = 1
+
+# files in the job directory with the timeline of all ranks and its summary
+TIMELINE_FILE = 'timeline.jsonl'
+TIMELINE_SUMMARY_FILE = 'timeline-summary.txt'
+# file with the timeline of a single rank, written when it failed (before the timeline was gathered)
+RANK_TIMELINE_FILE = 'timeline.%d.jsonl'
+
+SUMMARY_HEADERS = ['PHASE', 'SERVICE', 'RANKS', 'MIN', 'MEDIAN', 'MAX', 'SLOWEST']
+
+
+class _Timespec(ctypes.Structure):
+    '''struct timespec'''
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _monotonic_clock():
+    '''Return function which returns the time of a monotonic clock in seconds; time.time if there is none.'''
+    try:
+        # symbols of the running process, which include libc
+        clock_gettime = ctypes.CDLL(None, use_errno=True).clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+
+    def monotonic():
+        '''Time of the monotonic clock in seconds.'''
+        spec = _Timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(spec)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return spec.tv_sec + spec.tv_nsec * 1e-9
+
+    try:
+        monotonic()
+    except OSError:
+        return time.time
+    return monotonic
+
+now = _monotonic_clock()
+
+
+class Timeline(object):
+    """
+    Spans recorded on one rank. Spans can be added from several threads (e.g.
+    services which are started concurrently).
+    """
+    def __init__(self, rank=None):
+        self.rank = rank
+        self.host = socket.gethostname()
+        self.origin = now()
+        # wall clock time corresponding to origin
+        self.wallclock = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, phase, start, end=None, service=None):
+        '''Add span for phase (of service) between start and end (now if not specified), as given by now().'''
+        if end is None:
+            end = now()
+        with self._lock:
+            self.spans.append((phase, service, start - self.origin, end - start))
+
+    @contextmanager
+    def span(self, phase, service=None):
+        '''Context manager which records the time spent in its body as a span.'''
+        start = now()
+        try:
+            yield
+        finally:
+            self.add(phase, start, service=service)
+
+    def records(self):
+        '''Return list of dicts with the spans, as written to the timeline files.'''
+        records = []
+        with self._lock:
+            for phase, service, offset, duration in self.spans:
+                record = {
+                    'rank': self.rank,
+                    'host': self.host,
+                    'phase': phase,
+                    'start': round(self.wallclock + offset, 6),
+                    'duration': round(duration, 6),
+                }
+                if service is not None:
+                    record['service'] = service
+                records.append(record)
+        return records
+
+
+# timeline of this process
+_TIMELINE = Timeline()
+
+
+def process_timeline():
+    '''Return the timeline of this process.'''
+    return _TIMELINE
+
+
+def process_start():
+    '''Return the time at which this process was started, as given by now(); None if it is unknown.'''
+    if now is time.time:
+        return None
+    try:
+        with open('/proc/self/stat') as fh:
+            stat = fh.read()
+        # starttime (in clock ticks since boot) is the 22nd field; the 2nd one (command) can contain spaces
+        starttime = int(stat[stat.rindex(')') + 2:].split()[19])
+        return float(starttime) / os.sysconf('SC_CLK_TCK')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def span(phase, service=None):
+    '''Context manager which records a span in the timeline of this process; see Timeline.span.'''
+    return _TIMELINE.span(phase, service=service)
+
+
+def gather_timeline(comm, root):
+    '''
+    Gather the spans of all ranks of comm on the root rank (collective).
+    Returns list of records on the root rank, None on the other ranks.
+    '''
+    all_records = comm.gather(_TIMELINE.records(), root=root)
+    if all_records is None:
+        return None
+    return [record for records in all_records for record in records]
+
+
+def write_timeline(path, records):
+    '''Write the records to path, as JSON lines.'''
+    tmp_path = '%s.%d' % (path, os.getpid())
+    with open(tmp_path, 'w') as fh:
+        for record in records:
+            fh.write(json.dumps(record, sort_keys=True, separators=(',', ':')) + '\n')
+    os.rename(tmp_path, path)
+
+
+def read_timeline(path):
+    '''Read the records in the timeline file in path.'''
+    with open(path) as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def _median(values):
+    '''Return median of a (non-empty) list of numbers.'''
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def _phase_row(phase, service, durations, hosts):
+    '''Return summary row for the given durations of a phase by rank.'''
+    slowest = max(durations, key=lambda rank: (durations[rank], rank))
+    values = durations.values()
+    return [phase, service or '-', str(len(durations)), '%.3f' % min(values), '%.3f' % _median(values),
+            '%.3f' % max(values), 'rank %s (%s)' % (slowest, hosts[slowest])]
+
+
+def summarize_timeline(records):
+    '''
+    Return summary rows (see SUMMARY_HEADERS) of the time spent in each phase
+    (of each service) over the ranks, in the order in which the phases started,
+    followed by the time from the start of the first rank until each rank was
+    done. Spans for the same phase on a rank (e.g. waiting in barriers) are
+    added up.
+    '''
+    durations = dict()
+    first_start = dict()
+    hosts = dict()
+    done = dict()
+    for record in records:
+        rank = record['rank']
+        hosts[rank] = record['host']
+        key = (record['phase'], record.get('service'))
+        by_rank = durations.setdefault(key, dict())
+        by_rank[rank] = by_rank.get(rank, 0) + record['duration']
+        first_start[key] = min(first_start.get(key, record['start']), record['start'])
+        done[rank] = max(done.get(rank, 0), record['start'] + record['duration'])
+
+    rows = [_phase_row(phase, service, durations[(phase, service)], hosts)
+            for phase, service in sorted(durations, key=lambda key: (first_start[key], key))]
+    if records:
+        start = min(first_start.values())
+        rows.append(_phase_row('total', None, dict([(rank, end - start) for rank, end in done.items()]), hosts))
+    return rows
+
+
+def report_timeline(jobdir, records):
+    '''
+    Write the timeline records of all ranks and their summary to the job
+    directory, and log the summary.
+    '''
+    write_timeline(os.path.join(jobdir, TIMELINE_FILE), records)
+    rows = summarize_timeline(records)
+    if not rows:
+        return
+    summary = format_table(rows, SUMMARY_HEADERS)
+    with open(os.path.join(jobdir, TIMELINE_SUMMARY_FILE), 'w') as fh:
+        fh.write(summary + '\n')
+    _log.info("Startup timeline (seconds):\n%s", summary)
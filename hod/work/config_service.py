@@ -27,12 +27,46 @@
 """
 
 import os
+import shutil
 from errno import EEXIST
 from os.path import join as mkpath
 
+from vsc.utils import fancylogger
+
 from hod.work.work import Work
+from hod.work.ready_check import parse_ready_check, wait_until_ready
 from hod.config.config import env2str
 from hod.commands.command import Command
+from hod.monitor import SERVICE_ENV
+from hod.timeline import span
+
+_log = fancylogger.getLogger(fname=False)
+
+# number of services using each node local scratch directory
+_SCRATCH_REFS = dict()
+
+
+def acquire_scratch(path):
+    '''Create the node local scratch directory (if needed) and register a service using it.'''
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != EEXIST:
+            raise
+    _SCRATCH_REFS[path] = _SCRATCH_REFS.get(path, 0) + 1
+
+
+def release_scratch(path):
+    '''Unregister a service using the node local scratch directory; remove it once no service uses it.'''
+    if path not in _SCRATCH_REFS:
+        return
+    _SCRATCH_REFS[path] -= 1
+    if _SCRATCH_REFS[path] > 0:
+        return
+    del _SCRATCH_REFS[path]
+    _log.info('Removing node local scratch %s', path)
+    shutil.rmtree(path, ignore_errors=True)
+
 
 class ConfiguredService(Work):
     """
@@ -45,6 +79,7 @@ class ConfiguredService(Work):
         self._config = config
         self._master_env = master_env
         self.name = self._config.name
+        self._scratch = None
 
     def pre_start_work_service(self):
         """Run the ExecStartPre script"""
@@ -56,11 +91,13 @@ class ConfiguredService(Work):
         env = os.environ.copy()
         env.update(self._config.env)
         env.update(self._master_env)
+        env[SERVICE_ENV] = self.name
 
         self.log.info('Prestarting %s service on rank %s: "%s"',
                 self._config.name, rank, self._config.pre_start_script)
         command = Command(self._config.pre_start_script, env=env)
-        output = command.run()
+        with span('pre-start', service=self.name):
+            output = command.run()
         self.log.info('Ran %s service on rank %s prestart script. Output: "%s"',
                 self._config.name, rank, output)
 
@@ -69,6 +106,8 @@ class ConfiguredService(Work):
         env = os.environ.copy()
         env.update(self._config.env)
         env.update(self._master_env)
+        # tag the processes of the service, see hod.monitor
+        env[SERVICE_ENV] = self.name
         rank = self.svc.rank
 
         self.log.info('Starting %s service on rank %s: "%s"',
@@ -76,10 +115,28 @@ class ConfiguredService(Work):
         self.log.info("Env for %s service on rank %s: %s",
                 self._config.name, rank, env2str(env))
         command = Command(self._config.start_script, env=env, timeout=self._config.timeout)
-        output = command.run()
+        with span('start', service=self.name):
+            output = command.run()
         self.log.info('Ran %s service on rank %s start script. Output: "%s"',
                 self._config.name, rank, output)
 
+        ready_check = self._config.ready_check
+        if ready_check is not None:
+            try:
+                parse_ready_check(ready_check)
+            except ValueError as err:
+                self.log.error('Not checking whether %s service on rank %s is ready: %s', self._config.name, rank, err)
+                return
+            self.log.info('Waiting for %s service on rank %s to be ready: %s',
+                    self._config.name, rank, ready_check)
+            with span('ready-check', service=self.name):
+                ready = wait_until_ready(ready_check, self._config.ready_timeout, env=env)
+            if ready:
+                self.log.info('%s service on rank %s is ready', self._config.name, rank)
+            else:
+                self.log.error('%s service on rank %s not ready after %s seconds (ready check: %s)',
+                        self._config.name, rank, self._config.ready_timeout, ready_check)
+
     def stop_work_service(self):
         """Stop service by running the ExecStop script."""
         env = os.environ.copy()
@@ -93,6 +150,10 @@ class ConfiguredService(Work):
         self.log.info('Ran %s service on rank %s stop script. Output: "%s"',
                 self._config.name, rank, output)
 
+        if self._scratch is not None:
+            release_scratch(self._scratch)
+            self._scratch = None
+
     def prepare_work_cfg(self):
         """Prepare the config: collect the parameters and make the necessary xml cfg files"""
         self.controldir = mkpath(self._config.localworkdir, 'controldir')
@@ -104,5 +165,12 @@ class ConfiguredService(Work):
             else:
                 raise
 
+        # the localscratch is only set up (and cleaned up) if it is used, and isn't the localworkdir
+        if self._scratch is None:
+            scratch = self._config.localscratch
+            if scratch is not None:
+                acquire_scratch(scratch)
+                self._scratch = scratch
+
     def __repr__(self):
         return 'ConfiguredService(name=%s)' % (self.name)
@@ -0,0 +1,145 @@
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+# #
+"""
+Readiness checks for services (see the ReadyCheck option of service configs).
+
+A ready check is specified as one of:
+    tcp:<host>:<port>    a TCP connection to host:port can be made
+    http://<url>         a GET request for the URL succeeds (also https://)
+    file:<path>          the file exists
+    cmd:<command>        the command exits with exit code 0
+"""
+import os
+import socket
+import time
+import urllib2
+
+from vsc.utils import fancylogger
+
+from hod.commands.command import Command
+
+_log = fancylogger.getLogger(fname=False)
+
+# default number of seconds to wait for a service to become ready
+READY_TIMEOUT = 300
+
+# bounds for the number of seconds between ready checks
+MIN_CHECK_INTERVAL = 0.1
+MAX_CHECK_INTERVAL = 5
+
+
+def _check_tcp(target, timeout, env):
+    '''Check whether a TCP connection to host:port can be made.'''
+    host, port = target.rsplit(':', 1)
+    try:
+        sock = socket.create_connection((host.strip('[]'), int(port)), timeout)
+    except (socket.error, socket.timeout):
+        return False
+    sock.close()
+    return True
+
+
+def _check_http(url, timeout, env):
+    '''Check whether a GET request for the URL succeeds.'''
+    try:
+        urllib2.urlopen(url, timeout=timeout).close()
+    except (urllib2.URLError, socket.error, socket.timeout):
+        return False
+    return True
+
+
+def _check_file(path, timeout, env):
+    '''Check whether the file exists.'''
+    return os.path.exists(path)
+
+
+def _check_cmd(cmd, timeout, env):
+    '''Check whether the command succeeds.'''
+    command = Command(cmd, timeout=timeout, env=env)
+    command.run()
+    return command.returncode == 0
+
+
+READY_CHECKS = {
+    'tcp': _check_tcp,
+    'http': _check_http,
+    'https': _check_http,
+    'file': _check_file,
+    'cmd': _check_cmd,
+}
+
+
+def ready_check_kind(spec):
+    '''
+    Return the kind of the specified ready check; raises ValueError if it is
+    unknown. Unlike parse_ready_check, this can be used before the templates in
+    the ready check are resolved.
+    '''
+    kind, sep, _ = spec.partition(':')
+    kind = kind.strip().lower()
+    if not sep or kind not in READY_CHECKS:
+        raise ValueError("Invalid ready check '%s', should be one of %s" %
+                         (spec, ', '.join(['%s:...' % x for x in sorted(READY_CHECKS)])))
+    return kind
+
+
+def parse_ready_check(spec):
+    '''Return (kind, target) for the specified (resolved) ready check; raises ValueError if it is invalid.'''
+    kind = ready_check_kind(spec)
+    target = spec.partition(':')[2]
+    if kind in ('http', 'https'):
+        # keep the scheme as part of the URL
+        target = spec.strip()
+    else:
+        target = target.strip()
+    if kind == 'tcp' and not target.rpartition(':')[2].isdigit():
+        raise ValueError("Invalid ready check '%s', should be tcp:<host>:<port>" % spec)
+    return kind, target
+
+
+def wait_until_ready(spec, timeout=READY_TIMEOUT, env=None):
+    '''
+    Run the specified ready check until it succeeds, for at most timeout seconds.
+    The interval between checks doubles after each failed check, from
+    MIN_CHECK_INTERVAL up to MAX_CHECK_INTERVAL. Returns True if the check succeeded.
+    '''
+    kind, target = parse_ready_check(spec)
+    check = READY_CHECKS[kind]
+
+    deadline = time.time() + timeout
+    interval = MIN_CHECK_INTERVAL
+    attempts = 0
+    while True:
+        attempts += 1
+        remaining = deadline - time.time()
+        if check(target, max(min(remaining, MAX_CHECK_INTERVAL), MIN_CHECK_INTERVAL), env):
+            _log.debug("Ready check %s succeeded after %d attempt(s)", spec, attempts)
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            _log.debug("Ready check %s failed %d time(s), giving up", spec, attempts)
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(2 * interval, MAX_CHECK_INTERVAL)
@@ -30,7 +30,7 @@ import time
 import os
 
 from vsc.utils.fancylogger import getLogger
-from hod.mpiservice import MpiService, barrier
+from hod.mpiservice import MpiService
 
 
 class Work(object):
@@ -60,6 +60,10 @@ class Work(object):
         """Stop the service"""
         raise NotImplementedError
 
+    def work_deadline(self):
+        """Return the time (in seconds since the epoch) at which the work reaches its maximum age"""
+        return self.work_start_time + self.work_max_age
+
     def work_wait(self):
         """What to do between start and stop (and how stop is triggered). Returns True is the wait is over"""
         now = time.time()
@@ -70,15 +74,18 @@ class Work(object):
         return False
 
     def do_work_start(self):
-        """Start the work"""
-        barrier(self.svc.comm, "Going to run pre-start work on rank %s" % self.svc.rank)
+        """
+        Start the work. When running as part of a cluster, the ranks are
+        synchronised between both steps by hod.mpiservice.run_tasks.
+        """
         self.pre_start_work_service()
-        barrier(self.svc.comm, "Going to start work on rank %s" % self.svc.rank)
         self.start_work_service()
 
     def do_work_wait(self):
-        barrier(self.svc.comm, "Going to wait work on all. Return True when all is over")
-
+        """
+        Check whether the work is over. This is called by the supervisor
+        whenever something changes, so it must not do any collective calls.
+        """
         ans = self.work_wait()  # True when wait is over
 
         # # override mechanisms
@@ -99,6 +106,5 @@ class Work(object):
         return ans
 
     def do_work_stop(self):
-        """Stop the work"""
-        barrier(self.svc.comm, "Going to stop work on ")
+        """Stop the work; ranks are synchronised by the supervisor afterwards"""
         self.stop_work_service()
@@ -0,0 +1,82 @@
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+# #
+"""
+Startup time benchmark for the hod command line tool.
+
+Runs 'python -m hod.main' (like bin/hod does) for the given arguments a number
+of times in a fresh interpreter, and reports the best and median wall clock
+time. Exits with a non-zero exit code if the median goes over the budget.
+
+The median time to only import vsc-base (which the subcommands use for option
+parsing and logging) is reported as well, since that is a lower bound for
+any subcommand other than 'hod --help'.
+
+Usage: python test/benchmark/cli_startup.py [--runs 10] [--budget 0.25] [-- <hod arguments>]
+"""
+import optparse
+import os
+import subprocess
+import sys
+import time
+
+
+VSC_IMPORT = "import os; os.environ['FANCYLOGGER_IGNORE_MPI4PY'] = '1'; import vsc.utils.generaloption"
+
+
+def run_cmd(cmd, topdir):
+    """Run the given command; return the wall clock time."""
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        subprocess.call(cmd, cwd=topdir, stdout=devnull, stderr=devnull)
+        return time.time() - start
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__)
+    parser.add_option('--runs', type='int', default=10, help='number of runs')
+    parser.add_option('--budget', type='float', default=0.25, help='budget for the median time (seconds)')
+    opts, args = parser.parse_args()
+    if not args:
+        args = ['--help']
+
+    topdir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    hod_cmd = [sys.executable, '-O', '-m', 'hod.main'] + args
+    times = sorted([run_cmd(hod_cmd, topdir) for _ in range(opts.runs)])
+    median = times[len(times) // 2]
+    vsc_cmd = [sys.executable, '-O', '-c', VSC_IMPORT]
+    vsc_times = sorted([run_cmd(vsc_cmd, topdir) for _ in range(opts.runs)])
+
+    print "hod %s (%d runs)" % (' '.join(args), opts.runs)
+    print "  best:             %.4fs" % times[0]
+    print "  median:           %.4fs" % median
+    print "  budget:           %.4fs" % opts.budget
+    print "  vsc-base import:  %.4fs (median)" % vsc_times[len(vsc_times) // 2]
+    if median > opts.budget:
+        print "Median startup time is over budget!"
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
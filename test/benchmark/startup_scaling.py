@@ -0,0 +1,544 @@
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+# #
+"""
+Offline benchmark of the startup path of a cluster for a growing number of ranks.
+
+Runs setup_tasks and run_tasks (with ConfiguredMaster/ConfiguredSlave.distribution
+and _setup_config_paths) for all ranks of a simulated job, with one thread per
+rank sharing an in-process communicator instead of MPI.COMM_WORLD. Every
+simulated rank has its own host name, so it gets its own localworkdir like on
+a real node. The node discovery (e.g. probing the node local scratch) is done
+once up front, and a copy is used by each rank. Only one rank runs at a time,
+switching when it waits in a collective. The services are not actually started, and
+the supervision of the work ends right away. If the pbs/mpi4py modules are not
+available, empty stub modules are used; nothing in the startup path calls them.
+
+For each phase, this reports the wall clock time and CPU time of the master,
+the median CPU time of the slaves, and the number of read/write system calls
+and the bytes written by all ranks (from the I/O accounting of each thread in
+/proc). Since the ranks take turns, the wall clock time includes waiting for
+other ranks in the collectives; the CPU time does not. The phases are nested
+(distribution runs in setup_tasks, _setup_config_paths in distribution); the
+numbers of a phase exclude those of the phases nested in it.
+
+The collectives of the master are reported as well, with an estimate of the time
+they take on a real network, using a simple model of binomial trees (latency
+plus bandwidth per hop).
+
+Usage: python test/benchmark/startup_scaling.py [--ranks 1,2,4,...,1024] [--dist HBase-1.0.2]
+                                                [--latency 20e-6] [--bandwidth 1e9]
+"""
+import copy
+import ctypes
+import imp
+import math
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from cPickle import dumps, loads, HIGHEST_PROTOCOL
+
+from mock import patch
+
+
+def _stub_module(name):
+    '''Make an empty module available under name, if the real one can't be imported.'''
+    try:
+        __import__(name)
+    except ImportError:
+        sys.modules[name] = imp.new_module(name)
+
+# must happen before importing hod, which checks whether these are available at import time
+for _name in ['pbs', 'PBSQuery', 'mpi4py']:
+    _stub_module(_name)
+
+import hod.hodproc as hp
+import hod.mpiservice as hm
+import hod.node.node as node
+import hod.timeline as ht
+from hod.config.autogen.filesystem import local_scratch
+from hod.hodproc import ConfiguredMaster, ConfiguredSlave
+from hod.table import format_table
+from hod.work.config_service import ConfiguredService
+
+
+DEFAULT_RANKS = ','.join([str(2 ** exp) for exp in range(11)])
+
+# from <time.h>
+CLOCK_THREAD_CPUTIME_ID = 3
+
+# see MPI_UNDEFINED
+UNDEFINED = -32766
+
+# phases in the order of the table, with the depth they are nested at
+PHASES = [('setup_tasks', 0), ('distribution', 1), ('_setup_config_paths', 2), ('run_tasks', 0)]
+HEADERS = ['PHASE', 'MASTER WALL', 'MASTER CPU', 'SLAVE CPU', 'R/W SYSCALLS', 'BYTES WRITTEN']
+
+# state of the simulated rank running in the current thread
+_RANK = threading.local()
+
+
+class Aborted(Exception):
+    """Another simulated rank failed while this one was waiting in a collective."""
+
+
+class Rendezvous(object):
+    """
+    Meeting point for the ranks of a simulated communicator: each collective
+    waits until all ranks contributed their value.
+    """
+    def __init__(self, size, world):
+        self.size = size
+        self.world = world
+        self.cond = threading.Condition()
+        self.values = dict()
+        self.result = None
+        self.generation = 0
+        world.append(self)
+
+    def exchange(self, rank, value, combine=list):
+        '''Contribute value; return combine(values of all ranks), which is called only once.'''
+        with self.cond:
+            generation = self.generation
+            self.values[rank] = value
+            if len(self.values) == self.size:
+                self.result = combine([self.values[idx] for idx in range(self.size)])
+                self.values = dict()
+                self.generation += 1
+                self.cond.notify_all()
+                return self.result
+        # let another rank run while waiting for the others
+        self.world.running.release()
+        try:
+            with self.cond:
+                while self.generation == generation:
+                    if self.world.failed:
+                        raise Aborted()
+                    self.cond.wait()
+                return self.result
+        finally:
+            self.world.running.acquire()
+
+    def abort(self):
+        '''Wake up the ranks waiting in a collective.'''
+        with self.cond:
+            self.cond.notify_all()
+
+
+class World(list):
+    """
+    All communicators of a simulated job. Only one rank runs at a time (they
+    share the interpreter lock anyway); ranks switch when they wait in a collective.
+    """
+    failed = False
+
+    def __init__(self):
+        list.__init__(self)
+        self.running = threading.Semaphore(1)
+
+    def abort(self):
+        '''Make all ranks which are waiting in a collective fail.'''
+        self.failed = True
+        for rdv in self[:]:
+            rdv.abort()
+
+
+class SimulatedGroup(object):
+    """Group of ranks of a simulated communicator."""
+    def __init__(self, ranks, rank):
+        self.ranks = list(ranks)
+        self.rank = rank
+
+    def Get_rank(self):
+        if self.rank in self.ranks:
+            return self.ranks.index(self.rank)
+        return UNDEFINED
+
+    def Get_size(self):
+        return len(self.ranks)
+
+    def Incl(self, ranks):
+        return SimulatedGroup([self.ranks[idx] for idx in ranks], self.rank)
+
+
+class SimulatedComm(object):
+    """
+    Communicator for one rank of a simulated job. Objects are pickled (like
+    mpi4py does) when they are passed to other ranks.
+    """
+    def __init__(self, rdv, rank):
+        self.rdv = rdv
+        self.rank = rank
+
+    def _record(self, kind, nbytes):
+        '''Add a collective (with the bytes it sends) to the collectives of the current rank.'''
+        _RANK.collectives.append((kind, nbytes, self.rdv.size))
+
+    def Get_rank(self):
+        return self.rank
+
+    def Get_size(self):
+        return self.rdv.size
+
+    def bcast(self, obj=None, root=0):
+        data = None
+        if self.rank == root:
+            data = dumps(obj, HIGHEST_PROTOCOL)
+        data = self.rdv.exchange(self.rank, data)[root]
+        self._record('bcast', len(data))
+        if self.rank == root:
+            return obj
+        return loads(data)
+
+    def gather(self, obj, root=0):
+        values = self.rdv.exchange(self.rank, dumps(obj, HIGHEST_PROTOCOL))
+        self._record('gather', sum([len(data) for data in values]))
+        if self.rank == root:
+            return [loads(data) for data in values]
+        return None
+
+    def allgather(self, obj):
+        values = self.rdv.exchange(self.rank, dumps(obj, HIGHEST_PROTOCOL))
+        self._record('allgather', sum([len(data) for data in values]))
+        return [loads(data) for data in values]
+
+    def barrier(self):
+        self.rdv.exchange(self.rank, None)
+        self._record('barrier', 0)
+
+    def Get_group(self):
+        return SimulatedGroup(range(self.rdv.size), self.rank)
+
+    def Create(self, group):
+        ranks = group.ranks
+        rdv = self.rdv.exchange(self.rank, None, combine=lambda _: Rendezvous(len(ranks), self.rdv.world))
+        if self.rank in ranks:
+            return SimulatedComm(rdv, ranks.index(self.rank))
+        return SimulatedMPI.COMM_NULL
+
+    def Free(self):
+        pass
+
+    def Disconnect(self):
+        pass
+
+
+class SimulatedMPI(object):
+    """Stand-in for mpi4py.MPI in hod.mpiservice; COMM_WORLD is the communicator of the current rank."""
+    COMM_NULL = object()
+    ANY_SOURCE = -1
+    UNDEFINED = UNDEFINED
+
+    @property
+    def COMM_WORLD(self):
+        return _RANK.comm
+
+
+class RankDiscovery(object):
+    """Node discovery of the current rank, which runs on a host of its own."""
+    def __getattr__(self, name):
+        return getattr(_RANK.discovery, name)
+
+
+class RankTimeline(object):
+    """Startup timeline (see hod.timeline) of the current rank."""
+    def __getattr__(self, name):
+        return getattr(_RANK.timeline, name)
+
+
+class FinishedSupervisor(object):
+    """Supervisor for work which is over as soon as it is started."""
+    def __init__(self, comm, active_work, masterrank, **kwargs):
+        self.comm = comm
+
+    def run(self):
+        self.comm.barrier()
+
+
+class _Timespec(ctypes.Structure):
+    '''struct timespec'''
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _thread_cpu_clock():
+    '''Return function which returns the CPU time of the current thread in seconds (None if unknown).'''
+    try:
+        clock_gettime = ctypes.CDLL(None).clock_gettime
+    except (OSError, AttributeError):
+        return lambda: None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+
+    def thread_cpu():
+        spec = _Timespec()
+        if clock_gettime(CLOCK_THREAD_CPUTIME_ID, ctypes.byref(spec)) != 0:
+            return None
+        return spec.tv_sec + spec.tv_nsec * 1e-9
+    return thread_cpu
+
+thread_cpu = _thread_cpu_clock()
+
+
+def thread_io():
+    '''Return (read/write system calls, bytes written) by the current thread so far; (None, None) if unknown.'''
+    try:
+        with open('/proc/thread-self/io') as fh:
+            counters = dict([line.split(':') for line in fh.read().splitlines()])
+        return int(counters['syscr']) + int(counters['syscw']), int(counters['wchar'])
+    except (IOError, KeyError, ValueError):
+        return None, None
+
+
+def _sample():
+    '''Return (wall clock time, CPU time, read/write system calls, bytes written) of the current thread.'''
+    return (ht.now(), thread_cpu()) + thread_io()
+
+
+def _diff(start, end, overhead):
+    '''Difference between the samples start and end, corrected for the overhead of taking a sample.'''
+    return [None if None in (begin, stop, extra) else stop - begin - extra
+            for begin, stop, extra in zip(start, end, overhead)]
+
+
+class PhaseMeter(object):
+    """Wall clock time, CPU time, system calls and bytes written per phase and per rank."""
+    def __init__(self):
+        self.metrics = dict()
+        self.lock = threading.Lock()
+        # only the system calls and bytes written by reading the I/O counters are subtracted
+        start = _sample()
+        self.overhead = [0, 0] + _diff(start, _sample(), [0, 0, 0, 0])[2:]
+
+    def reset(self):
+        self.metrics = dict()
+
+    def wrap(self, phase, func):
+        '''
+        Return function which calls func, and adds the metrics to phase of the current rank.
+        The metrics of the phases which are nested in it are subtracted.
+        '''
+        def measured(*args, **kwargs):
+            # metrics of the phases nested in this one (in the current rank)
+            nested = [0, 0, 0, 0]
+            _RANK.phases.append(nested)
+            start = _sample()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics = _diff(start, _sample(), self.overhead)
+                _RANK.phases.pop()
+                if _RANK.phases:
+                    _RANK.phases[-1][:] = [_total([outer, value]) for outer, value in zip(_RANK.phases[-1], metrics)]
+                metrics = [_total([value, -inner]) for value, inner in zip(metrics, nested)]
+                with self.lock:
+                    self.metrics.setdefault(phase, dict()).setdefault(_RANK.rank, []).append(metrics)
+        return measured
+
+    def rows(self):
+        '''Return table rows with the metrics of each phase (see HEADERS); nested phases are indented.'''
+        rows = []
+        for phase, depth in PHASES:
+            by_rank = dict([(rank, [_total(values) for values in zip(*calls)])
+                            for rank, calls in self.metrics.get(phase, dict()).items()])
+            if not by_rank:
+                continue
+            master = by_rank.get(hm.MASTERRANK, [None] * 4)
+            slave_cpu = _median([metrics[1] for rank, metrics in by_rank.items() if rank != hm.MASTERRANK])
+            syscalls = _total([metrics[2] for metrics in by_rank.values()])
+            written = _total([metrics[3] for metrics in by_rank.values()])
+            rows.append(['  ' * depth + phase, _fmt_time(master[0]), _fmt_time(master[1]), _fmt_time(slave_cpu),
+                         _fmt_count(syscalls), _fmt_count(written)])
+        return rows
+
+
+def _total(values):
+    if None in values:
+        return None
+    return sum(values)
+
+
+def collective_time(collectives, latency, bandwidth):
+    '''Estimated time of the collectives (see SimulatedComm._record) on a real network, using binomial trees.'''
+    total = 0
+    for kind, nbytes, size in collectives:
+        hops = math.ceil(math.log(size, 2)) if size > 1 else 0
+        if kind == 'barrier':
+            total += 2 * hops * latency
+        elif kind == 'bcast':
+            total += hops * (latency + float(nbytes) / bandwidth)
+        else:
+            # gathered data goes over the links to the root once
+            total += hops * latency + float(nbytes) / bandwidth
+    return total
+
+
+def _median(values):
+    if not values or None in values:
+        return None
+    return sorted(values)[len(values) // 2]
+
+
+def _fmt_time(value):
+    if value is None:
+        return '-'
+    return '%.4fs' % value
+
+
+def _fmt_count(value):
+    if value is None:
+        return '-'
+    return str(value)
+
+
+class Options(object):
+    """Command line options of 'hod create'/'hod batch' which are used by setup_tasks."""
+    def __init__(self, dist, workdir):
+        self.hodconf = None
+        self.dist = dist
+        self.workdir = workdir
+        self.modulepaths = None
+        self.modules = None
+        self.label = 'benchmark'
+        self.script = None
+
+
+def discover_node():
+    """Run the node discovery in the current thread; return the discovery cache."""
+    _RANK.discovery = node.DiscoveryCache()
+    node.discovery.hostaddress()
+    node.discovery.networks()
+    node.discovery.memory()
+    node.discovery.usable_cores()
+    node.discovery.cgroup()
+    node.discovery.numa()
+    local_scratch()
+    return _RANK.discovery
+
+
+def run_rank(rank, rdv, options, discovery, errors, collectives):
+    """Run the startup of a simulated rank; the collectives of the rank are added to collectives."""
+    _RANK.rank = rank
+    _RANK.comm = SimulatedComm(rdv, rank)
+    _RANK.collectives = collectives
+    _RANK.phases = []
+    _RANK.discovery = copy.deepcopy(discovery)
+    _RANK.discovery.invalidate('fqdn')
+    _RANK.discovery.get('fqdn', lambda: 'node%04d.benchmark' % rank)
+    _RANK.timeline = ht.Timeline(rank)
+    rdv.world.running.acquire()
+    try:
+        if rank == hm.MASTERRANK:
+            svc = ConfiguredMaster(options)
+        else:
+            svc = ConfiguredSlave(options)
+        hm.setup_tasks(svc)
+        hm.run_tasks(svc)
+    except Aborted:
+        pass
+    except Exception:
+        errors.append(sys.exc_info())
+        rdv.world.abort()
+    finally:
+        rdv.world.running.release()
+
+
+def run_job(size, options, discovery):
+    """
+    Run the startup of all ranks of a simulated job of the given size;
+    return the wall clock time and the collectives of the master.
+    """
+    world = World()
+    rdv = Rendezvous(size, world)
+    errors = []
+    collectives = dict([(rank, []) for rank in range(size)])
+    threads = [threading.Thread(target=run_rank, args=(rank, rdv, options, discovery, errors, collectives[rank]))
+               for rank in range(size)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return time.time() - start, collectives[hm.MASTERRANK]
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__)
+    parser.add_option('--ranks', default=DEFAULT_RANKS, help='comma separated list of numbers of simulated ranks')
+    parser.add_option('--dist', default='HBase-1.0.2', help='bundled distribution to use')
+    parser.add_option('--latency', type='float', default=20e-6, help='latency per hop (seconds)')
+    parser.add_option('--bandwidth', type='float', default=1e9, help='bandwidth per hop (bytes/second)')
+    opts, _ = parser.parse_args()
+
+    # localworkdir is named after the job
+    os.environ.setdefault('PBS_JOBID', 'benchmark')
+
+    meter = PhaseMeter()
+    if thread_io()[0] is None:
+        print "No I/O accounting per thread in /proc, system calls and bytes written are not reported"
+
+    patches = [
+        patch('hod.mpiservice.MPI', SimulatedMPI(), create=True),
+        patch('hod.mpiservice.Supervisor', FinishedSupervisor),
+        patch('hod.node.node.discovery', RankDiscovery()),
+        patch('hod.timeline._TIMELINE', RankTimeline()),
+        patch('hod.mpiservice.setup_tasks', meter.wrap('setup_tasks', hm.setup_tasks)),
+        patch('hod.mpiservice.run_tasks', meter.wrap('run_tasks', hm.run_tasks)),
+        patch('hod.hodproc._setup_config_paths', meter.wrap('_setup_config_paths', hp._setup_config_paths)),
+        patch.object(ConfiguredMaster, 'distribution', meter.wrap('distribution', ConfiguredMaster.distribution)),
+        patch.object(ConfiguredSlave, 'distribution', meter.wrap('distribution', ConfiguredSlave.distribution)),
+        patch.object(ConfiguredService, 'pre_start_work_service', lambda self: None),
+        patch.object(ConfiguredService, 'start_work_service', lambda self: None),
+    ]
+    for ptch in patches:
+        ptch.start()
+    try:
+        start = time.time()
+        discovery = discover_node()
+        print "node discovery: %.4fs" % (time.time() - start)
+        print
+        for size in [int(size) for size in opts.ranks.split(',')]:
+            meter.reset()
+            workdir = tempfile.mkdtemp(prefix='hod-benchmark-')
+            try:
+                wall, collectives = run_job(size, Options(opts.dist, workdir), discovery)
+            finally:
+                shutil.rmtree(workdir)
+            print "distribution %s on %d simulated ranks: %.4fs" % (opts.dist, size, wall)
+            print format_table(meter.rows(), HEADERS)
+            print "collectives of the master: %d (%d bytes), %.4fs on a real network (estimated)" % (
+                len(collectives), sum([nbytes for _, nbytes, _ in collectives]),
+                collective_time(collectives, opts.latency, opts.bandwidth))
+            print
+    finally:
+        for ptch in reversed(patches):
+            ptch.stop()
+
+
+if __name__ == '__main__':
+    main()
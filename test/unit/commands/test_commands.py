@@ -25,8 +25,12 @@
 @author Ewan Higgs (Universiteit Gent)
 '''
 
+import os
+import tempfile
+import time
 import unittest
 import pytest
+from mock import patch
 import hod.commands.command as hcc
 
 class HodCommandsCommandTestCase(unittest.TestCase):
@@ -80,6 +84,88 @@ class HodCommandsCommandTestCase(unittest.TestCase):
         self.assertEqual(out, '')
         self.assertEqual(err, 'hello')
 
+    def test_command_large_output(self):
+        '''test command with more output than fits in a pipe buffer'''
+        c = hcc.Command('head -c 1000000 /dev/zero | tr "\\0" x')
+        out, err = c.run()
+        self.assertEqual(len(out), 1000000)
+        self.assertEqual(err, '')
+
+    def test_command_max_output(self):
+        '''test only the tail of the output is kept'''
+        c = hcc.Command('seq 1 100000', max_output=100)
+        out, _ = c.run()
+        self.assertTrue(len(out) <= 100)
+        self.assertTrue(out.endswith('99999\n100000'))
+
+    def test_command_logfile(self):
+        '''test output is streamed to the log file'''
+        fd, logfile = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            c = hcc.Command('seq 1 1000', logfile=logfile, max_output=10)
+            c.run()
+            with open(logfile) as fh:
+                self.assertEqual(fh.read(), ''.join(['%d\n' % i for i in range(1, 1001)]))
+        finally:
+            os.remove(logfile)
+
+    def test_command_fake_pty_large_output(self):
+        '''test command with more output than fits in the pty buffer, in fake pty mode'''
+        fd, logfile = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            c = hcc.Command('head -c 100000 /dev/zero | tr "\\0" x', timeout=10, logfile=logfile)
+            c.fake_pty = True
+            c.run()
+            self.assertFalse(c.timedout)
+            self.assertEqual(c.returncode, 0)
+            with open(logfile) as fh:
+                self.assertEqual(fh.read(), 'x' * 100000)
+        finally:
+            os.remove(logfile)
+
+    def test_command_start_failed(self):
+        '''test the log file is closed if the command can't be started'''
+        fd, logfile = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            c = hcc.Command('true', logfile=logfile)
+            c.fake_pty = True
+            with patch('hod.commands.command.Popen', side_effect=OSError('no such file')):
+                self.assertRaises(OSError, c.start)
+            self.assertEqual(c._log_fh, None)
+            self.assertEqual(c._pty_fds, None)
+        finally:
+            os.remove(logfile)
+
+    def test_command_timeout(self):
+        '''test command is terminated when it runs past its timeout'''
+        start = time.time()
+        c = hcc.Command('sleep 10', timeout=0.2)
+        out, err = c.run()
+        self.assertTrue(time.time() - start < 5)
+        self.assertTrue(c.timedout)
+        self.assertEqual(err, 'Exitcode -15\n')
+
+    def test_command_start_poll(self):
+        '''test starting a command without waiting for it'''
+        c = hcc.Command('echo hello; sleep 0.2')
+        self.assertTrue(c.start())
+        self.assertTrue(c.pid > 0)
+        self.assertEqual(c.poll(), None)
+        out, err = c.wait()
+        self.assertEqual(out, 'hello')
+        self.assertEqual(c.poll(), 0)
+
+    def test_command_background_daemon(self):
+        '''test command which leaves a daemon holding its stdout'''
+        start = time.time()
+        c = hcc.Command('(sleep 5 &); echo started')
+        out, err = c.run()
+        self.assertEqual(out, 'started')
+        self.assertTrue(time.time() - start < 4)
+
     def test_generate_ssh_key(self):
         '''test generate ssh key'''
         c = hcc.GenerateSshKey('.')
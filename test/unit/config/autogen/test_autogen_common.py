@@ -32,6 +32,7 @@ import hod.config.autogen.common as hcc
 import unittest
 from mock import patch, MagicMock
 import errno
+import time
 
 class TestConfigAutogenCommon(unittest.TestCase):
     def test_blocksize(self):
@@ -142,3 +143,103 @@ class TestConfigAutogenCommon(unittest.TestCase):
         self.assertEqual(hcc.available_memory(node), int(avail * 1./2))
         node['cores'] = 1 
         self.assertEqual(hcc.available_memory(node), int(avail * 1./24))
+
+    def test_usable_cores(self):
+        node = dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
+                cores=24, totalcores=24, usablecores=range(24), num_nodes=1,
+                memory=dict(meminfo=dict(memtotal=68719476736), ulimit='unlimited'))
+        self.assertEqual(hcc.usable_cores(node), 24)
+        node['ppn'] = 16
+        self.assertEqual(hcc.usable_cores(node), 16)
+        node['cgroup'] = dict(memory=None, cpus=None, cpuset=range(12), mems=None)
+        self.assertEqual(hcc.usable_cores(node), 12)
+        node['cgroup']['cpus'] = 2.5
+        self.assertEqual(hcc.usable_cores(node), 3)
+
+    def test_available_memory_cgroup(self):
+        total_mem = 68719476736
+        node = dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
+                cores=24, totalcores=24, usablecores=range(24), num_nodes=1,
+                memory=dict(meminfo=dict(memtotal=total_mem), ulimit='unlimited'),
+                cgroup=dict(memory=hcc.parse_memory('16g'), cpus=None, cpuset=None, mems=None))
+        avail = hcc.parse_memory('16g') - hcc.parse_memory('2g')
+        self.assertEqual(hcc.available_memory(node), avail)
+
+    def test_available_memory_ppn(self):
+        total_mem = 68719476736
+        node = dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
+                cores=24, totalcores=24, usablecores=range(24), num_nodes=1, ppn=6,
+                memory=dict(meminfo=dict(memtotal=total_mem), ulimit='unlimited'))
+        avail = total_mem - hcc.parse_memory('8g')
+        self.assertEqual(hcc.available_memory(node), int(avail * 1./4))
+
+    def test_available_memory_hugepages(self):
+        total_mem = 68719476736
+        node = dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
+                cores=24, totalcores=24, usablecores=range(24), num_nodes=1,
+                memory=dict(meminfo=dict(memtotal=total_mem, hugepages_total=8192, hugepagesize=2*1024**2),
+                            ulimit='unlimited'))
+        avail = total_mem - hcc.parse_memory('16g') - hcc.parse_memory('6g')
+        self.assertEqual(hcc.available_memory(node), avail)
+
+    def test_available_memory_numa(self):
+        total_mem = 68719476736
+        numa = [dict(id=0, cpus=range(12), memtotal=total_mem/2),
+                dict(id=1, cpus=range(12, 24), memtotal=total_mem/2)]
+        node = dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
+                cores=24, totalcores=24, usablecores=range(24), num_nodes=1, numa=numa,
+                memory=dict(meminfo=dict(memtotal=total_mem), ulimit='unlimited'),
+                cgroup=dict(memory=None, cpus=None, cpuset=None, mems=[1]))
+        self.assertEqual(hcc.numa_nodes(node), [numa[1]])
+        avail = hcc.parse_memory('32g') - hcc.parse_memory('6g')
+        self.assertEqual(hcc.available_memory(node), avail)
+
+        node['cgroup']['mems'] = None
+        node['usablecores'] = range(6)
+        self.assertEqual(hcc.numa_nodes(node), [numa[0]])
+
+    def test_node_resources(self):
+        total_mem = 68719476736
+        node = dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
+                cores=24, totalcores=24, usablecores=range(24), num_nodes=1, ppn=12,
+                memory=dict(meminfo=dict(memtotal=total_mem), ulimit='unlimited'))
+        resources = hcc.node_resources(node)
+        self.assertEqual(resources.cores, 12)
+        self.assertEqual(resources.memory, hcc.available_memory(node))
+        self.assertEqual(resources.numa_nodes, [])
+
+    def test_blocksize_timeout(self):
+        with patch('os.statvfs', return_value=MagicMock(f_bsize=1048576)):
+            self.assertEqual(hcc.blocksize_timeout('/'), 1048576)
+        with patch('os.statvfs', side_effect=OSError(errno.EACCES, 'message')):
+            self.assertRaises(OSError, hcc.blocksize_timeout, '/')
+
+        # hanging file system
+        def hanging_statvfs(path):
+            time.sleep(2)
+            return MagicMock(f_bsize=1048576)
+        with patch('os.statvfs', side_effect=hanging_statvfs):
+            start = time.time()
+            self.assertEqual(hcc.blocksize_timeout('/', timeout=0.1), hcc.DEFAULT_BLOCKSIZE)
+            self.assertTrue(time.time() - start < 1)
+
+    def test_autogen_context(self):
+        node = dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
+                cores=24, totalcores=24, usablecores=range(24), num_nodes=1,
+                memory=dict(meminfo=dict(memtotal=68719476736), ulimit='unlimited'))
+        ctx = hcc.AutogenContext(node)
+        self.assertEqual(ctx['cores'], 24)
+        with patch('hod.config.autogen.common.available_memory', return_value=1024**3) as available_memory:
+            self.assertEqual(hcc.node_resources(ctx), hcc.node_resources(ctx))
+            self.assertEqual(available_memory.call_count, 1)
+            # plain node info is not cached
+            hcc.node_resources(node)
+            hcc.node_resources(node)
+            self.assertEqual(available_memory.call_count, 3)
+
+        with patch('os.statvfs', return_value=MagicMock(f_bsize=4194304)) as statvfs:
+            self.assertEqual(hcc.workdir_blocksize('/', ctx), 4194304)
+            self.assertEqual(hcc.workdir_blocksize('/', ctx), 4194304)
+            self.assertEqual(statvfs.call_count, 1)
+            hcc.workdir_blocksize('/tmp', ctx)
+            self.assertEqual(statvfs.call_count, 2)
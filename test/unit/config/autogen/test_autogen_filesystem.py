@@ -0,0 +1,152 @@
+##
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the file system detection and I/O tuning of autogenerated configurations.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+import hod.config.autogen.common as hcc
+import hod.config.autogen.filesystem as hcf
+
+
+def _node():
+    return dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
+                cores=24, totalcores=24, usablecores=range(24), num_nodes=1,
+                memory=dict(meminfo=dict(memtotal=68719476736), ulimit='unlimited'))
+
+
+class TestConfigAutogenFilesystem(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_mount_point(self):
+        mounts = os.path.join(self.tmpdir, 'mounts')
+        with open(mounts, 'w') as fh:
+            fh.write('/dev/sda1 / ext4 rw 0 0\n'
+                     'storage@o2ib:/scratch /user/scratch lustre rw 0 0\n'
+                     'gpfs0 /user/data\\040gpfs gpfs rw 0 0\n'
+                     'tmpfs /user/scratchy tmpfs rw 0 0\n')
+        with patch('os.path.realpath', side_effect=lambda x: x):
+            self.assertEqual(hcf.mount_point('/user/scratch/gent/vsc400', mounts), ('/user/scratch', 'lustre'))
+            self.assertEqual(hcf.mount_point('/user/scratch', mounts), ('/user/scratch', 'lustre'))
+            self.assertEqual(hcf.mount_point('/user/scratchy/x', mounts), ('/user/scratchy', 'tmpfs'))
+            self.assertEqual(hcf.mount_point('/user/data gpfs/x', mounts), ('/user/data gpfs', 'gpfs'))
+            self.assertEqual(hcf.mount_point('/home/x', mounts), ('/', 'ext4'))
+
+    def test_lustre_stripe(self):
+        out = 'stripe_count:  4 stripe_size:   1048576 pattern:       0 stripe_offset: -1\n'
+        with patch('hod.config.autogen.filesystem.Command.run', return_value=(out, '')):
+            self.assertEqual(hcf.lustre_stripe('/scratch'), (4, 1048576))
+        with patch('hod.config.autogen.filesystem.Command.run', return_value=('lfs: command not found', '')):
+            self.assertEqual(hcf.lustre_stripe('/scratch'), (None, None))
+
+    def test_detect_filesystem(self):
+        path = os.path.join(self.tmpdir, 'does', 'not', 'exist')
+        with patch('hod.config.autogen.filesystem.mount_point', return_value=('/scratch', 'lustre')) as mount_point:
+            with patch('hod.config.autogen.filesystem._statfs_type', return_value=None):
+                with patch('hod.config.autogen.filesystem.lustre_stripe', return_value=(4, 1048576)):
+                    fsinfo = hcf.detect_filesystem(path, 4096)
+        # the closest existing parent directory is used
+        mount_point.assert_called_with(self.tmpdir)
+        self.assertEqual(fsinfo, hcf.FsInfo('lustre', 'lustre', '/scratch', 4096, 4, 1048576))
+
+        # statfs has the final word (e.g. for fuse mounts)
+        with patch('hod.config.autogen.filesystem.mount_point', return_value=('/data', 'fuse')):
+            with patch('hod.config.autogen.filesystem._statfs_type', return_value='gpfs'):
+                fsinfo = hcf.detect_filesystem(self.tmpdir, 4194304)
+        self.assertEqual(fsinfo, hcf.FsInfo('gpfs', 'gpfs', '/data', 4194304, None, None))
+
+        # unknown file systems are considered to be local
+        with patch('hod.config.autogen.filesystem.mount_point', return_value=('/', 'zfs')):
+            with patch('hod.config.autogen.filesystem._statfs_type', return_value=None):
+                self.assertEqual(hcf.detect_filesystem(self.tmpdir, 4096).kind, 'local')
+
+    def test_is_shared_filesystem(self):
+        with patch('hod.config.autogen.filesystem._statfs_type', return_value=None):
+            with patch('hod.config.autogen.filesystem.mount_point', return_value=('/user', 'nfs4')):
+                self.assertTrue(hcf.is_shared_filesystem(os.path.join(self.tmpdir, 'does', 'not', 'exist')))
+            with patch('hod.config.autogen.filesystem.mount_point', return_value=('/', 'ext4')):
+                self.assertFalse(hcf.is_shared_filesystem(self.tmpdir))
+
+    def test_io_buffer_size(self):
+        self.assertEqual(hcf.io_buffer_size(hcf.FsInfo('ext4', 'local', '/', 4096, None, None)), 4096)
+        self.assertEqual(hcf.io_buffer_size(hcf.FsInfo('lustre', 'lustre', '/', 4096, 4, 1048576)), 1048576)
+        self.assertEqual(hcf.io_buffer_size(hcf.FsInfo('gpfs', 'gpfs', '/', 16 * 1024**2, None, None)),
+                         hcf.MAX_IO_BUFFER_SIZE)
+
+    def test_probe_scratch(self):
+        ext4 = hcf.FsInfo('ext4', 'local', '/', 4096, None, None)
+        with patch('hod.config.autogen.filesystem.detect_filesystem', return_value=ext4):
+            free, throughput = hcf.probe_scratch(self.tmpdir, size=1024**2)
+            self.assertTrue(free > 0)
+            self.assertTrue(throughput > 0)
+            # the probe file is removed
+            self.assertEqual(os.listdir(self.tmpdir), [])
+            self.assertEqual(hcf.probe_scratch(os.path.join(self.tmpdir, 'nosuchdir')), None)
+        for fsinfo in [hcf.FsInfo('tmpfs', 'local', '/tmp', 4096, None, None),
+                       hcf.FsInfo('gpfs', 'gpfs', '/user', 4096, None, None)]:
+            with patch('hod.config.autogen.filesystem.detect_filesystem', return_value=fsinfo):
+                self.assertEqual(hcf.probe_scratch(self.tmpdir), None)
+
+    def test_select_local_scratch(self):
+        probes = {
+            '/tmp': (100 * 1024**3, 100 * 1024**2),
+            '/local': (500 * 1024**3, 400 * 1024**2),
+            '/full': (1024**2, 800 * 1024**2),
+        }
+        with patch('hod.config.autogen.filesystem.probe_scratch', side_effect=probes.get):
+            with patch('os.path.realpath', side_effect=lambda x: x):
+                with patch.dict(os.environ, dict(TMPDIR='/tmp', VSC_SCRATCH_NODE='/local')):
+                    self.assertEqual(hcf.select_local_scratch(), '/local')
+                    # not enough free space on /full
+                    self.assertEqual(hcf.select_local_scratch(['/full', '$TMPDIR']), '/tmp')
+                    self.assertEqual(hcf.select_local_scratch(['$NOSUCHVAR', '/nosuchdir']), None)
+
+    def test_io_tuning(self):
+        local = hcf.FsInfo('ext4', 'local', '/', 4096, None, None)
+        with patch('hod.config.autogen.filesystem.detect_filesystem', return_value=local):
+            tuning = hcf.io_tuning('/', hcc.AutogenContext(_node()))
+        self.assertEqual(tuning, {
+            'core-site.xml': {'io.file.buffer.size': 4096},
+            'mapred-site.xml': {},
+            'yarn-site.xml': {},
+        })
+
+        lustre = hcf.FsInfo('lustre', 'lustre', '/scratch', 4096, 4, 1048576)
+        with patch('hod.config.autogen.filesystem.detect_filesystem', return_value=lustre):
+            # the node local scratch is only selected when $localscratch is resolved
+            with patch('hod.config.autogen.filesystem.select_local_scratch') as select:
+                tuning = hcf.io_tuning('/scratch', hcc.AutogenContext(_node()))
+            self.assertFalse(select.called)
+            self.assertEqual(tuning['core-site.xml'], {'io.file.buffer.size': 1048576, 'hadoop.tmp.dir': '$localscratch'})
+            self.assertEqual(tuning['mapred-site.xml'], hcf.SHARED_SPILL_TUNING)
+            self.assertEqual(tuning['yarn-site.xml'], {'yarn.nodemanager.local-dirs': '$localscratch/nm-local-dir'})
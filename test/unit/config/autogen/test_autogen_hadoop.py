@@ -82,6 +82,48 @@ class TestConfigAutogenHadoop(unittest.TestCase):
         self.assertEqual(d['yarn.scheduler.minimum-allocation-vcores'], '1')
         self.assertEqual(d['yarn.nodemanager.resource.cpu-vcores'], '24')
 
+    def test_yarn_site_xml_defaults_cgroup(self):
+        node = dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
+                cores=24, totalcores=24, usablecores=range(24), num_nodes=1, ppn=8,
+                memory=dict(meminfo=dict(memtotal=68719476736), ulimit='unlimited'),
+                cgroup=dict(memory=hcc.parse_memory('16G'), cpus=None, cpuset=None, mems=None))
+        d = hca.yarn_site_xml_defaults('/', node)
+        # containers fill the cgroup, minus what the OS (and the daemons) need
+        self.assertEqual(d['yarn.nodemanager.resource.memory-mb'], hcc.round_mb(hcc.parse_memory('14G')))
+        self.assertEqual(d['yarn.nodemanager.resource.cpu-vcores'], '8')
+        self.assertEqual(d['yarn.scheduler.maximum-allocation-vcores'], '8')
+
+    def test_yarn_site_xml_defaults_numa(self):
+        numa = [dict(id=0, cpus=range(12), memtotal=34359738368),
+                dict(id=1, cpus=range(12, 24), memtotal=34359738368)]
+        node = dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
+                cores=24, totalcores=24, usablecores=range(24), num_nodes=1, numa=numa,
+                memory=dict(meminfo=dict(memtotal=68719476736), ulimit='unlimited'))
+        mem_dflts = hca.memory_defaults(node)
+        self.assertEqual(mem_dflts.num_numa_nodes, 2)
+        self.assertEqual(mem_dflts.num_containers % 2, 0)
+        d = hca.yarn_site_xml_defaults('/', node)
+        self.assertEqual(d['yarn.nodemanager.resource.memory-mb'], hcc.round_mb(hcc.parse_memory('56G')))
+        # a single container fits in one NUMA node
+        self.assertEqual(d['yarn.scheduler.maximum-allocation-mb'], hcc.round_mb(hcc.parse_memory('28G')))
+        self.assertEqual(d['yarn.scheduler.maximum-allocation-vcores'], '12')
+        self.assertEqual(d['yarn.nodemanager.resource.cpu-vcores'], '24')
+        d = hca.mapred_site_xml_defaults('/', node)
+        self.assertTrue(d['mapreduce.map.java.opts'].endswith(' -XX:+UseNUMA'))
+
+    def test_yarn_site_xml_defaults_numa_low_memory(self):
+        '''With one container per NUMA node, reduce containers must still fit in the maximum allocation.'''
+        numa = [dict(id=idx, cpus=[idx], memtotal=805306368) for idx in range(4)]
+        node = dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
+                cores=4, totalcores=4, usablecores=range(4), num_nodes=1, numa=numa,
+                memory=dict(meminfo=dict(memtotal=3221225472), ulimit='unlimited'))
+        mem_dflts = hca.memory_defaults(node)
+        self.assertEqual(mem_dflts.num_containers, 4)
+        yarn = hca.yarn_site_xml_defaults('/', node)
+        mapred = hca.mapred_site_xml_defaults('/', node)
+        self.assertTrue(mapred['mapreduce.reduce.memory.mb'] <= yarn['yarn.scheduler.maximum-allocation-mb'])
+        self.assertTrue(mapred['mapreduce.map.memory.mb'] <= yarn['yarn.scheduler.maximum-allocation-mb'])
+
     def test_capacity_scheduler_xml_defaults(self):
         node = dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
                 cores=24, totalcores=24, usablecores=range(24), num_nodes=1,
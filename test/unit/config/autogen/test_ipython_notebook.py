@@ -32,6 +32,7 @@ import hod.config.autogen.ipython_notebook as hcip
 import hod.config.autogen.common as hcc
 
 import unittest
+from mock import patch, MagicMock
 class TestIpythonNodebook(unittest.TestCase):
     def test_spark_defaults(self):
         node = dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
@@ -62,3 +63,29 @@ class TestIpythonNodebook(unittest.TestCase):
         self.assertEqual(dflts['spark.executor.instances'], 1)
         self.assertEqual(dflts['spark.executor.cores'], 1)
         self.assertEqual(hcc.parse_memory(dflts['spark.executor.memory']), hcc.parse_memory('56G'))
+
+    def test_spark_defaults_numa(self):
+        numa = [dict(id=0, cpus=range(5), memtotal=34359738368),
+                dict(id=1, cpus=range(5, 10), memtotal=34359738368)]
+        node = dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
+                    cores=10, totalcores=10, usablecores=range(10), num_nodes=1, numa=numa,
+                    memory=dict(meminfo=dict(memtotal=68719476736), ulimit='unlimited'))
+        dflts = hcip.spark_defaults(None, node)
+        # 2 executors of 2 cores per NUMA node, rather than 5 executors which don't fit in the NUMA nodes
+        self.assertEqual(dflts['spark.executor.instances'], 3)
+        self.assertEqual(dflts['spark.executor.cores'], 2)
+        self.assertEqual(hcc.parse_memory(dflts['spark.executor.memory']), hcc.parse_memory('14G'))
+        self.assertEqual(dflts['spark.executor.extraJavaOptions'], '-XX:+UseNUMA')
+
+    def test_autogen_config_context(self):
+        node = dict(fqdn='hosty.domain.be', network='ib0', pid=1234,
+                    cores=16, totalcores=16, usablecores=range(16), num_nodes=1,
+                    memory=dict(meminfo=dict(memtotal=68719476736), ulimit='unlimited'))
+        ctx = hcc.AutogenContext(node)
+        with patch('hod.config.autogen.common.available_memory', wraps=hcc.available_memory) as available_memory:
+            with patch('os.statvfs', return_value=MagicMock(f_bsize=4194304)) as statvfs:
+                d = hcip.autogen_config('/', ctx)
+        self.assertEqual(len(d), 5)
+        # the node resources and the file system are only probed once for all generators
+        self.assertEqual(available_memory.call_count, 1)
+        self.assertEqual(statvfs.call_count, 1)
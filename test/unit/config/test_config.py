@@ -28,6 +28,8 @@
 
 import os
 import os.path
+import shutil
+import tempfile
 import unittest
 from mock import patch 
 from os.path import basename
@@ -35,6 +37,7 @@ from cStringIO import StringIO
 from cPickle import dumps, loads
 from ConfigParser import NoOptionError
 
+import hod
 import hod.config.config as hcc
 import hod.config.template as hct
 
@@ -246,6 +249,115 @@ SOME_ENV=123""")
         self.assertTrue(isinstance(cfg.env['SOME_ENV'], basestring))
         self.assertEqual(hcc.env2str(cfg.env), 'SOME_ENV="123" ')
 
+    def test_ConfigOpts_after_requires(self):
+        config = StringIO("""
+[Unit]
+Name=testconfig
+RunsOn=all
+After=namenode, zookeeper
+Requires=resourcemanager
+
+[Service]
+ExecStart=starter
+ExecStop=stopper
+
+[Environment]
+""")
+        cfg = hcc.ConfigOpts.from_file(config, hct.TemplateResolver(workdir=''))
+        self.assertEqual(cfg.after, ['namenode', 'zookeeper'])
+        self.assertEqual(cfg.requires, ['resourcemanager'])
+        params = cfg.to_params('workdir', 'modulepaths', 'modules', [])
+        remade_cfg = hcc.ConfigOpts.from_params(params, hct.TemplateResolver(workdir=''))
+        self.assertEqual(remade_cfg.after, ['namenode', 'zookeeper'])
+        self.assertEqual(remade_cfg.requires, ['resourcemanager'])
+
+    def test_ConfigOpts_ready_check(self):
+        config = StringIO("""
+[Unit]
+Name=testconfig
+RunsOn=master
+
+[Service]
+ExecStart=starter
+ExecStop=stopper
+ReadyCheck=tcp:$masterhostname:8032
+ReadyTimeout=60
+
+[Environment]
+""")
+        resolver = hct.TemplateResolver(workdir='', masterhostname='node1')
+        cfg = hcc.ConfigOpts.from_file(config, resolver)
+        self.assertEqual(cfg.ready_check, 'tcp:node1:8032')
+        self.assertEqual(cfg.ready_timeout, 60)
+        params = cfg.to_params('workdir', 'modulepaths', 'modules', [])
+        remade_cfg = hcc.ConfigOpts.from_params(params, resolver)
+        self.assertEqual(remade_cfg.ready_check, 'tcp:node1:8032')
+        self.assertEqual(remade_cfg.ready_timeout, 60)
+
+    def test_ConfigOpts_no_ready_check(self):
+        config = StringIO("""
+[Unit]
+Name=testconfig
+RunsOn=master
+
+[Service]
+ExecStart=starter
+ExecStop=stopper
+
+[Environment]
+""")
+        cfg = hcc.ConfigOpts.from_file(config, hct.TemplateResolver(workdir=''))
+        self.assertEqual(cfg.ready_check, None)
+
+    def test_ConfigOpts_invalid_ready_check(self):
+        config = StringIO("""
+[Unit]
+Name=testconfig
+RunsOn=master
+
+[Service]
+ExecStart=starter
+ExecStop=stopper
+ReadyCheck=port:8032
+
+[Environment]
+""")
+        self.assertRaises(ValueError, hcc.ConfigOpts.from_file, config, hct.TemplateResolver(workdir=''))
+
+    def test_ConfigOpts_templated_ready_check(self):
+        '''Ready checks are only fully validated once the templates are resolved.'''
+        config = StringIO("""
+[Unit]
+Name=testconfig
+RunsOn=master
+
+[Service]
+ExecStart=starter
+ExecStop=stopper
+ReadyCheck=tcp:$masterhostname:$port
+
+[Environment]
+""")
+        resolver = hct.TemplateResolver(workdir='', masterhostname='node1', port='8032')
+        cfg = hcc.ConfigOpts.from_file(config, resolver)
+        self.assertEqual(cfg.ready_check, 'tcp:node1:8032')
+
+    def test_ConfigOpts_no_after_requires(self):
+        config = StringIO("""
+[Unit]
+Name=testconfig
+RunsOn=all
+
+[Service]
+ExecStart=starter
+ExecStop=stopper
+
+[Environment]
+""")
+        cfg = hcc.ConfigOpts.from_file(config, hct.TemplateResolver(workdir=''))
+        self.assertEqual(cfg.after, [])
+        self.assertEqual(cfg.requires, [])
+
     def test_ConfigOpts_runs_on_SLAVE(self):
         config = StringIO("""
 [Unit]
@@ -398,12 +510,12 @@ SOME_ENV=123""")
 
 
     def test_resolve_dist_path(self):
-        with patch('hod.config.config.resource_filename', side_effect=lambda pks, *args: os.path.join('/path/to/python/pkgs/', *args)):
+        with patch('hod.config.config.resolve_dists_dir', return_value='/path/to/python/pkgs/etc/hod'):
             self.assertEqual(hcc.resolve_dist_path('Program-1.2.3'), '/path/to/python/pkgs/etc/hod/Program-1.2.3/hod.conf')
 
 
     def test_resolve_config_path(self):
-        with patch('hod.config.config.resource_filename', side_effect=lambda pks, *args: os.path.join('/path/to/python/pkgs/', *args)):
+        with patch('hod.config.config.resolve_dists_dir', return_value='/path/to/python/pkgs/etc/hod'):
             with patch('os.path.exists', return_value=True):
                 self.assertEqual(hcc.resolve_config_paths('', 'Program-1.2.3'), '/path/to/python/pkgs/etc/hod/Program-1.2.3/hod.conf')
                 self.assertEqual(hcc.resolve_config_paths('/path/to/python/pkgs/etc/hod/Program-1.2.3/hod.conf', ''),
@@ -412,3 +524,53 @@ SOME_ENV=123""")
 
     def test_avail_dists(self):
         self.assertEqual(hcc.avail_dists(), sorted(os.listdir(hcc.resolve_dists_dir())))
+
+    def test_resolve_dists_dir(self):
+        # dists are found next to the hod package in the source tree
+        topdir = os.path.dirname(os.path.dirname(os.path.abspath(hod.__file__)))
+        self.assertEqual(hcc.resolve_dists_dir(), os.path.join(topdir, 'etc', 'hod'))
+
+        tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(tmpdir, 'etc', 'hod'))
+        with patch('os.path.isdir', side_effect=lambda path: path.startswith(tmpdir)):
+            with patch('sys.prefix', tmpdir):
+                self.assertEqual(hcc.resolve_dists_dir(), os.path.join(tmpdir, 'etc', 'hod'))
+        shutil.rmtree(tmpdir)
+
+    def test_write_service_configs(self):
+        calls = []
+        def writer(outfile, options, template_resolver):
+            calls.append(basename(outfile))
+            return ''.join(['%s=%s\n' % (k, template_resolver(v)) for k, v in sorted(options.items())])
+        configdir = tempfile.mkdtemp()
+        try:
+            tr = hct.TemplateResolver(workdir='', host='node1')
+            configs = {'a.conf': {'x': '$host'}, 'b.conf': {'y': 'value'}}
+            hcc.write_service_configs(configdir, configs, writer, tr)
+            self.assertEqual(open(os.path.join(configdir, 'a.conf')).read(), 'x=node1\n')
+            self.assertEqual(open(os.path.join(configdir, 'b.conf')).read(), 'y=value\n')
+            # each file is rendered once, and written in place
+            self.assertEqual(calls, ['a.conf', 'b.conf'])
+            self.assertEqual(sorted(os.listdir(configdir)), ['a.conf', 'b.conf'])
+        finally:
+            shutil.rmtree(configdir)
+
+    def test_write_service_config_atomic(self):
+        def writer(outfile, options, template_resolver):
+            yield 'first\n'
+            raise RuntimeError('failed')
+        def bad_writer(outfile, options, template_resolver):
+            return 'unused'
+        bad_writer.chunks = writer
+        configdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(configdir, 'a.conf')
+            with open(path, 'w') as f:
+                f.write('old\n')
+            tr = hct.TemplateResolver(workdir='')
+            self.assertRaises(RuntimeError, hcc.write_service_config, path, {}, bad_writer, tr)
+            # old file is left alone, and nothing else is left behind
+            self.assertEqual(open(path).read(), 'old\n')
+            self.assertEqual(os.listdir(configdir), ['a.conf'])
+        finally:
+            shutil.rmtree(configdir)
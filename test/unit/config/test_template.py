@@ -74,14 +74,14 @@ class TestConfigTemplate(unittest.TestCase):
     def test_localworkdir_no_jobid(self):
         with patch('hod.config.template._current_user', return_value='username'):
             with patch('os.getpid', return_value='123'):
-                with patch('socket.getfqdn', return_value='hostname'):
+                with patch('hod.node.node.discovery.fqdn', return_value='hostname'):
                     with patch('os.getenv', return_value=None):
                         self.assertRaises(RuntimeError, hct.mklocalworkdir, 'workdir')
 
     def test_localworkdir_jobid(self):
         with patch('hod.config.template._current_user', return_value='username'):
             with patch('os.getpid', return_value='123'):
-                with patch('socket.getfqdn', return_value='hostname'):
+                with patch('hod.node.node.discovery.fqdn', return_value='hostname'):
                     with patch('os.getenv', return_value='jobid'):
                         self.assertEqual('workdir/hod/jobid/username.hostname.123', hct.mklocalworkdir('workdir'))
 
@@ -91,3 +91,67 @@ class TestConfigTemplate(unittest.TestCase):
             tr = hct.TemplateResolver(workdir='someval', greeting='hello')
             self.assertEqual(tr('$workdir $greeting joey joe joe',), 'someval hello joey joe joe')
             self.assertEqual(tr('$BINDIR/wibble'), '/usr/bin/wibble')
+
+    def test_TemplateResolver_from_registry(self):
+        reg = hct.TemplateRegistry()
+        hostaddress = Mock(return_value='10.0.0.1')
+        unused = Mock(return_value='unused')
+        reg.register(hct.ConfigTemplate('workdir', 'someval', 'Work directory'))
+        reg.register(hct.ConfigTemplate('hostaddress', hostaddress, 'Address'))
+        reg.register(hct.ConfigTemplate('unused', unused, 'Not used'))
+        with patch('hod.config.template.os.environ', dict(BINDIR='/usr/bin', workdir='env-wins')):
+            tr = hct.TemplateResolver.from_registry(reg)
+            self.assertEqual(tr.workdir, 'someval')
+            self.assertEqual(tr('$hostaddress:8020 $BINDIR'), '10.0.0.1:8020 /usr/bin')
+            self.assertEqual(tr('${hostaddress}:50070 $$BINDIR'), '10.0.0.1:50070 $BINDIR')
+            self.assertEqual(tr('$workdir'), 'env-wins')
+            self.assertEqual(tr('no placeholders'), 'no placeholders')
+            self.assertEqual(tr(1024), 1024)
+            self.assertRaises(KeyError, tr, '$unknown')
+        # fields are only evaluated when used, and only once
+        self.assertEqual(hostaddress.call_count, 1)
+        self.assertFalse(unused.called)
+
+    def test_TemplateResolver_from_registry_pickles(self):
+        reg = hct.TemplateRegistry()
+        reg.register(hct.ConfigTemplate('workdir', 'someval', 'Work directory'))
+        reg.register(hct.ConfigTemplate('greeting', lambda: 'hello', 'Greeting'))
+        with patch('hod.config.template.os.environ', dict()):
+            tr = loads(dumps(hct.TemplateResolver.from_registry(reg)))
+            self.assertEqual(tr('$greeting $workdir'), 'hello someval')
+
+    def test_numactl_command(self):
+        numa = [dict(id=0, cpus=[0, 1, 2, 3], memtotal=1024**3),
+                dict(id=1, cpus=[4, 5, 6, 7], memtotal=1024**3)]
+        cgroup = dict(memory=None, cpus=None, cpuset=None, mems=None)
+        with patch('hod.node.node.discovery.numa', return_value=numa):
+            with patch('hod.node.node.discovery.cgroup', return_value=cgroup):
+                with patch('hod.config.template.find_executable', return_value='/usr/bin/numactl'):
+                    with patch('hod.node.node.discovery.usable_cores', return_value=[4, 5]):
+                        self.assertEqual(hct.numactl_command(), '/usr/bin/numactl --cpunodebind=1 --membind=1')
+                    # no need to bind if all NUMA nodes are used
+                    with patch('hod.node.node.discovery.usable_cores', return_value=range(8)):
+                        self.assertEqual(hct.numactl_command(), '')
+                with patch('hod.config.template.find_executable', return_value=None):
+                    with patch('hod.node.node.discovery.usable_cores', return_value=[4, 5]):
+                        self.assertEqual(hct.numactl_command(), '')
+
+    def test_mklocalscratch(self):
+        with patch('hod.config.template.mklocalworkdir', side_effect=lambda base: '%s/hod/123/user.host.1' % base):
+            with patch.dict(hct._LOCAL_SCRATCH, clear=True):
+                with patch('hod.config.template.is_shared_filesystem', return_value=True):
+                    self.assertEqual(hct.resolved_localscratch('/user/scratch'), None)
+                    with patch('hod.config.template.local_scratch', return_value='/local'):
+                        self.assertEqual(hct.mklocalscratch('/user/scratch'), '/local/hod/123/user.host.1')
+                    self.assertEqual(hct.resolved_localscratch('/user/scratch'), '/local/hod/123/user.host.1')
+                    # fall back to the localworkdir
+                    with patch('hod.config.template.local_scratch', return_value=None):
+                        self.assertEqual(hct.mklocalscratch('/user/home'), '/user/home/hod/123/user.host.1')
+                    self.assertEqual(hct.resolved_localscratch('/user/home'), None)
+
+                # no need for node local scratch if the workdir is local
+                with patch('hod.config.template.is_shared_filesystem', return_value=False):
+                    with patch('hod.config.template.local_scratch') as local_scratch:
+                        self.assertEqual(hct.mklocalscratch('/tmp'), '/tmp/hod/123/user.host.1')
+                    self.assertEqual(local_scratch.call_count, 0)
+                    self.assertEqual(hct.resolved_localscratch('/tmp'), None)
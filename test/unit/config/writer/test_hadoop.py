@@ -99,3 +99,16 @@ yarn.option.nested 123
         output = hcw.hadoop_xml('spark-defaults.conf', vals, tr)
         self.assertEqual(output, expected)
 
+    def test_hadoop_xml_escape(self):
+        tr = hct.TemplateResolver(somename="potato", workdir='')
+        vals = {"some.option": "a<b & $somename>c", "some.number": 42}
+        output = hcw.hadoop_xml('file.xml', vals, tr)
+        self.assertTrue('<value>a&lt;b &amp; potato&gt;c</value>' in output)
+        self.assertTrue('<value>42</value>' in output)
+
+    def test_hadoop_xml_chunks(self):
+        tr = hct.TemplateResolver(somename="potato", workdir='')
+        vals = {"fs.defaultFs": "file:///", "templated.value": "$somename"}
+        chunks = list(hcw.hadoop_xml.chunks('file.xml', vals, tr))
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(''.join(chunks), hcw.hadoop_xml('file.xml', vals, tr))
@@ -26,9 +26,13 @@
 '''
 
 from StringIO import StringIO
-from mock import patch
+from mock import patch, Mock
 import copy
+import json
+import os
+import shutil
 import socket
+import tempfile
 import unittest
 import hod.node.node as hn
 
@@ -205,3 +209,151 @@ class HodNodeTestCase(unittest.TestCase):
         self.assertTrue(isinstance(memory, dict))
         self.assertTrue('meminfo' in memory)
         self.assertTrue('ulimit' in memory)
+
+    def test_discovery_cache(self):
+        '''test discovered values are cached until invalidated'''
+        cache = hn.DiscoveryCache()
+        discover = Mock(side_effect=['first', 'second'])
+        self.assertEqual(cache.get('key', discover), 'first')
+        self.assertEqual(cache.get('key', discover), 'first')
+        self.assertEqual(discover.call_count, 1)
+        cache.invalidate('key')
+        self.assertEqual(cache.get('key', discover), 'second')
+
+    def test_discovery_cache_networks(self):
+        '''test networks are only discovered once, and can be sorted by the caller'''
+        nw = [hn.NetworkInterface('wibble01.wibble.os', '10.1.1.2', 'em1', 16),
+              hn.NetworkInterface('localhost', '127.0.0.1', 'lo', 8)]
+        cache = hn.DiscoveryCache()
+        with patch('hod.node.node.get_networks', return_value=nw) as get_networks:
+            hn.sorted_network(cache.networks())
+            self.assertEqual(cache.networks(), nw)
+        self.assertEqual(get_networks.call_count, 1)
+
+    def test_discovery_cache_file(self):
+        '''test discovered values are shared through the cache file'''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'discovery.json')
+            nw = [hn.NetworkInterface('localhost', '127.0.0.1', 'lo', 8)]
+            with patch('hod.node.node.get_networks', return_value=nw):
+                with patch('socket.getfqdn', return_value='wibble01.wibble.os'):
+                    cache = hn.DiscoveryCache(path)
+                    cache.networks()
+                    cache.fqdn()
+            self.assertTrue(os.path.exists(path))
+
+            cache = hn.DiscoveryCache(path)
+            with patch('hod.node.node.get_networks', side_effect=RuntimeError):
+                self.assertEqual(cache.networks(), nw)
+                self.assertTrue(isinstance(cache.networks()[0].hostname, str))
+                self.assertEqual(cache.fqdn(), 'wibble01.wibble.os')
+
+            cache.invalidate()
+            cache = hn.DiscoveryCache(path)
+            with patch('socket.getfqdn', return_value='wibble02.wibble.os'):
+                self.assertEqual(cache.fqdn(), 'wibble02.wibble.os')
+
+            # values which depend on the process are never shared
+            with patch('hod.node.node.get_usable_cores', return_value=[0, 1]):
+                with patch('hod.node.node._get_memory_ulimit_v', return_value=1024):
+                    self.assertEqual(cache.usable_cores(), [0, 1])
+                    self.assertEqual(cache.memory()['ulimit'], 1024)
+            stored = json.load(open(path))
+            self.assertTrue('meminfo' in stored)
+            for key in ['usablecores', 'ulimit', 'cgroup']:
+                self.assertFalse(key in stored)
+            cache = hn.DiscoveryCache(path)
+            with patch('hod.node.node.get_usable_cores', return_value=[2, 3]):
+                with patch('hod.node.node._get_memory_ulimit_v', return_value='unlimited'):
+                    self.assertEqual(cache.usable_cores(), [2, 3])
+                    self.assertEqual(cache.memory()['ulimit'], 'unlimited')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_parse_cpulist(self):
+        '''test parsing of kernel cpu lists'''
+        self.assertEqual(hn.parse_cpulist('0-3,8,10-11\n'), [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(hn.parse_cpulist('5'), [5])
+        self.assertEqual(hn.parse_cpulist(''), [])
+
+    def _write(self, path, txt):
+        '''Write txt to path, creating the parent directories.'''
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fh:
+            fh.write(txt)
+
+    def test_get_cgroup_limits_v1(self):
+        '''test collecting cgroup v1 limits'''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            proc_cgroup = os.path.join(tmpdir, 'cgroup')
+            self._write(proc_cgroup, '4:memory:/torque/123.master\n3:cpuset:/torque/123.master\n'
+                                     '2:cpu,cpuacct:/torque/123.master\n')
+            root = os.path.join(tmpdir, 'sys')
+            self._write(os.path.join(root, 'memory', 'memory.limit_in_bytes'), '9223372036854771712\n')
+            self._write(os.path.join(root, 'memory', 'torque', 'memory.limit_in_bytes'), '17179869184\n')
+            self._write(os.path.join(root, 'memory', 'torque', '123.master', 'memory.limit_in_bytes'),
+                        '34359738368\n')
+            self._write(os.path.join(root, 'cpuset', 'torque', '123.master', 'cpuset.cpus'), '0-3,8\n')
+            self._write(os.path.join(root, 'cpuset', 'torque', '123.master', 'cpuset.mems'), '0\n')
+            self._write(os.path.join(root, 'cpu', 'torque', '123.master', 'cpu.cfs_quota_us'), '-1\n')
+            self._write(os.path.join(root, 'cpu', 'torque', '123.master', 'cpu.cfs_period_us'), '100000\n')
+            limits = hn.get_cgroup_limits(proc_cgroup, root)
+            # the limit of the parent cgroup applies
+            self.assertEqual(limits['memory'], 17179869184)
+            self.assertEqual(limits['cpus'], None)
+            self.assertEqual(limits['cpuset'], [0, 1, 2, 3, 8])
+            self.assertEqual(limits['mems'], [0])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_get_cgroup_limits_v2(self):
+        '''test collecting cgroup v2 limits'''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            proc_cgroup = os.path.join(tmpdir, 'cgroup')
+            self._write(proc_cgroup, '0::/slurm/job_123\n')
+            root = os.path.join(tmpdir, 'sys')
+            jobdir = os.path.join(root, 'slurm', 'job_123')
+            self._write(os.path.join(jobdir, 'memory.max'), '8589934592\n')
+            self._write(os.path.join(jobdir, 'cpu.max'), '250000 100000\n')
+            self._write(os.path.join(jobdir, 'cpuset.cpus.effective'), '0-3\n')
+            self._write(os.path.join(jobdir, 'cpuset.mems.effective'), '0-1\n')
+            self._write(os.path.join(root, 'slurm', 'memory.max'), 'max\n')
+            limits = hn.get_cgroup_limits(proc_cgroup, root)
+            self.assertEqual(limits, dict(memory=8589934592, cpus=2.5, cpuset=[0, 1, 2, 3], mems=[0, 1]))
+
+            # no limits at all
+            self.assertEqual(hn.get_cgroup_limits(os.path.join(tmpdir, 'nosuchfile'), root),
+                             dict(memory=None, cpus=None, cpuset=None, mems=None))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_get_numa_nodes(self):
+        '''test collecting the NUMA topology'''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for idx, cpus in enumerate(['0-3', '4-7']):
+                self._write(os.path.join(tmpdir, 'node%d' % idx, 'cpulist'), cpus + '\n')
+                self._write(os.path.join(tmpdir, 'node%d' % idx, 'meminfo'),
+                            'Node %d MemTotal:       33554432 kB\nNode %d MemFree: 1024 kB\n' % (idx, idx))
+            os.mkdir(os.path.join(tmpdir, 'power'))
+            numa = hn.get_numa_nodes(tmpdir)
+            self.assertEqual(numa, [
+                dict(id=0, cpus=[0, 1, 2, 3], memtotal=32 * 1024**3),
+                dict(id=1, cpus=[4, 5, 6, 7], memtotal=32 * 1024**3),
+            ])
+            self.assertEqual(hn.get_numa_nodes(os.path.join(tmpdir, 'nosuchdir')), [])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_get_pbs_ppn(self):
+        '''test number of processors per node allocated by PBS'''
+        with patch.dict(os.environ, dict(PBS_NUM_PPN='4', PBS_NP='16', PBS_NUM_NODES='2')):
+            self.assertEqual(hn.get_pbs_ppn(), 4)
+        with patch.dict(os.environ, dict(PBS_NUM_PPN='', PBS_NP='16', PBS_NUM_NODES='2')):
+            self.assertEqual(hn.get_pbs_ppn(), 8)
+        with patch.dict(os.environ, dict(PBS_NUM_PPN='', PBS_NP='', PBS_NUM_NODES='2')):
+            self.assertEqual(hn.get_pbs_ppn(), None)
@@ -26,12 +26,16 @@
 '''
 
 import os
+import pwd
 import pytest
+import shutil
+import tempfile
 import unittest
 from mock import patch, Mock
 from collections import namedtuple
 
 from ..util import capture
+from hod.cache import JsonCache
 import hod.rmscheduler.rm_pbs as hrr
 
 
@@ -41,6 +45,12 @@ Attrib = namedtuple('attrib', 'name, value')
 class HodRMSchedulerRMPBSTestCase(unittest.TestCase):
     '''Test Pbs class functions'''
 
+    def setUp(self):
+        hrr._CONNECTIONS.clear()
+
+    def tearDown(self):
+        hrr._CONNECTIONS.clear()
+
     def test_master_hostname(self):
         fake_environ = os.environ.copy()
         fake_environ['PBS_DEFAULT'] = 'master123.test.gent.vsc'
@@ -101,6 +111,105 @@ class HodRMSchedulerRMPBSTestCase(unittest.TestCase):
         self.assertEqual(state[0].state, 'R')
         self.assertEqual(state[0].hosts, 'node1.domain')
 
+    def test_pbs_connection_reused(self):
+        '''test that Pbs instances share the connection to the pbs server'''
+        with patch('pbs.pbs_default', return_value='master.domain'):
+            with patch('pbs.pbs_connect', return_value=3) as pbs_connect:
+                o1 = hrr.Pbs(None)
+                o2 = hrr.Pbs(None)
+        self.assertEqual(pbs_connect.call_count, 1)
+        self.assertEqual(o1.pbsconn, 3)
+        self.assertEqual(o2.pbsconn, 3)
+
+        with patch('pbs.pbs_disconnect') as pbs_disconnect:
+            hrr.close_pbs_connections()
+        pbs_disconnect.assert_called_once_with(3)
+        self.assertEqual(hrr._CONNECTIONS, {})
+
+    def test_pbs_connection_failed(self):
+        '''test that a failed connection to the pbs server is not reused'''
+        with patch('pbs.pbs_connect', return_value=-1):
+            self.assertEqual(hrr.pbs_connection('master.domain'), -1)
+        self.assertEqual(hrr._CONNECTIONS, {})
+
+    def test_pbs_state_selstat(self):
+        '''test Pbs state using jobs of the user selected by the pbs server'''
+        selstat = [Attribs(name='123.master.domain', attribs=[
+                Attrib('Job_Name', 'HOD_job'),
+                Attrib('job_state', 'R'),
+                Attrib('exec_host', 'node1.domain/1'),
+                Attrib('Resource_List', 'nodes=1'),
+            ]),
+            Attribs(name='124.master.domain', attribs=[
+                Attrib('Job_Name', 'other_job'),
+                Attrib('job_state', 'Q'),
+            ]),
+        ]
+        with patch('pbs.pbs_default'):
+            with patch('pbs.pbs_connect'):
+                with patch('pbs.pbs_selstat', return_value=selstat) as pbs_selstat:
+                    with patch('pbs.error', return_value=(0, '')):
+                        with patch('pbs.pbs_statjob') as statjob:
+                            o = hrr.Pbs(None)
+                            info = o.info(None, types=['job_state', 'exec_host'], job_filter={'Job_Name': '^HOD'})
+        self.assertFalse(statjob.called)
+        # the server only selects the jobs of the user named HOD*, and only returns the requested attributes
+        select, jobattr = pbs_selstat.call_args[0][1:3]
+        self.assertEqual([(attr.name, attr.op, attr.value) for attr in select], o._select_criteria({'Job_Name': '^HOD'}))
+        self.assertEqual([attr.name for attr in jobattr], ['job_state', 'exec_host', 'Job_Name'])
+        self.assertEqual(info, [{
+            'id': '123.master.domain',
+            'Job_Name': 'HOD_job',
+            'job_state': 'R',
+            'exec_host': 'node1.domain/1',
+        }])
+
+    def test_pbs_select_criteria(self):
+        '''test the criteria for selecting the jobs of the user on the pbs server'''
+        user = pwd.getpwuid(os.getuid()).pw_name
+        with patch('pbs.pbs_default'):
+            with patch('pbs.pbs_connect'):
+                o = hrr.Pbs(None)
+        self.assertEqual(o._select_criteria({}), [('User_List', hrr.pbs.EQ, user)])
+        self.assertEqual(o._select_criteria({'Job_Name': '^HOD'}), [
+            ('User_List', hrr.pbs.EQ, user),
+            ('Job_Name', hrr.pbs.GE, 'HOD'),
+            ('Job_Name', hrr.pbs.LT, 'HOE'),
+        ])
+        self.assertEqual(o._select_criteria({'Job_Name': '^HOD_job$'}), [
+            ('User_List', hrr.pbs.EQ, user),
+            ('Job_Name', hrr.pbs.EQ, 'HOD_job'),
+        ])
+        # other regular expressions are only applied to the jobs returned by the server
+        self.assertEqual(o._select_criteria({'Job_Name': 'HOD$'}), [('User_List', hrr.pbs.EQ, user)])
+
+    def test_pbs_state_selstat_without_attributes(self):
+        '''test Pbs state with a pbs_selstat which doesn't take the attributes to return'''
+        selstat = [Attribs(name='123.master.domain', attribs=[Attrib('job_state', 'R')])]
+        with patch('pbs.pbs_default'):
+            with patch('pbs.pbs_connect'):
+                with patch('pbs.pbs_selstat', side_effect=[TypeError('takes exactly 3 arguments'), selstat]):
+                    with patch('pbs.error', return_value=(0, '')):
+                        with patch('pbs.pbs_statjob') as statjob:
+                            o = hrr.Pbs(None)
+                            state = o.state()
+        self.assertFalse(statjob.called)
+        self.assertEqual(len(state), 1)
+        self.assertEqual(state[0].state, 'R')
+
+    def test_pbs_state_selstat_failed(self):
+        '''test Pbs state falling back to pbs_statjob'''
+        statjob = [Attribs(name='123.master.domain', attribs=[Attrib('job_state', 'R')])]
+        with patch('pbs.pbs_default'):
+            with patch('pbs.pbs_connect'):
+                with patch('pbs.pbs_selstat', return_value=[]):
+                    with patch('pbs.error', return_value=(15001, 'Unknown Job Id')):
+                        with patch('pbs.pbs_statjob', return_value=statjob):
+                            o = hrr.Pbs(None)
+                            state = o.state()
+        self.assertEqual(len(state), 1)
+        self.assertEqual(state[0].jobid, '123.master.domain')
+
     def test_pbs_info(self):
         '''test Pbs info -- though it doesn't do it yet.'''
         statjob = [Attribs(name='123.master.domain', attribs=[
@@ -167,19 +276,65 @@ class HodRMSchedulerRMPBSTestCase(unittest.TestCase):
 
     def test_pbs_get_ppn_none(self):
         '''test Pbs get_ppn'''
-        o = hrr.Pbs(None)
+        o = hrr.Pbs({})
         nodes = { }
 
-        with patch('PBSQuery.PBSQuery', return_value=Mock(getnodes=lambda: nodes)):
+        with patch('PBSQuery.PBSQuery', return_value=Mock(getnodes=lambda attrs: nodes)):
             self.assertTrue(o.get_ppn() is None)
 
     def test_pbs_get_ppn(self):
         '''test Pbs get_ppn'''
-        o = hrr.Pbs(None)
+        o = hrr.Pbs({})
         nodes = {
             'node1': {'np': ['24'], 'state': ['free']},
             'node2': {'np': ['24'], 'state': ['job-exclusive']}
         }
 
-        with patch('PBSQuery.PBSQuery', return_value=Mock(getnodes=lambda: nodes)):
+        with patch('PBSQuery.PBSQuery', return_value=Mock(getnodes=lambda attrs: nodes)):
             self.assertEqual(24, o.get_ppn())
+
+    def test_pbs_get_ppn_queue_partition(self):
+        '''test Pbs get_ppn for a queue and partition'''
+        nodes = {
+            'node1': {'np': ['24'], 'state': ['free'], 'properties': ['compute']},
+            'node2': {'np': ['24'], 'state': ['free'], 'properties': ['compute']},
+            'node3': {'np': ['24'], 'state': ['down'], 'properties': ['bigmem', 'ib']},
+            'node4': {'np': ['32'], 'state': ['free'], 'properties': ['bigmem', 'ib']},
+        }
+        queues = {
+            'long': {},
+            'bigmem': {'resources_default': {'neednodes': ['bigmem']}},
+        }
+        pq = Mock(getnodes=lambda attrs: nodes, getqueue=lambda name, attrs: queues.get(name))
+
+        with patch('PBSQuery.PBSQuery', return_value=pq):
+            self.assertEqual(24, hrr.Pbs({'queue': 'long'}).get_ppn())
+            self.assertEqual(32, hrr.Pbs({'queue': 'bigmem'}).get_ppn())
+            self.assertEqual(32, hrr.Pbs({'queue': 'long', 'partition': 'ib'}).get_ppn())
+            # no nodes in partition, so all nodes are considered
+            self.assertEqual(24, hrr.Pbs({'partition': 'gpu'}).get_ppn())
+            self.assertEqual([[24, 2], [32, 1]], hrr.Pbs({}).node_shapes())
+
+    def test_pbs_get_ppn_cached(self):
+        '''test Pbs get_ppn using the node shape cache'''
+        nodes = {'node1': {'np': ['24'], 'state': ['free']}}
+        tmpdir = tempfile.mkdtemp()
+        cache = JsonCache(os.path.join(tmpdir, 'nodeshape.json'), 60)
+        with patch('pbs.pbs_default', return_value='master'):
+            with patch('PBSQuery.PBSQuery', return_value=Mock(getnodes=lambda attrs: nodes, getqueue=lambda name, attrs: {})) as pbsquery:
+                o = hrr.Pbs({'queue': 'long'})
+                o.node_shape_cache = cache
+                self.assertEqual(24, o.get_ppn())
+                self.assertEqual(24, o.get_ppn())
+                self.assertEqual(pbsquery.call_count, 1)
+                self.assertEqual(cache.get('master/long/', None), [[24, 1]])
+
+                # no usable nodes found is not cached
+                nodes['node1']['state'] = ['down']
+                o = hrr.Pbs({'queue': 'short'})
+                o.node_shape_cache = cache
+                self.assertEqual(None, o.get_ppn())
+                nodes['node1']['state'] = ['free']
+                self.assertEqual(24, o.get_ppn())
+                self.assertEqual(pbsquery.call_count, 3)
+        shutil.rmtree(tmpdir)
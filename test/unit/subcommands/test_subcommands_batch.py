@@ -28,6 +28,7 @@
 """
 import os
 import shutil
+import stat
 import pytest
 import tempfile
 import unittest
@@ -100,6 +101,32 @@ class TestBatchSubCommand(unittest.TestCase):
                 self.assertEqual(1, app.run(['--hodconf=hod.conf', '--dist=Hadoop-2.3.0',
                                              '--hod-module=hanythingondemand', '--workdir=workdir']))
 
+    def test_run_with_manifest(self):
+        with tmpscript('script.sh'):
+            with open('clusters.ini', 'w') as fh:
+                fh.write("[DEFAULT]\nscript = script.sh\n[sweep1]\nnodes = 2\n[sweep2]\nscript = nosuchscript.sh\n")
+            with patch('hod.rmscheduler.hodjob.PbsHodJob') as pbshodjob:
+                with patch('hod.rmscheduler.hodjob.load_hod_config'):
+                    with patch('hod.cluster.known_cluster_labels', return_value=[]):
+                        with patch('hod.cluster.validate_hodconf_or_dist', return_value=True):
+                            with patch('hod.cluster.post_jobs_submission'):
+                                app = BatchSubCommand()
+                                args = ['--dist=Hadoop-2.3.0', '--workdir=workdir', '--hod-module=hanythingondemand',
+                                        '--manifest=clusters.ini']
+                                # script for second cluster doesn't exist
+                                with patch('sys.stderr'):
+                                    self.assertRaises(SystemExit, app.run, args)
+                                self.assertEqual(pbshodjob.call_count, 0)
+
+                                with open('clusters.ini', 'w') as fh:
+                                    fh.write("[DEFAULT]\nscript = script.sh\n[sweep1]\nnodes = 2\n[sweep2]\n")
+                                self.assertEqual(app.run(args), 0)
+                                self.assertEqual(pbshodjob.call_count, 2)
+                                script = os.path.abspath('script.sh')
+                                self.assertTrue(os.stat(script).st_mode & stat.S_IXUSR)
+            optparsers = [args[0] for args, _ in pbshodjob.call_args_list]
+            self.assertEqual([o.options.script for o in optparsers], [script, script])
+
     def test_usage(self):
         app = BatchSubCommand()
         usage = app.usage()
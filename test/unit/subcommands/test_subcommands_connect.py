@@ -79,6 +79,27 @@ class TestCreateSubCommand(EnhancedTestCase):
                     app = hsc.ConnectSubCommand()
                     self.assertErrorRegex(SystemExit, '1', app.run, ['connect', 'h123'])
 
+    def test_run_with_outdated_job_state(self):
+        queued = [rm_pbs.PbsJob('1234', 'Q', '')]
+        running = [rm_pbs.PbsJob('1234', 'R', 'node1')]
+        with patch('hod.subcommands.connect.cluster_jobid', return_value='1234'):
+            with patch('hod.subcommands.connect.cluster_env_file', return_value='/path/env'):
+                with patch('hod.subcommands.connect.os.execvp') as execvp:
+                    # the job was still queued when its state was cached
+                    with patch('hod.subcommands.connect.pbs_job_states', side_effect=[queued, running]) as job_states:
+                        app = hsc.ConnectSubCommand()
+                        with capture(app.run, ['connect', 'label']):
+                            pass
+                    self.assertEqual(job_states.call_args[1], {'fresh': True})
+                    self.assertEqual(execvp.call_args[0][1][2], 'node1')
+
+                    # jobs which are really queued are refused
+                    with patch('hod.subcommands.connect.pbs_job_states', side_effect=[queued, queued]):
+                        execvp.reset_mock()
+                        app = hsc.ConnectSubCommand()
+                        with capture(self.assertErrorRegex, SystemExit, '1', app.run, ['connect', 'label']):
+                            pass
+                    self.assertFalse(execvp.called)
 
     @pytest.mark.xfail
     def test_run_with_good_jobid_arg(self):
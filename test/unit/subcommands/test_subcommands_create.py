@@ -27,6 +27,9 @@
 @author: Ewan Higgs (Universiteit Gent)
 """
 
+import os
+import shutil
+import tempfile
 import unittest
 import pytest
 
@@ -61,6 +64,66 @@ class TestCreateSubCommand(unittest.TestCase):
                 app = CreateSubCommand()
                 self.assertEqual(app.run(['--hodconf=hod.conf', '--dist=Hadoop-2.3.0', '--workdir=workdir', '--hod-module=hanythingondemand']), 1)
 
+    def test_run_with_manifest(self):
+        tmpdir = tempfile.mkdtemp()
+        manifest = os.path.join(tmpdir, 'clusters.ini')
+        with open(manifest, 'w') as fh:
+            fh.write("[sweep1]\nnodes = 2\n[sweep2]\nnodes = 4\n")
+        with patch('hod.rmscheduler.hodjob.PbsHodJob') as pbshodjob:
+            with patch('hod.rmscheduler.hodjob.load_hod_config') as load_hod_config:
+                with patch('hod.cluster.known_cluster_labels', return_value=[]):
+                    with patch('hod.cluster.validate_hodconf_or_dist', return_value=True):
+                        with patch('hod.cluster.post_jobs_submission') as post_jobs_submission:
+                            app = CreateSubCommand()
+                            self.assertEqual(app.run(['--dist=Hadoop-2.3.0', '--workdir=workdir', '--hod-module=hanythingondemand',
+                                                      '--manifest=%s' % manifest]), 0)
+        # hod.conf is loaded once for all clusters
+        self.assertEqual(load_hod_config.call_count, 1)
+        self.assertEqual(pbshodjob.call_count, 2)
+        optparsers = [args[0] for args, _ in pbshodjob.call_args_list]
+        self.assertEqual([o.options.label for o in optparsers], ['sweep1', 'sweep2'])
+        self.assertEqual([o.options.job_nodes for o in optparsers], [2, 4])
+        self.assertEqual([o.options.manifest for o in optparsers], [None, None])
+        submitted = post_jobs_submission.call_args[0][0]
+        self.assertEqual([(label, workdir) for label, _, workdir in submitted],
+                         [('sweep1', 'workdir'), ('sweep2', 'workdir')])
+
+        # labels must be unique
+        with open(manifest, 'w') as fh:
+            fh.write("[sweep1]\nnodes = 2\n")
+        with patch('hod.rmscheduler.hodjob.PbsHodJob'):
+            with patch('hod.cluster.known_cluster_labels', return_value=['sweep1']):
+                with patch('sys.stderr'):
+                    app = CreateSubCommand()
+                    self.assertRaises(SystemExit, app.run, ['--dist=Hadoop-2.3.0', '--workdir=workdir', '--hod-module=hanythingondemand',
+                                                            '--manifest=%s' % manifest])
+        shutil.rmtree(tmpdir)
+
+    def test_run_with_manifest_failed_submission(self):
+        tmpdir = tempfile.mkdtemp()
+        manifest = os.path.join(tmpdir, 'clusters.ini')
+        with open(manifest, 'w') as fh:
+            fh.write("[sweep1]\nnodes = 2\n[sweep2]\nnodes = 4\n[sweep3]\nnodes = 8\n")
+        with patch('hod.rmscheduler.hodjob.PbsHodJob') as pbshodjob:
+            # submission of the second cluster fails
+            pbshodjob.return_value.run.side_effect = [None, RuntimeError('qsub failed'), None]
+            with patch('hod.rmscheduler.hodjob.load_hod_config'):
+                with patch('hod.cluster.known_cluster_labels', return_value=[]):
+                    with patch('hod.cluster.validate_hodconf_or_dist', return_value=True):
+                        with patch('hod.cluster.post_jobs_submission') as post_jobs_submission:
+                            with patch('sys.stderr'):
+                                app = CreateSubCommand()
+                                app.run(['--dist=Hadoop-2.3.0', '--workdir=workdir', '--hod-module=hanythingondemand',
+                                         '--manifest=%s' % manifest])
+        # all clusters are submitted, and the hod.d/ files of the ones submitted are still written
+        self.assertEqual(pbshodjob.return_value.run.call_count, 3)
+        self.assertEqual(post_jobs_submission.call_count, 1)
+        submitted = post_jobs_submission.call_args[0][0]
+        self.assertEqual([label for label, _, _ in submitted], ['sweep1', 'sweep2', 'sweep3'])
+        self.assertEqual(submitted[1], ('sweep2', None, 'workdir'))
+        self.assertTrue(submitted[0][1] is not None)
+        shutil.rmtree(tmpdir)
+
     def test_usage(self):
         app = CreateSubCommand()
         usage = app.usage()
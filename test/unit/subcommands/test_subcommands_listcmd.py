@@ -35,6 +35,16 @@ from ..util import capture
 import hod.subcommands.listcmd as hsl
 
 class TestListSubCommand(EnhancedTestCase):
+    def setUp(self):
+        super(TestListSubCommand, self).setUp()
+        # keep the job state cache out of the home directory
+        self.cluster_info_dir = patch('hod.cluster.cluster_info_dir', return_value=self.tmpdir)
+        self.cluster_info_dir.start()
+
+    def tearDown(self):
+        self.cluster_info_dir.stop()
+        super(TestListSubCommand, self).tearDown()
+
     def test_run_no_jobs(self):
         with patch('hod.rmscheduler.rm_pbs.Pbs', return_value=Mock(state=lambda: [])):
             with patch('hod.rmscheduler.rm_pbs.master_hostname', return_value='good-host'):
@@ -42,24 +42,27 @@ class TestRelabelSubCommand(EnhancedTestCase):
     def test_run_success(self):
         with patch('hod.cluster.known_cluster_labels', return_value=['abc']):
             with patch('hod.cluster.cluster_info_dir', return_value='/path'):
-                with patch('shutil.move', MagicMock()) as move_fn:
-                    app = hsr.RelabelSubCommand()
-                    app.run(['relabel', 'abc', 'xyz'])
-                    move_fn.assert_called_with('/path/abc', '/path/xyz')
+                with patch('hod.cluster._updated_cluster_index'):
+                    with patch('shutil.move', MagicMock()) as move_fn:
+                        app = hsr.RelabelSubCommand()
+                        app.run(['relabel', 'abc', 'xyz'])
+                        move_fn.assert_called_with('/path/abc', '/path/xyz')
 
     def test_run_oserror(self):
         with patch('hod.cluster.known_cluster_labels', return_value=['abc']):
             with patch('hod.cluster.cluster_info_dir', return_value='/path'):
-                with patch('shutil.move', side_effect=OSError('bad')):
-                    app = hsr.RelabelSubCommand()
-                    self.assertErrorRegex(SystemExit, '1', app.run, ['relabel', 'abc', 'xyz'])
+                with patch('hod.cluster._updated_cluster_index'):
+                    with patch('shutil.move', side_effect=OSError('bad')):
+                        app = hsr.RelabelSubCommand()
+                        self.assertErrorRegex(SystemExit, '1', app.run, ['relabel', 'abc', 'xyz'])
 
     def test_run_ioerror(self):
         with patch('hod.cluster.known_cluster_labels', return_value=['abc']):
             with patch('hod.cluster.cluster_info_dir', return_value='/path'):
-                with patch('shutil.move', side_effect=IOError('bad')):
-                    app = hsr.RelabelSubCommand()
-                    self.assertErrorRegex(SystemExit, '1', app.run, ['relabel', 'abc', 'xyz'])
+                with patch('hod.cluster._updated_cluster_index'):
+                    with patch('shutil.move', side_effect=IOError('bad')):
+                        app = hsr.RelabelSubCommand()
+                        self.assertErrorRegex(SystemExit, '1', app.run, ['relabel', 'abc', 'xyz'])
 
     def test_usage(self):
         app = hsr.RelabelSubCommand()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the 'top' subcommand.
+"""
+import os
+import time
+
+from mock import patch
+
+from vsc.utils.testing import EnhancedTestCase
+
+from ..util import capture
+import hod.monitor as hmon
+import hod.subcommands.top as hst
+
+
+class TestTopSubCommand(EnhancedTestCase):
+    def setUp(self):
+        super(TestTopSubCommand, self).setUp()
+        self.usage_file = os.path.join(self.tmpdir, 'top')
+
+    def run_top(self, args):
+        with patch('hod.cluster.known_cluster_labels', return_value=['mylabel']):
+            with patch('hod.cluster.cluster_usage_file', return_value=self.usage_file):
+                app = hst.TopSubCommand()
+                return app.run(['top'] + args)
+
+    def test_run_no_label(self):
+        app = hst.TopSubCommand()
+        self.assertErrorRegex(SystemExit, '1', app.run, ['top'])
+
+    def test_run_unknown_label(self):
+        self.assertErrorRegex(SystemExit, '1', self.run_top, ['nosuchlabel'])
+
+    def test_run_no_usage(self):
+        self.assertErrorRegex(SystemExit, '1', self.run_top, ['mylabel'])
+
+    def test_run(self):
+        usage = hmon.ClusterUsage(self.usage_file)
+        usage.update({'rank': 0, 'host': 'node1', 'time': time.time(), 'interval': 10.0,
+                      'services': {'datanode': [1, 5.0, 1024, 0, 0]}, 'net': [0, 0]})
+        usage.write()
+        with capture(self.run_top, ['mylabel']) as (out, err):
+            self.assertTrue(out.startswith("Resource usage of HOD cluster 'mylabel' at "))
+            self.assertTrue('node1' in out)
+            self.assertTrue('datanode' in out)
+            self.assertTrue('50%' in out)
+
+    def test_usage(self):
+        app = hst.TopSubCommand()
+        usage = app.usage()
+        self.assertTrue(isinstance(usage, basestring))
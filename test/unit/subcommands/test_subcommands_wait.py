@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the 'wait' subcommand.
+"""
+import os
+import threading
+
+from mock import patch, Mock
+
+from vsc.utils.testing import EnhancedTestCase
+
+from ..util import capture
+import hod.rmscheduler.rm_pbs as rm_pbs
+import hod.subcommands.wait as hsw
+
+
+def mock_pbs(*states):
+    """Return mocked Pbs class, for which state() returns the specified states for job 123 in turn."""
+    jobs = [[rm_pbs.PbsJob('123', state, 'host1')] if state else [] for state in states]
+    return Mock(return_value=Mock(state=Mock(side_effect=jobs)))
+
+
+class TestWaitSubCommand(EnhancedTestCase):
+    def setUp(self):
+        super(TestWaitSubCommand, self).setUp()
+        self.ready_file = os.path.join(self.tmpdir, 'ready')
+
+    def run_wait(self, args, pbs):
+        with patch('hod.cluster.cluster_jobid', return_value='123'):
+            with patch('hod.cluster.cluster_ready_file', return_value=self.ready_file):
+                with patch('hod.rmscheduler.rm_pbs.Pbs', pbs):
+                    with patch('time.sleep'):
+                        app = hsw.WaitSubCommand()
+                        return app.run(['wait'] + args)
+
+    def test_backoff(self):
+        intervals = hsw.backoff(1, 10)
+        self.assertEqual([next(intervals) for _ in range(6)], [1, 2, 4, 8, 10, 10])
+
+    def test_run_no_label(self):
+        app = hsw.WaitSubCommand()
+        self.assertErrorRegex(SystemExit, '1', app.run, ['wait'])
+
+    def test_run_unknown_label(self):
+        with patch('hod.cluster.known_cluster_labels', return_value=[]):
+            app = hsw.WaitSubCommand()
+            self.assertErrorRegex(SystemExit, '1', app.run, ['wait', 'nosuchlabel'])
+
+    def test_run_ready(self):
+        open(self.ready_file, 'w').close()
+        pbs = mock_pbs('Q', 'Q', 'R')
+        with capture(self.run_wait, ['mylabel'], pbs) as (out, err):
+            self.assertTrue(out.endswith("HOD cluster 'mylabel' is ready.\n"))
+        self.assertEqual(pbs.return_value.state.call_count, 3)
+
+    def test_run_wait_for_ready_file(self):
+        timer = threading.Timer(0.1, lambda: open(self.ready_file, 'w').close())
+        timer.start()
+        with capture(self.run_wait, ['mylabel', '--timeout=10'], mock_pbs('R', 'R', 'R')) as (out, err):
+            self.assertTrue(out.endswith("HOD cluster 'mylabel' is ready.\n"))
+        timer.join()
+
+    def test_run_ready_file_not_seen_by_inotify(self):
+        '''The ready file is noticed soon, also if it is written on another node (e.g. on NFS).'''
+        timeouts = []
+        def wait(timeout):
+            timeouts.append(timeout)
+            open(self.ready_file, 'w').close()
+            return False
+        pbs = mock_pbs('R', 'R')
+        with patch('hod.subcommands.wait.DirWatcher', return_value=Mock(wait=wait)):
+            with capture(self.run_wait, ['mylabel', '--max-interval=60'], pbs) as (out, err):
+                self.assertTrue(out.endswith("HOD cluster 'mylabel' is ready.\n"))
+        self.assertEqual(len(timeouts), 1)
+        self.assertTrue(timeouts[0] <= hsw.READY_POLL_INTERVAL)
+        # job state is only checked once by wait_for_job
+        self.assertEqual(pbs.return_value.state.call_count, 1)
+
+    def test_run_job_gone(self):
+        self.assertErrorRegex(SystemExit, '1', self.run_wait, ['mylabel'], mock_pbs('Q', None))
+        self.assertErrorRegex(SystemExit, '1', self.run_wait, ['mylabel'], mock_pbs('C'))
+
+    def test_run_timeout(self):
+        pbs = Mock(return_value=Mock(state=Mock(return_value=[rm_pbs.PbsJob('123', 'R', 'host1')])))
+        self.assertErrorRegex(SystemExit, '1', self.run_wait, ['mylabel', '--timeout=0.2'], pbs)
+
+    def test_usage(self):
+        app = hsw.WaitSubCommand()
+        usage = app.usage()
+        self.assertTrue(isinstance(usage, basestring))
@@ -0,0 +1,136 @@
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+# #
+"""
+Tests for the JSON file cache.
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import patch
+
+from hod.cache import JsonCache
+
+
+class TestJsonCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache.json')
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def obtain(self):
+        self.calls.append(None)
+        return ['value', len(self.calls)]
+
+    def age_entry(self, key, age):
+        '''Pretend the cached value for key was stored age seconds ago.'''
+        with open(self.path) as fh:
+            entries = json.load(fh)
+        entries[key]['time'] -= age
+        with open(self.path, 'w') as fh:
+            json.dump(entries, fh)
+
+    def test_get(self):
+        cache = JsonCache(self.path, 10)
+        self.assertEqual(cache.get('key', self.obtain), ['value', 1])
+        self.assertEqual(cache.get('key', self.obtain), ['value', 1])
+        # other instances use the same file
+        self.assertEqual(JsonCache(self.path, 10).get('key', self.obtain), ['value', 1])
+        self.assertEqual(len(self.calls), 1)
+
+        self.assertEqual(cache.get('other', self.obtain), ['value', 2])
+        self.assertEqual(len(self.calls), 2)
+
+    def test_get_expired(self):
+        cache = JsonCache(self.path, 10)
+        cache.get('key', self.obtain)
+        self.age_entry('key', 11)
+        self.assertEqual(cache.get('key', self.obtain), ['value', 2])
+
+    def test_get_stale(self):
+        cache = JsonCache(self.path, 10, max_stale=20)
+        cache.get('key', self.obtain)
+        self.age_entry('key', 15)
+        with patch('hod.cache.JsonCache._revalidate') as revalidate:
+            self.assertEqual(cache.get('key', self.obtain), ['value', 1])
+        revalidate.assert_called_once_with('key', self.obtain, keep=None)
+
+        self.age_entry('key', 20)
+        with patch('hod.cache.JsonCache._revalidate') as revalidate:
+            self.assertEqual(cache.get('key', self.obtain), ['value', 2])
+        self.assertFalse(revalidate.called)
+
+    def test_get_keep(self):
+        cache = JsonCache(self.path, 10)
+        values = [[], ['value']]
+        # values which should not be kept are obtained again every time
+        self.assertEqual(cache.get('key', lambda: values.pop(0), keep=bool), [])
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(cache.get('key', lambda: values.pop(0), keep=bool), ['value'])
+        self.assertEqual(cache.get('key', self.obtain, keep=bool), ['value'])
+        self.assertEqual(len(self.calls), 0)
+
+    def test_revalidate(self):
+        cache = JsonCache(self.path, 10, max_stale=20)
+        cache.set('key', 'old')
+        self.age_entry('key', 15)
+        self.assertEqual(cache.get('key', lambda: 'new'), 'old')
+
+        # value is updated by a background process
+        timeout = time.time() + 5
+        while time.time() < timeout and cache.get('key', lambda: 'oops') != 'new':
+            time.sleep(0.01)
+        self.assertEqual(cache.get('key', lambda: 'oops'), 'new')
+
+    def test_missing_dir(self):
+        path = os.path.join(self.tmpdir, 'sub', 'cache.json')
+        cache = JsonCache(path, 10)
+        self.assertEqual(cache.get('key', self.obtain), ['value', 1])
+        self.assertTrue(os.path.exists(path))
+
+    def test_corrupt(self):
+        with open(self.path, 'w') as fh:
+            fh.write('{')
+        cache = JsonCache(self.path, 10)
+        self.assertEqual(cache.get('key', self.obtain), ['value', 1])
+
+    def test_invalidate(self):
+        cache = JsonCache(self.path, 10)
+        cache.get('key', self.obtain)
+        cache.get('other', self.obtain)
+        cache.invalidate('key')
+        self.assertEqual(cache.get('key', self.obtain), ['value', 3])
+        self.assertEqual(cache.get('other', self.obtain), ['value', 2])
+
+        cache.invalidate()
+        self.assertFalse(os.path.exists(self.path))
+        cache.invalidate()
+        self.assertEqual(cache.get('other', self.obtain), ['value', 4])
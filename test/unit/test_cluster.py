@@ -28,7 +28,9 @@
 """
 
 import os
+import shutil
 import unittest
+import time
 import tempfile
 from mock import patch, Mock
 from contextlib import contextmanager
@@ -67,28 +69,90 @@ class TestCluster(unittest.TestCase):
         self.assertFalse(hc.validate_label('/mybatch-job', ['mybatch-job']))
         self.assertFalse(hc.validate_label('/mybatch-job', ['/mybatch-job']))
 
+    def test_cluster_manifest_args(self):
+        tmpdir = tempfile.mkdtemp()
+        manifest = os.path.join(tmpdir, 'clusters.ini')
+        with open(manifest, 'w') as fh:
+            fh.write("[DEFAULT]\nwalltime = 2\n[sweep1]\nnodes = 2\n[sweep2]\nnodes = 4\nworkdir = /tmp\n")
+        clusters = hc.cluster_manifest_args(manifest)
+        self.assertEqual([label for label, _ in clusters], ['sweep1', 'sweep2'])
+        self.assertEqual(sorted(clusters[0][1]), ['--job-nodes=2', '--job-walltime=2', '--label=sweep1'])
+        self.assertEqual(sorted(clusters[1][1]), ['--job-nodes=4', '--job-walltime=2', '--label=sweep2',
+                                                  '--workdir=/tmp'])
+
+        # options which are not allowed
+        self.assertRaises(ValueError, hc.cluster_manifest_args, manifest, {'nodes': 'job-nodes'})
+
+        with open(manifest, 'w') as fh:
+            fh.write("nodes = 2\n")
+        self.assertRaises(ValueError, hc.cluster_manifest_args, manifest)
+        with open(manifest, 'w') as fh:
+            fh.write("")
+        self.assertRaises(ValueError, hc.cluster_manifest_args, manifest)
+        self.assertRaises(ValueError, hc.cluster_manifest_args, os.path.join(tmpdir, 'nosuchfile'))
+        shutil.rmtree(tmpdir)
+
     def test_cluster_info_dir(self):
         with patch('os.getenv', lambda x, *args: dict(HOME='/home/myname', XDG_CONFIG_HOME='/home/myname/.config')[x]):
             self.assertEqual('/home/myname/.config/hod.d', hc.cluster_info_dir())
 
     def test_known_cluster_labels(self):
-        with patch('hod.cluster.cluster_info_dir', return_value='/'):
-            with patch('os.path.exists', return_value=True):
-                with patch('os.listdir', return_value=['a']):
-                    with patch('os.path.isdir', return_value=True):
-                        self.assertEqual(['a'], hc.known_cluster_labels())
+        tmpdir = tempfile.mkdtemp()
+        with patch('hod.cluster.cluster_info_dir', return_value=tmpdir):
+            self.assertEqual([], hc.known_cluster_labels())
 
-        with patch('hod.cluster.cluster_info_dir', return_value='/'):
-            with patch('os.path.exists', return_value=True):
-                with patch('os.listdir', return_value=['notadir']):
-                    with patch('os.path.isdir', return_value=False):
-                        self.assertEqual([], hc.known_cluster_labels())
+            open(os.path.join(tmpdir, 'notadir'), 'w').close()
+            self.assertEqual([], hc.known_cluster_labels())
 
+            testdir = os.path.join(tmpdir, 'test123')
+            os.mkdir(testdir)
+            self.assertEqual(['test123'], hc.known_cluster_labels())
+        shutil.rmtree(tmpdir)
+
+    def test_cluster_index(self):
         tmpdir = tempfile.mkdtemp()
-        testdir = os.path.join(tmpdir, 'test123')
-        os.mkdir(testdir)
         with patch('hod.cluster.cluster_info_dir', return_value=tmpdir):
-            self.assertEqual(['test123'], hc.known_cluster_labels())
+            hc.mk_cluster_info('banana', '123.master', '$HOME/hod')
+            hc.mk_cluster_info(None, '124.master', '/tmp')
+            self.assertTrue(os.path.exists(os.path.join(tmpdir, hc.CLUSTER_INDEX_FILE)))
+            self.assertEqual(['124.master', 'banana'], hc.known_cluster_labels())
+
+            # lookups use the index rather than the files in the cluster info directory
+            os.remove(os.path.join(tmpdir, 'banana', 'jobid'))
+            self.assertEqual('123.master', hc.cluster_jobid('banana'))
+            self.assertEqual(os.path.expandvars('$HOME/hod'), hc.cluster_workdir('banana'))
+
+            hc.mv_cluster_info('banana', 'apple')
+            self.assertEqual(['124.master', 'apple'], hc.known_cluster_labels())
+            self.assertEqual('123.master', hc.cluster_jobid('apple'))
+
+            with capture(hc.rm_cluster_info, '124.master'):
+                pass
+            self.assertEqual(['apple'], hc.known_cluster_labels())
+        shutil.rmtree(tmpdir)
+
+    def test_cluster_index_migration(self):
+        tmpdir = tempfile.mkdtemp()
+        for label, jobid in [('banana', '123.master'), ('apple', '124.master')]:
+            os.mkdir(os.path.join(tmpdir, label))
+            with open(os.path.join(tmpdir, label, 'jobid'), 'w') as jobid_file:
+                jobid_file.write(jobid)
+
+        with patch('hod.cluster.cluster_info_dir', return_value=tmpdir):
+            # index is created from the existing cluster info directories
+            self.assertEqual(['apple', 'banana'], hc.known_cluster_labels())
+            self.assertEqual('124.master', hc.cluster_jobid('apple'))
+            self.assertTrue(os.path.exists(os.path.join(tmpdir, hc.CLUSTER_INDEX_FILE)))
+
+            # cluster info directories created without updating the index are picked up
+            os.mkdir(os.path.join(tmpdir, 'cherry'))
+            self.assertEqual(['apple', 'banana', 'cherry'], hc.known_cluster_labels())
+
+            # corrupt index is rebuilt
+            with open(os.path.join(tmpdir, hc.CLUSTER_INDEX_FILE), 'w') as index_file:
+                index_file.write('{')
+            self.assertEqual(['apple', 'banana', 'cherry'], hc.known_cluster_labels())
+        shutil.rmtree(tmpdir)
 
     def test_known_cluster_labels_not_found(self):
         with patch('hod.cluster.cluster_info_dir', return_value='/'):
@@ -113,6 +177,39 @@ class TestCluster(unittest.TestCase):
                 with patch('os.path.exists', return_value=False):
                     self.assertRaises(ValueError, hc._cluster_info, '1234', 'jobid')
 
+    def test_pbs_job_states(self):
+        tmpdir = tempfile.mkdtemp()
+        jobs = [PbsJob('123', 'R', 'host1'), PbsJob('abc', 'Q', '')]
+        pbs = Mock(state=Mock(return_value=jobs))
+        with patch('hod.cluster.cluster_info_dir', return_value=tmpdir):
+            with patch('hod.rmscheduler.rm_pbs.master_hostname', return_value='master'):
+                with patch('hod.rmscheduler.rm_pbs.Pbs', return_value=pbs):
+                    for fresh in [False, False, True]:
+                        states = hc.pbs_job_states(None, fresh=fresh)
+                        self.assertEqual([(j.jobid, j.state, j.hosts) for j in states],
+                                         [('123', 'R', 'host1'), ('abc', 'Q', '')])
+                    self.assertEqual(pbs.state.call_count, 2)
+
+                    hc.invalidate_pbs_job_states()
+                    hc.pbs_job_states(None)
+                    self.assertEqual(pbs.state.call_count, 3)
+
+                    # updating the cache doesn't invalidate the cluster index
+                    self.assertEqual(os.listdir(tmpdir), [hc.CLUSTER_CACHE_DIR])
+                    dir_mtime = os.stat(tmpdir).st_mtime
+                    time.sleep(0.01)
+                    hc.pbs_job_states(None, fresh=True)
+                    self.assertEqual(os.stat(tmpdir).st_mtime, dir_mtime)
+        shutil.rmtree(tmpdir)
+
+    def test_node_shape_cache(self):
+        with patch('hod.cluster.cluster_info_dir', return_value='/tmp/hod.d'):
+            with patch.dict(os.environ, {hc.NODE_SHAPE_TTL_ENV: '60'}):
+                cache = hc.node_shape_cache()
+        self.assertEqual(cache.path, os.path.join('/tmp/hod.d', hc.CLUSTER_CACHE_DIR, hc.NODE_SHAPE_CACHE_FILE))
+        self.assertEqual(cache.ttl, 60)
+        self.assertEqual(cache.max_stale, hc.DEFAULT_NODE_SHAPE_MAX_STALE)
+
     def test_find_pbsjob(self):
         expected = PbsJob('123', 'R', 'host')
         self.assertEqual(expected.jobid, hc._find_pbsjob('123', [PbsJob('123', 'R', 'host'), PbsJob('abc', 'Q', '')]).jobid)
@@ -135,9 +232,20 @@ class TestCluster(unittest.TestCase):
         workdir_file = StringIO()
         with patch('hod.cluster.cluster_jobid', side_effect=lambda lbl: dict(banana='123', apple='abc')[lbl]):
             with patch('os.makedirs'):
-                with patch('__builtin__.open', side_effect=_mock_open(jobid=jobid_file, workdir=workdir_file)):
-                    hc.mk_cluster_info('banana', jobs[0].jobid, 'workdir')
-                    self.assertEqual(jobid_file.getvalue(), '123')
+                with patch('hod.cluster._updated_cluster_index'):
+                    with patch('__builtin__.open', side_effect=_mock_open(jobid=jobid_file, workdir=workdir_file)):
+                        hc.mk_cluster_info('banana', jobs[0].jobid, 'workdir')
+                        self.assertEqual(jobid_file.getvalue(), '123')
+
+    def test_mk_cluster_infos(self):
+        tmpdir = tempfile.mkdtemp()
+        with patch('hod.cluster.cluster_info_dir', return_value=tmpdir):
+            with patch('hod.cluster._write_cluster_index', side_effect=hc._write_cluster_index) as write_index:
+                hc.mk_cluster_infos([('banana', '123.master', '/tmp'), (None, '124.master', '/tmp')])
+                self.assertEqual(write_index.call_count, 1)
+            self.assertEqual(['124.master', 'banana'], hc.known_cluster_labels())
+            self.assertEqual('123.master', open(os.path.join(tmpdir, 'banana', 'jobid')).read())
+        shutil.rmtree(tmpdir)
 
     def test_save_cluster_info(self):
         env_file = StringIO()
@@ -157,16 +265,17 @@ class TestCluster(unittest.TestCase):
             with patch('hod.cluster.cluster_info_exists', return_value=False):
                 with patch('hod.cluster.generate_cluster_env_script', return_value='my script'):
                     with patch('os.makedirs'):
-                        with patch('__builtin__.open',
-                                side_effect=_mock_open(jobid=jobid_file, env=env_file, workdir=workdir_file)):
-                            hc.save_cluster_info(dict(label='banana', hadoop_conf_dir='hadoop',
-                                hod_localworkdir='localworkdir', modules='', workdir=''))
-                            self.assertTrue(env_file.getvalue(), 'my script')
+                        with patch('hod.cluster._updated_cluster_index'):
+                            with patch('__builtin__.open',
+                                    side_effect=_mock_open(jobid=jobid_file, env=env_file, workdir=workdir_file)):
+                                hc.save_cluster_info(dict(label='banana', hadoop_conf_dir='hadoop',
+                                    hod_localworkdir='localworkdir', modules='', workdir=''))
+                                self.assertTrue(env_file.getvalue(), 'my script')
 
     def test_validate_hodconf_or_dist(self):
-        with patch('hod.cluster.resolve_config_paths'):
+        with patch('hod.config.config.resolve_config_paths'):
             self.assertTrue(hc.validate_hodconf_or_dist('a', 'b'))
-        with patch('hod.cluster.resolve_config_paths', side_effect=ValueError):
+        with patch('hod.config.config.resolve_config_paths', side_effect=ValueError):
             self.assertFalse(hc.validate_hodconf_or_dist('a', 'b'))
 
     def test_report_cluster_submission_with_label(self):
@@ -199,3 +308,21 @@ class TestCluster(unittest.TestCase):
             self.assertEqual(out, "Job submitted: Jobid 123 state R ehosts host\n")
             self.assertEqual(err, "Warning: More than one job found: ['123', '124']\n")
 
+    def test_post_jobs_submission(self):
+        jobs = [PbsJob('123', 'Q', ''), PbsJob('124', 'R', 'host')]
+        submitted = [('apple', '123', 'workdir'), ('banana', '124', 'workdir')]
+        with patch('hod.cluster.invalidate_pbs_job_states'):
+            with patch('hod.cluster.pbs_job_states', return_value=jobs) as job_states:
+                with patch('hod.cluster.mk_cluster_infos') as mk_cluster_infos:
+                    with capture(hc.post_jobs_submission, submitted, 'options') as (out, err):
+                        self.assertEqual(out, "Job submitted: Jobid 123 state Q ehosts \n"
+                                              "Job submitted: Jobid 124 state R ehosts host\n")
+                        self.assertEqual(err, '')
+                    job_states.assert_called_once_with('options', fresh=True)
+                    mk_cluster_infos.assert_called_once_with(submitted)
+
+                # submission of one of the clusters failed
+                submitted.append(('cherry', None, 'workdir'))
+                with patch('hod.cluster.mk_cluster_infos') as mk_cluster_infos:
+                    self.assertRaises(SystemExit, hc.post_jobs_submission, submitted, 'options')
+                    mk_cluster_infos.assert_called_once_with(submitted[:2])
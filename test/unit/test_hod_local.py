@@ -25,12 +25,17 @@
 @author Ewan Higgs (Universiteit Gent)
 '''
 
+import os
+import shutil
+import tempfile
+
 from vsc.utils.testing import EnhancedTestCase
 
 from mock import patch, Mock
 
 import hod.local as hl
 import hod.mpiservice as hm
+import hod.timeline as ht
 
 class TestHodLocal(EnhancedTestCase):
     def test_local_no_args(self):
@@ -47,3 +52,14 @@ class TestHodLocal(EnhancedTestCase):
     def test_slave_rank(self):
         with patch('mpi4py.MPI.COMM_WORLD', Mock(rank=hm.MASTERRANK + 1)):
             self.assertErrorRegex(SystemExit, '1', hl.main, [])
+
+    def test_failed_rank_timeline(self):
+        tmpdir = tempfile.mkdtemp()
+        with patch('mpi4py.MPI.COMM_WORLD', Mock(rank=hm.MASTERRANK + 1)):
+            with patch.dict(os.environ, {'PBS_JOBID': '123.master'}):
+                with patch('hod.local.setup_tasks', side_effect=RuntimeError('failed')):
+                    self.assertErrorRegex(SystemExit, '1', hl.main, ['--workdir=%s' % tmpdir])
+        records = ht.read_timeline(os.path.join(tmpdir, 'hod', '123.master', ht.RANK_TIMELINE_FILE % 1))
+        self.assertTrue('imports' in [record['phase'] for record in records])
+        self.assertEqual(set([record['rank'] for record in records]), set([1]))
+        shutil.rmtree(tmpdir)
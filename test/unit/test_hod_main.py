@@ -25,8 +25,12 @@
 @author Ewan Higgs (Universiteit Gent)
 '''
 
+import os
+import subprocess
+import sys
 import unittest
 
+import hod
 import hod.main as hm
 import hod.subcommands.dists
 
@@ -65,3 +69,44 @@ class TestHodMain(unittest.TestCase):
         cmd, opts = hm.init_subcmd(['hod', 'dists', '--someoptions'])
         self.assertTrue(isinstance(cmd, hod.subcommands.dists.DistsSubCommand))
         self.assertEqual(opts, None)
+
+    def test_subcommand_specs(self):
+        # the registry matches the subcommand classes
+        for spec in hm.SUBCOMMANDS:
+            subcmd_class = hm.subcommand_class(spec.cmd)
+            self.assertEqual(subcmd_class.__name__, spec.classname)
+            self.assertEqual(subcmd_class.CMD, spec.cmd)
+            self.assertEqual(subcmd_class.HELP, spec.help)
+
+    def _imported_modules(self, code):
+        """Run code in a new python process; return its output and the modules it imported."""
+        code = "import sys; %s; sys.stderr.write(' '.join(sys.modules))" % code
+        topdir = os.path.dirname(os.path.dirname(os.path.abspath(hod.__file__)))
+        proc = subprocess.Popen([sys.executable, '-c', code], cwd=topdir, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        self.assertEqual(proc.returncode, 0)
+        return out, err.split()
+
+    def test_help_imports(self):
+        # 'hod --help' doesn't import any of the subcommands (and what they depend on)
+        out, modules = self._imported_modules("import hod.main; hod.main.main(['hod', '--help'])")
+        self.assertTrue('Available subcommands' in out)
+        self.assertEqual([m for m in modules if m.startswith('hod.subcommands')], [])
+        for module in ['hod.config.config', 'hod.rmscheduler.rm_pbs', 'mpi4py', 'pkg_resources']:
+            self.assertFalse(module in modules, "%s imported by 'hod --help'" % module)
+
+    def test_subcommand_imports(self):
+        # the base class of the subcommands doesn't import the job submission stack
+        _, modules = self._imported_modules("import hod.subcommands.subcommand")
+        for module in ['hod.cluster', 'hod.options', 'hod.rmscheduler.hodjob']:
+            self.assertFalse(module in modules, "%s imported by hod.subcommands.subcommand" % module)
+
+    def test_list_imports(self):
+        # 'hod list' doesn't import the config stack, the node discovery or the resource manager
+        # (hod.main keeps fancylogger from importing mpi4py, which is what is done here as well)
+        code = "import os; os.environ['FANCYLOGGER_IGNORE_MPI4PY'] = '1'; import hod.subcommands.listcmd"
+        _, modules = self._imported_modules(code)
+        for module in ['hod.config.config', 'hod.node.node', 'netifaces', 'netaddr', 'hod.rmscheduler.rm_pbs',
+                       'hod.rmscheduler.hodjob', 'mpi4py']:
+            self.assertFalse(module in modules, "%s imported by hod.subcommands.listcmd" % module)
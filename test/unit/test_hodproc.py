@@ -28,6 +28,7 @@
 import unittest
 from mock import patch, Mock
 from cStringIO import StringIO
+from cPickle import dumps, loads, HIGHEST_PROTOCOL
 import hod.hodproc as hh
 from hod.subcommands.create import CreateOptions
 from hod.config.template import TemplateResolver
@@ -88,6 +89,9 @@ class TestHodProcConfiguredMaster(unittest.TestCase):
         self.assertEqual(autogen_config.call_count, 1)
         self.assertTrue('Python-2.7.9-intel-2015a' in cm.tasks[0].config_opts.modules)
         self.assertTrue('Spark/1.3.0' in cm.tasks[0].config_opts.modules)
+        # config for the slaves is taken before autogen and can be sent over
+        self.assertTrue('Spark/1.3.0' in cm.config.modules)
+        self.assertEqual(loads(dumps(cm.config, HIGHEST_PROTOCOL)).modules, cm.config.modules)
 
     def test_configured_slave_distribution(self):
         opts = CreateOptions(go_args=['progname', '--hodconf', 'hod.conf',
@@ -105,6 +109,28 @@ class TestHodProcConfiguredMaster(unittest.TestCase):
         self.assertTrue(autogen_config.called)
         self.assertEqual(autogen_config.call_count, 1)
 
+    def test_configured_slave_distribution_config(self):
+        opts = CreateOptions(go_args=['progname', '--hodconf', 'hod.conf'])
+        config = Mock()
+        cm = hh.ConfiguredSlave(opts.options)
+        with patch('hod.hodproc._setup_config_paths', side_effect=None):
+            with patch('hod.hodproc._setup_template_resolver', side_effect=None):
+                with patch('hod.hodproc.load_hod_config', side_effect=None) as load_hod_config:
+                    cm.distribution(config=config)
+        self.assertFalse(load_hod_config.called) # config from master is used
+        self.assertTrue(config.autogen_configs.called)
+
+    def test_default_start_order(self):
+        configs = [Mock(after=[], requires=[]) for _ in range(3)]
+        for idx, cfg in enumerate(configs):
+            cfg.name = 'svc%d' % idx
+        hh._default_start_order(configs)
+        self.assertEqual([cfg.after for cfg in configs], [[], ['svc0'], ['svc1']])
+
+        configs = [Mock(after=[], requires=[]), Mock(after=['x'], requires=[]), Mock(after=[], requires=[])]
+        hh._default_start_order(configs)
+        self.assertEqual([cfg.after for cfg in configs], [[], ['x'], []])
+
     def test_script_output_paths_nolabel(self):
         out, err = hh._script_output_paths('script_name')
         self.assertEqual(out, '$PBS_O_WORKDIR/hod-script_name.o${PBS_JOBID}')
@@ -0,0 +1,170 @@
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+# #
+"""
+Tests for the resource usage of the services.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import hod.monitor as hmon
+
+
+NET_DEV = """Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo: %(lo)d     10    0    0    0     0          0         0 %(lo)d     10    0    0    0     0       0          0
+  eth0: %(rx)d     10    0    0    0     0          0         0 %(tx)d     10    0    0    0     0       0          0
+"""
+
+
+class TestMonitor(unittest.TestCase):
+    """Tests for hod.monitor."""
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.proc = os.path.join(self.tmpdir, 'proc')
+        os.mkdir(self.proc)
+        self.net_dev = os.path.join(self.tmpdir, 'net_dev')
+        self.write_net_dev(0, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_net_dev(self, rx, tx):
+        with open(self.net_dev, 'w') as fh:
+            fh.write(NET_DEV % dict(lo=123456, rx=rx, tx=tx))
+
+    def write_process(self, pid, env, utime, stime, rss, read_bytes=0, write_bytes=0):
+        '''Write fake /proc entries for a process.'''
+        piddir = os.path.join(self.proc, str(pid))
+        if not os.path.exists(piddir):
+            os.mkdir(piddir)
+        with open(os.path.join(piddir, 'environ'), 'w') as fh:
+            fh.write('\0'.join(['%s=%s' % item for item in env.items()]) + '\0')
+        fields = ['S'] + ['0'] * 10 + [str(utime), str(stime)] + ['0'] * 8 + [str(rss)] + ['0'] * 20
+        with open(os.path.join(piddir, 'stat'), 'w') as fh:
+            fh.write('%d (java (main)) %s\n' % (pid, ' '.join(fields)))
+        with open(os.path.join(piddir, 'io'), 'w') as fh:
+            fh.write('rchar: 1\nwchar: 1\nread_bytes: %d\nwrite_bytes: %d\n' % (read_bytes, write_bytes))
+
+    def test_process_service(self):
+        self.write_process(10, {'HOD_SERVICE': 'datanode', 'PBS_JOBID': '123.master'}, 0, 0, 0)
+        self.write_process(11, {'PBS_JOBID': '123.master'}, 0, 0, 0)
+        self.assertEqual(hmon.process_service(10, proc=self.proc), 'datanode')
+        self.assertEqual(hmon.process_service(10, jobid='123.master', proc=self.proc), 'datanode')
+        self.assertEqual(hmon.process_service(10, jobid='456.master', proc=self.proc), None)
+        self.assertEqual(hmon.process_service(11, proc=self.proc), None)
+        self.assertEqual(hmon.process_service(12, proc=self.proc), None)
+
+    def test_process_counters(self):
+        ticks = os.sysconf('SC_CLK_TCK')
+        self.write_process(10, {}, ticks, 2 * ticks, 100, read_bytes=5, write_bytes=7)
+        self.assertEqual(hmon.process_counters(10, proc=self.proc), [3.0, 100 * os.sysconf('SC_PAGE_SIZE'), 5, 7])
+        self.assertEqual(hmon.process_counters(12, proc=self.proc), None)
+
+    def test_process_counters_self(self):
+        counters = hmon.process_counters(os.getpid())
+        self.assertEqual(len(counters), 4)
+        self.assertTrue(counters[1] > 0)
+
+    def test_net_counters(self):
+        self.write_net_dev(1000, 2000)
+        self.assertEqual(hmon.net_counters(self.net_dev), [1000, 2000])
+        self.assertEqual(hmon.net_counters(os.path.join(self.tmpdir, 'nosuchfile')), [0, 0])
+
+    def test_sampler(self):
+        ticks = os.sysconf('SC_CLK_TCK')
+        env = {'HOD_SERVICE': 'datanode', 'PBS_JOBID': '123.master'}
+        self.write_process(10, env, ticks, 0, 10, read_bytes=1000)
+        self.write_process(11, {'PBS_JOBID': '123.master'}, ticks, 0, 10)
+        sampler = hmon.ServiceSampler(3, jobid='123.master', proc=self.proc, net_dev=self.net_dev)
+
+        # process 10 used another second of CPU, and a new process of the service was started
+        self.write_process(10, env, 2 * ticks, 0, 10, read_bytes=1500, write_bytes=200)
+        self.write_process(12, dict(env, HOD_SERVICE='regionserver'), 0, ticks, 20)
+        self.write_net_dev(4096, 1024)
+        sample = sampler.sample()
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        self.assertEqual(sample['rank'], 3)
+        self.assertTrue(sample['interval'] >= 0)
+        self.assertEqual(sample['services'], {
+            'datanode': [1, 1.0, 10 * page_size, 500, 200],
+            'regionserver': [1, 1.0, 20 * page_size, 0, 0],
+        })
+        self.assertEqual(sample['net'], [4096, 1024])
+
+        # processes which are gone are no longer counted
+        shutil.rmtree(os.path.join(self.proc, '12'))
+        sample = sampler.sample()
+        self.assertEqual(sample['services'], {'datanode': [1, 0.0, 10 * page_size, 0, 0]})
+        self.assertEqual(sample['net'], [0, 0])
+
+    def test_sampler_children(self):
+        '''Processes started by a service process are part of the service.'''
+        env = dict(os.environ, HOD_SERVICE='sleeper')
+        proc = subprocess.Popen(['sh', '-c', 'sleep 5 & wait'], env=env)
+        try:
+            sampler = hmon.ServiceSampler(0)
+            sample = sampler.sample()
+            self.assertTrue(sample['services']['sleeper'][hmon.PROCS] >= 1)
+        finally:
+            proc.kill()
+            proc.wait()
+
+    def test_cluster_usage(self):
+        path = os.path.join(self.tmpdir, 'top')
+        usage = hmon.ClusterUsage(path)
+        usage.update({'rank': 1, 'host': 'node2', 'time': 1000.0, 'interval': 10.0,
+                      'services': {'datanode': [2, 5.0, 2048, 10240, 0]}, 'net': [1024, 2048]})
+        usage.update({'rank': 0, 'host': 'node1', 'time': 1001.0, 'interval': 10.0,
+                      'services': {'datanode': [1, 20.0, 1024, 0, 0], 'namenode': [1, 1.0, 1024 ** 3, 0, 5 * 1024 ** 2]},
+                      'net': [0, 0]})
+        usage.write()
+        top = hmon.read_usage(path)
+        self.assertEqual([sample['rank'] for sample in top['samples']], [0, 1])
+
+        self.assertEqual(hmon.node_rows(top, now=1011.0), [
+            ['node1', '0', '2', '210%', '1.0G', '0B/s', '512.0K/s', '0B/s', '0B/s', '10s'],
+            ['node2', '1', '2', '50%', '2.0K', '1.0K/s', '0B/s', '102B/s', '204B/s', '11s'],
+        ])
+        self.assertEqual(hmon.service_rows(top), [
+            ['datanode', '2', '3', '250%', '3.0K', '1.0K/s', '0B/s'],
+            ['namenode', '1', '1', '10%', '1.0G', '0B/s', '512.0K/s'],
+        ])
+        out = hmon.format_usage(top)
+        self.assertTrue(out.startswith('HOST'))
+        self.assertTrue('\nSERVICE' in out)
+
+        usage.remove()
+        self.assertFalse(os.path.exists(path))
+        usage.remove()
+
+    def test_monitor(self):
+        monitor = hmon.ServiceMonitor(0, interval=60)
+        self.assertTrue(55 < monitor.due() <= 60)
+        self.assertEqual(monitor.usage, None)
+        monitor.sample()
+        self.assertTrue(monitor.due() > 55)
@@ -26,10 +26,11 @@
 '''
 
 import pytest
+import threading
 import unittest
 import hod.mpiservice as hm
 
-from mock import sentinel
+from mock import sentinel, Mock, patch
 from hod.config.template import ConfigTemplate
 
 class MPIServiceTestCase(unittest.TestCase):
@@ -76,6 +77,26 @@ class MPIServiceTestCase(unittest.TestCase):
         ms = hm.MpiService()
         hm._make_comm_group(ms.comm, range(1))
 
+    def test_comm_pool(self):
+        '''test communicators are shared between tasks on the same ranks'''
+        with patch('hod.mpiservice._make_comm_group', side_effect=[sentinel.master, sentinel.all]) as mk:
+            pool = hm.CommPool(sentinel.comm)
+            self.assertEqual(pool.get([0]), sentinel.master)
+            self.assertEqual(pool.get([0, 1, 2]), sentinel.all)
+            self.assertEqual(pool.get([0]), sentinel.master)
+            self.assertEqual(pool.get([2, 1, 0]), sentinel.all)
+        self.assertEqual(mk.call_count, 2)
+        self.assertEqual(len(pool), 2)
+
+    def test_comm_pool_free(self):
+        '''test freeing the pooled communicators'''
+        ms = hm.MpiService()
+        pool = hm.CommPool(ms.comm)
+        comm = pool.get([0])
+        self.assertTrue(pool.get([0]) is comm)
+        pool.free()
+        self.assertEqual(len(pool), 0)
+
     def test_mpiservice_distribution(self):
         '''test mpiservice distribution'''
         ms = hm.MpiService()
@@ -130,3 +151,102 @@ class MPIServiceTestCase(unittest.TestCase):
         ms = hm.MpiService()
         ms.distribution()
         ms. run_dist()
+
+    def test_task_waves(self):
+        '''test grouping tasks in waves which can start concurrently'''
+        def mktask(name, after=None, requires=None):
+            return hm.Task(None, name, [0], Mock(after=after or [], requires=requires or []), None)
+        tasks = [
+            mktask('zookeeper'),
+            mktask('namenode'),
+            mktask('datanode', after=['namenode']),
+            mktask('hbase-master', after=['zookeeper'], requires=['datanode']),
+            mktask('regionserver', after=['hbase-master', 'not-here']),
+            mktask('screen'),
+        ]
+        self.assertEqual(hm._task_waves(tasks), [[0, 1, 5], [2], [3], [4]])
+        self.assertEqual(hm._task_waves([]), [])
+
+    def test_task_waves_errors(self):
+        '''test unknown required services and dependency cycles'''
+        def mktask(name, after=None, requires=None):
+            return hm.Task(None, name, [0], Mock(after=after or [], requires=requires or []), None)
+        self.assertRaises(ValueError, hm._task_waves, [mktask('a', requires=['b'])])
+        self.assertRaises(ValueError, hm._task_waves, [mktask('a', after=['b']), mktask('b', after=['a'])])
+
+    def test_run_concurrently(self):
+        '''test running calls in parallel threads'''
+        started = threading.Event()
+        calls = []
+        def first():
+            # only finishes if second runs at the same time
+            self.assertTrue(started.wait(5))
+            calls.append('first')
+        def second():
+            started.set()
+            calls.append('second')
+        hm._run_concurrently([first, second])
+        self.assertEqual(calls, ['second', 'first'])
+
+        def fail():
+            raise RuntimeError('failed')
+        self.assertRaises(RuntimeError, hm._run_concurrently, [second, fail])
+
+    def _fake_svc(self, rank, spread):
+        '''Make a service on rank with a comm which broadcasts through the spread list'''
+        svc = Mock(rank=rank, size=2, tasks=None, config=None)
+        def bcast(obj=None, root=0):
+            if rank == root:
+                spread.append(obj)
+                return obj
+            return spread.pop(0)
+        svc.comm.bcast.side_effect = bcast
+        return svc
+
+    def test_setup_tasks(self):
+        '''test master sends the plan in a single broadcast'''
+        spread = []
+        master = self._fake_svc(hm.MASTERRANK, spread)
+        def distribution(*args):
+            master.tasks = [sentinel.task]
+            master.config = sentinel.config
+        master.distribution.side_effect = distribution
+        with patch('hod.mpiservice.master_template_opts', return_value=[sentinel.template]):
+            hm.setup_tasks(master)
+        master.distribution.assert_called_once_with(sentinel.template)
+        self.assertEqual(master.comm.bcast.call_count, 1)
+        self.assertFalse(master.comm.barrier.called)
+        self.assertEqual(spread, [hm.ClusterPlan(hm.PLAN_VERSION, [sentinel.template], sentinel.config,
+                                                 [sentinel.task])])
+
+        slave = self._fake_svc(1, spread)
+        hm.setup_tasks(slave)
+        self.assertEqual(slave.comm.bcast.call_count, 1)
+        self.assertEqual(slave.tasks, [sentinel.task])
+        slave.distribution.assert_called_once_with(sentinel.template, config=sentinel.config)
+
+    def test_setup_tasks_bad_plan(self):
+        '''test slaves fail on a missing or mismatching plan'''
+        spread = [None, hm.ClusterPlan(hm.PLAN_VERSION + 1, [], None, [])]
+        slave = self._fake_svc(1, spread)
+        self.assertRaises(RuntimeError, hm.setup_tasks, slave)
+        self.assertRaises(RuntimeError, hm.setup_tasks, slave)
+        self.assertFalse(slave.distribution.called)
+
+    def test_setup_tasks_master_fails(self):
+        '''test master releases the slaves if the distribution fails'''
+        spread = []
+        master = self._fake_svc(hm.MASTERRANK, spread)
+        master.distribution.side_effect = IOError('no such file')
+        with patch('hod.mpiservice.master_template_opts', return_value=[]):
+            self.assertRaises(IOError, hm.setup_tasks, master)
+        self.assertEqual(spread, [None])
+
+    def test_setup_tasks_single_node(self):
+        '''test nothing is sent when there are no slaves'''
+        master = self._fake_svc(hm.MASTERRANK, [])
+        master.size = 1
+        with patch('hod.mpiservice.master_template_opts', return_value=[]):
+            hm.setup_tasks(master)
+        self.assertTrue(master.distribution.called)
+        self.assertFalse(master.comm.bcast.called)
@@ -0,0 +1,135 @@
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+# #
+"""
+Tests for the event driven supervision of work.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+from mock import patch
+from mpi4py import MPI
+
+import hod.dirwatch as hd
+import hod.monitor as hmon
+import hod.supervisor as hs
+import hod.mpiservice as hm
+
+
+class FakeWork(object):
+    '''Work which is over when a force_stop file shows up in its controldir.'''
+    def __init__(self, controldir, max_age=3600):
+        self.controldir = controldir
+        self.deadline = time.time() + max_age
+        self.stopped = False
+
+    def work_deadline(self):
+        return self.deadline
+
+    def do_work_wait(self):
+        return time.time() >= self.deadline or os.path.exists(os.path.join(self.controldir, 'force_stop'))
+
+    def do_work_stop(self):
+        self.stopped = True
+
+
+class TestSupervisor(unittest.TestCase):
+    '''Tests for hod.supervisor and hod.dirwatch'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_dirwatcher(self):
+        watcher = hd.DirWatcher([self.tmpdir])
+        self.assertFalse(watcher.changed())
+        open(os.path.join(self.tmpdir, 'force_stop'), 'w').close()
+        self.assertTrue(watcher.wait(5))
+        self.assertFalse(watcher.changed())
+        watcher.close()
+
+    def test_supervisor_no_work(self):
+        hs.Supervisor(MPI.COMM_WORLD, [], hm.MASTERRANK).run()
+
+    def test_supervisor_force_stop(self):
+        work = FakeWork(self.tmpdir)
+        force_stop = lambda: open(os.path.join(self.tmpdir, 'force_stop'), 'w').close()
+        timer = threading.Timer(0.2, force_stop)
+        start = time.time()
+        timer.start()
+        hs.Supervisor(MPI.COMM_WORLD, [work], hm.MASTERRANK).run()
+        self.assertTrue(work.stopped)
+        self.assertTrue(time.time() - start < 5)
+
+    def test_supervisor_max_age(self):
+        work = FakeWork(self.tmpdir, max_age=0.2)
+        hs.Supervisor(MPI.COMM_WORLD, [work], hm.MASTERRANK).run()
+        self.assertTrue(work.stopped)
+
+    def test_next_timeout_passed_deadline(self):
+        '''Work which is kept running after its maximum age doesn't make the supervisor spin.'''
+        work = FakeWork(self.tmpdir, max_age=-10)
+        supervisor = hs.Supervisor(MPI.COMM_WORLD, [work], hm.MASTERRANK, poll_interval=0.5)
+        self.assertEqual(supervisor._next_timeout(), 0.5)
+        supervisor.watcher.close()
+
+        other = FakeWork(self.tmpdir, max_age=0.2)
+        supervisor = hs.Supervisor(MPI.COMM_WORLD, [work, other], hm.MASTERRANK, poll_interval=0.5)
+        self.assertTrue(0 < supervisor._next_timeout() <= 0.2)
+        supervisor.watcher.close()
+
+    def test_next_timeout_control_check(self):
+        '''Control files created from another node are noticed, even if inotify is used.'''
+        work = FakeWork(self.tmpdir, max_age=3600)
+        supervisor = hs.Supervisor(MPI.COMM_WORLD, [work], hm.MASTERRANK, poll_interval=0.5)
+        with patch.object(supervisor.watcher, 'fileno', return_value=42):
+            self.assertEqual(supervisor._next_timeout(), hs.CONTROL_CHECK_INTERVAL)
+        supervisor.watcher.close()
+
+    def test_supervisor_sigchld(self):
+        '''A child process exiting wakes up the supervisor.'''
+        work = FakeWork(self.tmpdir, max_age=10)
+        proc = subprocess.Popen(['sleep', '0.2'])
+        work.do_work_wait = lambda: proc.poll() is not None
+        start = time.time()
+        hs.Supervisor(MPI.COMM_WORLD, [work], hm.MASTERRANK).run()
+        self.assertTrue(work.stopped)
+        self.assertTrue(time.time() - start < 5)
+
+    def test_supervisor_monitor(self):
+        '''The master writes the resource usage while the work is running.'''
+        path = os.path.join(self.tmpdir, 'top')
+        monitor = hmon.ServiceMonitor(hm.MASTERRANK, path=path, interval=0.1)
+        work = FakeWork(self.tmpdir, max_age=0.5)
+        hs.Supervisor(MPI.COMM_WORLD, [work], hm.MASTERRANK, monitor=monitor).run()
+        self.assertTrue(work.stopped)
+        usage = hmon.read_usage(path)
+        self.assertEqual([sample['rank'] for sample in usage['samples']], [hm.MASTERRANK])
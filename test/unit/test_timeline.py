@@ -0,0 +1,120 @@
+# #
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+# #
+"""
+Tests for the startup timeline.
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import Mock, patch
+
+import hod.timeline as ht
+
+
+def _record(rank, phase, start, duration, service=None):
+    record = {'rank': rank, 'host': 'node%d' % rank, 'phase': phase, 'start': start, 'duration': duration}
+    if service is not None:
+        record['service'] = service
+    return record
+
+
+class TestTimeline(unittest.TestCase):
+    """Tests for hod.timeline."""
+    def test_now(self):
+        start = ht.now()
+        time.sleep(0.01)
+        self.assertTrue(ht.now() - start >= 0.01)
+
+    def test_process_start(self):
+        start = ht.process_start()
+        if start is not None:
+            self.assertTrue(start <= ht.now())
+
+    def test_span(self):
+        timeline = ht.Timeline(rank=3)
+        with timeline.span('autogen'):
+            pass
+        timeline.add('start', timeline.origin, service='HDFS')
+        try:
+            with timeline.span('failing'):
+                raise ValueError('failed')
+        except ValueError:
+            pass
+
+        records = timeline.records()
+        self.assertEqual([r['phase'] for r in records], ['autogen', 'start', 'failing'])
+        self.assertEqual([r.get('service') for r in records], [None, 'HDFS', None])
+        self.assertEqual(set([r['rank'] for r in records]), set([3]))
+        self.assertEqual(records[1]['start'], round(timeline.wallclock, 6))
+        self.assertTrue(all([r['duration'] >= 0 for r in records]))
+
+    def test_process_timeline(self):
+        with patch('hod.timeline._TIMELINE', ht.Timeline()):
+            with ht.span('setup-config-paths', service='Yarn'):
+                pass
+            self.assertEqual([(r['phase'], r['service']) for r in ht.process_timeline().records()],
+                             [('setup-config-paths', 'Yarn')])
+
+    def test_gather_timeline(self):
+        with patch('hod.timeline._TIMELINE', ht.Timeline(rank=0)):
+            with ht.span('autogen'):
+                pass
+            comm = Mock(gather=lambda records, root: [records, [_record(1, 'autogen', 0, 1)]])
+            records = ht.gather_timeline(comm, 0)
+            self.assertEqual([(r['rank'], r['phase']) for r in records], [(0, 'autogen'), (1, 'autogen')])
+
+            comm = Mock(gather=lambda records, root: None)
+            self.assertEqual(ht.gather_timeline(comm, 0), None)
+
+    def test_summarize_timeline(self):
+        records = [
+            _record(0, 'autogen', 100.0, 2.0),
+            _record(1, 'autogen', 100.5, 1.0),
+            _record(0, 'barrier', 103.0, 1.0),
+            _record(0, 'barrier', 105.0, 1.0),
+            _record(1, 'barrier', 103.0, 4.0),
+            _record(0, 'start', 102.0, 3.0, service='HDFS'),
+        ]
+        rows = ht.summarize_timeline(records)
+        self.assertEqual(rows, [
+            ['autogen', '-', '2', '1.000', '1.500', '2.000', 'rank 0 (node0)'],
+            ['start', 'HDFS', '1', '3.000', '3.000', '3.000', 'rank 0 (node0)'],
+            ['barrier', '-', '2', '2.000', '3.000', '4.000', 'rank 1 (node1)'],
+            ['total', '-', '2', '6.000', '6.500', '7.000', 'rank 1 (node1)'],
+        ])
+        self.assertEqual(ht.summarize_timeline([]), [])
+
+    def test_report_timeline(self):
+        tmpdir = tempfile.mkdtemp()
+        records = [_record(0, 'autogen', 100.0, 2.0), _record(1, 'autogen', 100.5, 1.0, service='HDFS')]
+        ht.report_timeline(tmpdir, records)
+        self.assertEqual(ht.read_timeline(os.path.join(tmpdir, ht.TIMELINE_FILE)), records)
+        summary = open(os.path.join(tmpdir, ht.TIMELINE_SUMMARY_FILE)).read()
+        self.assertTrue(summary.startswith('PHASE'))
+        self.assertTrue('rank 0 (node0)' in summary)
+        shutil.rmtree(tmpdir)
@@ -26,6 +26,8 @@
 @author: Ewan Higgs
 """
 import os
+import shutil
+import tempfile
 import unittest
 from mock import patch, sentinel
 from cStringIO import StringIO
@@ -56,6 +58,18 @@ ExecStop=echo hello
 [Environment]
     """)
 
+def _mk_scratch_config():
+    return StringIO("""
+[Unit]
+Name=test
+RunsOn=slave
+[Service]
+ExecStart=echo hello
+ExecStop=echo hello
+[Environment]
+TMPDIR=$localscratch/tmp
+    """)
+
 class TestHodWorkConfiguredService(unittest.TestCase):
     '''Test the ConfiguredService'''
 
@@ -76,6 +90,24 @@ class TestHodWorkConfiguredService(unittest.TestCase):
         cs = hwc.ConfiguredService(cfg)
         cs.start_work_service()
 
+    def test_ConfiguredService_invalid_ready_check(self):
+        '''An invalid (resolved) ready check is reported, not waited for'''
+        config = StringIO("""
+[Unit]
+Name=test
+RunsOn=master
+[Service]
+ExecStart=echo hello
+ExecStop=echo hello
+ReadyCheck=tcp:$port
+[Environment]
+    """)
+        cfg = hcc.ConfigOpts.from_file(config, hct.TemplateResolver(workdir='/tmp', port='noport'))
+        cs = hwc.ConfiguredService(cfg)
+        with patch('hod.work.config_service.wait_until_ready') as wait_until_ready:
+            cs.start_work_service()
+        self.assertFalse(wait_until_ready.called)
+
     def test_ConfiguredService_stop_work_service(self):
         '''Test ConfiguredService stop method'''
         cfg = hcc.ConfigOpts.from_file(_mk_master_config(), hct.TemplateResolver(workdir='/tmp'))
@@ -90,3 +122,59 @@ class TestHodWorkConfiguredService(unittest.TestCase):
             with patch('hod.config.template.mklocalworkdir', side_effect=lambda *args, **kwargs: localworkdir):
                 cs.prepare_work_cfg()
         self.assertEqual(cs.controldir, os.path.join(localworkdir, 'controldir'))
+
+    def test_scratch_refcount(self):
+        '''Test the node local scratch is removed once no service uses it'''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            scratch = os.path.join(tmpdir, 'hod', '123', 'user.host.1')
+            hwc.acquire_scratch(scratch)
+            hwc.acquire_scratch(scratch)
+            self.assertTrue(os.path.isdir(scratch))
+            hwc.release_scratch(scratch)
+            self.assertTrue(os.path.isdir(scratch))
+            hwc.release_scratch(scratch)
+            self.assertFalse(os.path.exists(scratch))
+            # releasing an unknown directory is harmless
+            hwc.release_scratch(scratch)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_ConfiguredService_scratch_cleanup(self):
+        '''Test the node local scratch is cleaned up when the services stop'''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            localworkdir = os.path.join(tmpdir, 'localworkdir')
+            scratch = os.path.join(tmpdir, 'scratch')
+            def mklocalworkdir(base):
+                return scratch if base == '/local' else localworkdir
+            def resolver():
+                reg = hct.TemplateRegistry()
+                reg.register(hct.ConfigTemplate('workdir', tmpdir, ''))
+                reg.register(hct.ConfigTemplate('localscratch', lambda: hct.mklocalscratch(tmpdir), ''))
+                return hct.TemplateResolver.from_registry(reg)
+            with patch('hod.config.template.mklocalworkdir', side_effect=mklocalworkdir):
+                with patch('hod.config.template.is_shared_filesystem', return_value=True):
+                    with patch.dict(hct._LOCAL_SCRATCH, clear=True):
+                        with patch('hod.config.template.local_scratch', return_value='/local') as local_scratch:
+                            # the node local scratch is only selected if it is used
+                            cfg = hcc.ConfigOpts.from_file(_mk_slave_config(), resolver())
+                            cs = hwc.ConfiguredService(cfg)
+                            cs.prepare_work_cfg()
+                            self.assertEqual(local_scratch.call_count, 0)
+                            self.assertFalse(os.path.exists(scratch))
+
+                            services = []
+                            for _ in range(2):
+                                cfg = hcc.ConfigOpts.from_file(_mk_scratch_config(), resolver())
+                                cs = hwc.ConfiguredService(cfg)
+                                cs.prepare_work_cfg()
+                                services.append(cs)
+                            self.assertTrue(os.path.isdir(scratch))
+                            services[0].stop_work_service()
+                            self.assertTrue(os.path.isdir(scratch))
+                            services[1].stop_work_service()
+                            self.assertFalse(os.path.exists(scratch))
+                            self.assertTrue(os.path.isdir(localworkdir))
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,101 @@
+###
+# Copyright 2009-2016 Ghent University
+#
+# This file is part of hanythingondemand
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/hanythingondemand
+#
+# hanythingondemand is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# hanythingondemand is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hanythingondemand. If not, see <http://www.gnu.org/licenses/>.
+###
+"""
+Tests for the readiness checks of services.
+"""
+import os
+import socket
+import urllib2
+from mock import patch
+
+from vsc.utils.testing import EnhancedTestCase
+
+import hod.work.ready_check as hwr
+
+
+class TestReadyCheck(EnhancedTestCase):
+    """Tests for ready checks."""
+
+    def test_parse_ready_check(self):
+        self.assertEqual(hwr.parse_ready_check('tcp:node1:8032'), ('tcp', 'node1:8032'))
+        self.assertEqual(hwr.parse_ready_check('http://node1:8088/ws'), ('http', 'http://node1:8088/ws'))
+        self.assertEqual(hwr.parse_ready_check('file: /tmp/ready'), ('file', '/tmp/ready'))
+        self.assertEqual(hwr.parse_ready_check('cmd:hdfs dfsadmin -report'), ('cmd', 'hdfs dfsadmin -report'))
+        self.assertRaises(ValueError, hwr.parse_ready_check, 'node1:8032')
+        self.assertRaises(ValueError, hwr.parse_ready_check, 'tcp:node1')
+        self.assertRaises(ValueError, hwr.parse_ready_check, '/tmp/ready')
+        self.assertRaises(ValueError, hwr.parse_ready_check, 'tcp:$host:$port')
+
+    def test_ready_check_kind(self):
+        self.assertEqual(hwr.ready_check_kind('tcp:$host:$port'), 'tcp')
+        self.assertEqual(hwr.ready_check_kind('HTTP://$host:8088/ws'), 'http')
+        self.assertRaises(ValueError, hwr.ready_check_kind, 'port:8032')
+        self.assertRaises(ValueError, hwr.ready_check_kind, '/tmp/ready')
+
+    def test_check_tcp(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(1)
+        port = sock.getsockname()[1]
+        self.assertTrue(hwr._check_tcp('127.0.0.1:%d' % port, 1, None))
+        sock.close()
+        self.assertFalse(hwr._check_tcp('127.0.0.1:%d' % port, 1, None))
+
+    def test_check_http(self):
+        with patch('hod.work.ready_check.urllib2.urlopen') as urlopen:
+            self.assertTrue(hwr._check_http('http://node1:8088', 1, None))
+            urlopen.assert_called_with('http://node1:8088', timeout=1)
+            urlopen.side_effect = urllib2.URLError('connection refused')
+            self.assertFalse(hwr._check_http('http://node1:8088', 1, None))
+
+    def test_check_file(self):
+        path = os.path.join(self.tmpdir, 'ready')
+        self.assertFalse(hwr._check_file(path, 1, None))
+        open(path, 'w').close()
+        self.assertTrue(hwr._check_file(path, 1, None))
+
+    def test_check_cmd(self):
+        self.assertTrue(hwr._check_cmd('true', 5, None))
+        self.assertFalse(hwr._check_cmd('false', 5, None))
+
+    def test_wait_until_ready(self):
+        path = os.path.join(self.tmpdir, 'ready')
+        calls = []
+        def check(target, timeout, env):
+            calls.append(target)
+            if len(calls) == 3:
+                open(path, 'w').close()
+            return hwr._check_file(target, timeout, env)
+
+        with patch.dict(hwr.READY_CHECKS, file=check):
+            with patch('hod.work.ready_check.time.sleep') as sleep:
+                self.assertTrue(hwr.wait_until_ready('file:%s' % path, timeout=10))
+        self.assertEqual(len(calls), 3)
+        # the interval between checks doubles
+        self.assertEqual([c[0][0] for c in sleep.call_args_list], [0.1, 0.2])
+
+    def test_wait_until_ready_timeout(self):
+        path = os.path.join(self.tmpdir, 'never')
+        self.assertFalse(hwr.wait_until_ready('file:%s' % path, timeout=0.3))